@@ -0,0 +1,6 @@
+"""
+Benchmarks for the ChatBridge packet hot path. Not shipped with the plugin
+
+Run the whole suite with ``python -m benchmark``, see :mod:`benchmark.suite`,
+or a single benchmark module with ``python -m benchmark.<module>``, in the repository root
+"""
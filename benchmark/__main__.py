@@ -0,0 +1,3 @@
+from benchmark.suite import main
+
+main()
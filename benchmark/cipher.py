@@ -0,0 +1,43 @@
+"""
+Encrypt + decrypt throughput of the legacy AES-CBC cipher and the AEAD ciphers, on payloads of different sizes
+"""
+import random
+import string
+
+from benchmark.codec import measure
+from chatbridge.core.network import cryptor
+from chatbridge.core.network.cryptor import AESCryptor
+
+PAYLOAD_SIZES = (100, 1000, 16000)
+HEADER = b'\x03\x00\x00\x00\x00\x00'
+
+
+def main():
+	aes_cryptor = AESCryptor('ThisIsTheSecret')
+	rnd = random.Random(0)
+	payloads = {size: ''.join(rnd.choice(string.printable) for _ in range(size)).encode('utf8') for size in PAYLOAD_SIZES}
+
+	def round_trip_cbc_hex(data: bytes):
+		aes_cryptor.decrypt(aes_cryptor.encrypt(data.decode('utf8')))
+
+	def round_trip_cbc(data: bytes):
+		aes_cryptor.decrypt_bytes(aes_cryptor.encrypt_bytes(data))
+
+	round_trips = [('aes-cbc hex (v2)', round_trip_cbc_hex), ('aes-cbc', round_trip_cbc)]
+	for name in cryptor.get_available_cipher_names():
+		cipher = aes_cryptor.get_aead_cipher(name)
+		assert cipher.decrypt(cipher.encrypt(payloads[100], HEADER), HEADER) == payloads[100]
+		round_trips.append((name, lambda data, c=cipher: c.decrypt(c.encrypt(data, HEADER), HEADER)))
+
+	print('Encrypt + decrypt, us per frame (MB/s)')
+	print('{:>20}'.format('') + ''.join('{:>20}'.format('{} bytes'.format(size)) for size in PAYLOAD_SIZES))
+	for name, round_trip in round_trips:
+		cells = []
+		for size in PAYLOAD_SIZES:
+			cost = measure(round_trip, [payloads[size]])
+			cells.append('{:.1f} ({:.1f})'.format(cost * 1e6, size / cost / 1e6))
+		print('{:>20}'.format(name) + ''.join('{:>20}'.format(cell) for cell in cells))
+
+
+if __name__ == '__main__':
+	main()
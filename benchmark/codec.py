@@ -0,0 +1,70 @@
+"""
+Encode / decode throughput and size of each available payload codec, on a realistic mix of packets
+"""
+import random
+import time
+from typing import List
+
+from chatbridge.core.network import codec
+from chatbridge.core.network.protocol import ChatBridgePacket, PacketType, ChatPayload, CommandPayload, KeepAlivePayload
+from chatbridge.impl.tis.protocol import StatsQueryResult
+
+MINIMUM_DURATION = 0.5
+
+
+def _create_packet(type_: str, payload, *, receivers: List[str] = (), broadcast: bool = False) -> dict:
+	return ChatBridgePacket(sender='survival', receivers=list(receivers), broadcast=broadcast, type=type_, payload=payload.serialize()).serialize()
+
+
+def create_packet_mix(seed: int = 0) -> List[dict]:
+	"""
+	80% chat, 15% command, 5% keep-alive
+	"""
+	rnd = random.Random(seed)
+	words = ['hello', 'creeper', 'diamond', 'anyone', 'online', '?', 'lol', 'base', 'nether', 'portal', '服务器', '好']
+	stats_ask = CommandPayload.ask('!!stats rank used diamond_pickaxe', {'player': 'Steve'})
+	stats_answer = CommandPayload.answer(stats_ask, StatsQueryResult.create(
+		'Used Diamond Pickaxe', ['#{} Player{}: {}'.format(i + 1, i, 100000 - i * 731) for i in range(15)], 1234567
+	))
+	packets = []
+	for i in range(1000):
+		x = rnd.random()
+		if x < 0.8:
+			message = ' '.join(rnd.choice(words) for _ in range(rnd.randint(1, 20)))
+			packets.append(_create_packet(PacketType.chat, ChatPayload(author='Player{}'.format(rnd.randint(1, 50)), message=message), broadcast=True))
+		elif x < 0.95:
+			packets.append(_create_packet(PacketType.command, stats_ask if rnd.random() < 0.5 else stats_answer, receivers=['bot']))
+		else:
+			packets.append(_create_packet(PacketType.keep_alive, KeepAlivePayload.ping(), receivers=['#SERVER']))
+	return packets
+
+
+def measure(func, items: list) -> float:
+	"""
+	:return: Seconds spent for each item
+	"""
+	count = 0
+	start = time.perf_counter()
+	while True:
+		for item in items:
+			func(item)
+		count += len(items)
+		elapsed = time.perf_counter() - start
+		if elapsed >= MINIMUM_DURATION:
+			return elapsed / count
+
+
+def main():
+	packets = create_packet_mix()
+	print('{:>8} {:>12} {:>12} {:>12}'.format('codec', 'encode (us)', 'decode (us)', 'avg bytes'))
+	for name in codec.get_available_codec_names():
+		c = codec.get_codec(name)
+		encoded = [c.encode(packet) for packet in packets]
+		assert [c.decode(data) for data in encoded] == packets
+		encode_time = measure(c.encode, packets)
+		decode_time = measure(c.decode, encoded)
+		print('{:>8} {:>12.2f} {:>12.2f} {:>12.1f}'.format(name, encode_time * 1e6, decode_time * 1e6, sum(map(len, encoded)) / len(encoded)))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,68 @@
+"""
+Frame size and compression cost on recorded-like payloads: chat, !!online and !!stats results and a custom payload
+"""
+import random
+from typing import List, Tuple
+
+from benchmark.codec import measure
+from chatbridge.core.network import net_util, codec, compression
+from chatbridge.core.network.cryptor import AESCryptor
+from chatbridge.core.network.protocol import ChatBridgePacket, PacketType, ChatPayload, CommandPayload, CustomPayload, AbstractPayload
+from chatbridge.impl.tis.protocol import StatsQueryResult, OnlineQueryResult
+
+
+def _create_packet(type_: str, payload: AbstractPayload) -> ChatBridgePacket:
+	return ChatBridgePacket(sender='survival', receivers=['bot'], broadcast=False, type=type_, payload=payload.serialize())
+
+
+def create_samples(seed: int = 0) -> List[Tuple[str, ChatBridgePacket]]:
+	rnd = random.Random(seed)
+	players = ['Player{}'.format(i) if rnd.random() < 0.5 else ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz_') for _ in range(rnd.randint(4, 12))) for i in range(120)]
+	online_lines = ['Players in 5 Minecraft servers:']
+	for server_name in ('survival', 'creative', 'mirror', 'lobby', 'minigame'):
+		server_players = sorted(rnd.sample(players, rnd.randint(5, 30)), key=lambda x: x.upper())
+		online_lines.append('[{}] ({}): {}'.format(server_name, len(server_players), ', '.join(server_players)))
+	online_lines.append('Total players online: 87')
+	online_ask = CommandPayload.ask('!!online', {'player': 'Steve'})
+	stats_ask = CommandPayload.ask('!!stats rank used diamond_pickaxe', {'player': 'Steve'})
+	stats_lines = ['§7#{}§r §6{}§r {}'.format(i + 1, name, 100000 - i * 731) for i, name in enumerate(rnd.sample(players, 15))]
+	return [
+		('chat', _create_packet(PacketType.chat, ChatPayload(author='Steve', message='hello everyone, anyone want to go to the nether?'))),
+		('online', _create_packet(PacketType.command, CommandPayload.answer(online_ask, OnlineQueryResult.create(online_lines)))),
+		('stats', _create_packet(PacketType.command, CommandPayload.answer(stats_ask, StatsQueryResult.create('§6Used Diamond Pickaxe§r', stats_lines, 1234567)))),
+		('custom', _create_packet(PacketType.custom, CustomPayload(data={'players': [{'name': name, 'dimension': 'minecraft:overworld', 'x': rnd.randint(-9999, 9999), 'y': 64, 'z': rnd.randint(-9999, 9999)} for name in players[:40]]}))),
+	]
+
+
+def main():
+	cryptor = AESCryptor('ThisIsTheSecret')
+	wire_formats = [('v2 hex', net_util.WireFormat())]
+	for codec_name in ('json', 'msgpack'):
+		for compression_name in [compression.NO_COMPRESSION] + compression.get_available_compression_names():
+			wire_format = net_util.WireFormat(version=net_util.PROTOCOL_VERSION_BINARY, codec=codec_name, compression=compression_name, compression_threshold=0)
+			wire_formats.append(('{} {}'.format(codec_name, compression_name or 'raw'), wire_format))
+
+	samples = create_samples()
+	print('Frame size in bytes, compression threshold 0')
+	print('{:>18}'.format('') + ''.join('{:>10}'.format(name) for name, _ in samples))
+	for format_name, wire_format in wire_formats:
+		if wire_format.codec == 'msgpack' and codec.get_codec('msgpack') is None:
+			continue
+		print('{:>18}'.format(format_name) + ''.join('{:>10}'.format(len(net_util.encode_packet(cryptor, packet, wire_format))) for _, packet in samples))
+
+	print()
+	print('Compression cost of the json payloads in us, compress / decompress')
+	print('{:>18}'.format('') + ''.join('{:>16}'.format(name) for name, _ in samples))
+	payloads = [codec.get_codec('json').encode(packet.serialize()) for _, packet in samples]
+	for name in compression.get_available_compression_names():
+		c = compression.get_compression(name)
+		costs = []
+		for payload in payloads:
+			compressed = c.compress(payload)
+			assert c.decompress(compressed) == payload
+			costs.append('{:.1f} / {:.1f}'.format(measure(c.compress, [payload]) * 1e6, measure(c.decompress, [compressed]) * 1e6))
+		print('{:>18}'.format(name) + ''.join('{:>16}'.format(cost) for cost in costs))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,97 @@
+"""
+1 -> N fan-out of a broadcast chat packet in ChatBridgeServer.process_packet
+
+"legacy" encodes the packet once per receiver, which is what the server did before,
+"current" is the server as is, which encodes the packet once per broadcast
+"""
+import time
+from typing import Optional, Dict
+
+from chatbridge.core.config import ClientInfo
+from chatbridge.core.network import net_util
+from chatbridge.core.network.basic import Address
+from chatbridge.core.network.protocol import ChatBridgePacket, PacketType, ChatPayload, AbstractPacket
+from chatbridge.core.server import ChatBridgeServer, _ClientConnection
+
+RECEIVER_COUNTS = (1, 10, 100, 1000)
+MINIMUM_DURATION = 0.5
+
+
+class _BenchmarkServer(ChatBridgeServer):
+	def get_logging_file_name(self) -> Optional[str]:
+		return None
+
+
+class _SinkConnection(_ClientConnection):
+	"""
+	A client connection of the server that is always online and discards everything sent to it
+
+	It's the real connection class, so the routing code finds everything it needs on it
+	"""
+	def __init__(self, server: ChatBridgeServer, info: ClientInfo, wire_format: net_util.WireFormat):
+		super().__init__(server, info)
+		self._set_wire_format(wire_format)
+		self.sent_bytes = 0
+
+	def is_online(self) -> bool:
+		return True
+
+	def send_packet_invoker(self, packet: AbstractPacket, frame_cache: Optional[Dict[net_util.WireFormat, bytes]] = None, *, can_block: bool = True):
+		wire_format = self.get_wire_format()
+		if frame_cache is None:
+			frame = net_util.encode_packet(self.server._cryptor, packet, wire_format)
+		else:
+			frame = frame_cache.get(wire_format)
+			if frame is None:
+				frame = frame_cache[wire_format] = net_util.encode_packet(self.server._cryptor, packet, wire_format)
+		self.sent_bytes += len(frame)
+
+
+class _LegacySinkConnection(_SinkConnection):
+	def send_packet_invoker(self, packet: AbstractPacket, frame_cache: Optional[Dict[net_util.WireFormat, bytes]] = None, *, can_block: bool = True):
+		super().send_packet_invoker(packet)
+
+
+def create_server(receiver_count: int, connection_class=_SinkConnection, wire_format: net_util.WireFormat = net_util.WireFormat()) -> ChatBridgeServer:
+	server = _BenchmarkServer('ThisIstheSecret', Address('127.0.0.1', 0))
+	for i in range(receiver_count + 1):
+		info = ClientInfo(name='client{}'.format(i), password='')
+		server.clients[info.name] = connection_class(server, info, wire_format)
+	return server
+
+
+def create_chat_packet() -> ChatBridgePacket:
+	return ChatBridgePacket(
+		sender='client0',
+		receivers=[],
+		broadcast=True,
+		type=PacketType.chat,
+		payload=ChatPayload(author='Steve', message='Hello world! This is a test message from the survival server').serialize(),
+	)
+
+
+def measure(server: ChatBridgeServer, packet: ChatBridgePacket) -> float:
+	"""
+	:return: Seconds spent on one process_packet call
+	"""
+	count = 0
+	start = time.perf_counter()
+	while True:
+		server.process_packet(server.clients['client0'], packet)
+		count += 1
+		elapsed = time.perf_counter() - start
+		if elapsed >= MINIMUM_DURATION:
+			return elapsed / count
+
+
+def main():
+	packet = create_chat_packet()
+	print('{:>10} {:>14} {:>14} {:>8}'.format('receivers', 'legacy (us)', 'current (us)', 'speedup'))
+	for receiver_count in RECEIVER_COUNTS:
+		legacy = measure(create_server(receiver_count, _LegacySinkConnection), packet)
+		current = measure(create_server(receiver_count), packet)
+		print('{:>10} {:>14.1f} {:>14.1f} {:>7.2f}x'.format(receiver_count, legacy * 1e6, current * 1e6, legacy / current))
+
+
+if __name__ == '__main__':
+	main()
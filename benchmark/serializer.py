@@ -0,0 +1,57 @@
+"""
+Serialize / deserialize time of the packet and payload classes, mcdreforged's reflection based implementation vs the generated functions
+"""
+from typing import List, Tuple, Type
+
+from mcdreforged.utils.serializer import serialize, deserialize
+
+from benchmark.codec import create_packet_mix, measure
+from chatbridge.core.network.protocol import ChatBridgePacket, PacketType, ChatPayload, CommandPayload, KeepAlivePayload, AbstractPayload
+
+
+def _get_payload_class(packet: dict) -> Type[AbstractPayload]:
+	return {
+		PacketType.chat: ChatPayload,
+		PacketType.command: CommandPayload,
+		PacketType.keep_alive: KeepAlivePayload,
+	}[packet['type']]
+
+
+def _reflection_round_trip(packet: dict):
+	obj = deserialize(packet, ChatBridgePacket, error_at_missing=True)
+	payload = deserialize(obj.payload, _get_payload_class(packet), error_at_missing=True)
+	serialize(payload)
+	serialize(obj)
+
+
+def _generated_round_trip(packet: dict):
+	obj = ChatBridgePacket.deserialize(packet)
+	payload = _get_payload_class(packet).deserialize(obj.payload)
+	payload.serialize()
+	obj.serialize()
+
+
+def main():
+	packets = create_packet_mix()
+	rows: List[Tuple[str, list, type]] = [('packet', packets, ChatBridgePacket)]
+	for cls in (ChatPayload, CommandPayload, KeepAlivePayload):
+		rows.append((cls.__name__, [packet['payload'] for packet in packets if _get_payload_class(packet) is cls], cls))
+
+	print('{:>16} {:>16} {:>16} {:>16} {:>16}'.format('class', 'mcdr ser (us)', 'fast ser (us)', 'mcdr des (us)', 'fast des (us)'))
+	for name, items, cls in rows:
+		objects = [cls.deserialize(item) for item in items]
+		assert [obj.serialize() for obj in objects] == [serialize(deserialize(item, cls, error_at_missing=True)) for item in items]
+		print('{:>16} {:>16.2f} {:>16.2f} {:>16.2f} {:>16.2f}'.format(
+			name,
+			measure(serialize, objects) * 1e6,
+			measure(cls.serialize, objects) * 1e6,
+			measure(lambda item: deserialize(item, cls, error_at_missing=True), items) * 1e6,
+			measure(cls.deserialize, items) * 1e6,
+		))
+	reflection_time = measure(_reflection_round_trip, packets)
+	generated_time = measure(_generated_round_trip, packets)
+	print('round trip of packet + payload: {:.2f}us -> {:.2f}us ({:.1f}x)'.format(reflection_time * 1e6, generated_time * 1e6, reflection_time / generated_time))
+
+
+if __name__ == '__main__':
+	main()
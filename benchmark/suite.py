@@ -0,0 +1,228 @@
+"""
+The packet hot path, measured stage by stage
+
+Results are printed to stdout as JSON, in microseconds per operation.
+Compare them with a stored baseline to spot regressions::
+
+	python -m benchmark --output baseline.json
+	(make changes)
+	python -m benchmark --baseline baseline.json
+
+Stages:
+
+- ``serialize.<class>`` / ``deserialize.<class>``: the packet and payload classes
+- ``codec.<name>.encode`` / ``codec.<name>.decode``: serialized packet <-> bytes, ``codec.json`` is json.dumps / json.loads
+- ``cryptor.<cipher>.encrypt`` / ``cryptor.<cipher>.decrypt``: ``aes-cbc-hex`` is the text based legacy one
+- ``socket.<format>``: encode a packet, send it over a socketpair, receive and decode it
+- ``fanout.<format>.<n>``: ChatBridgeServer.process_packet for a broadcast to n receivers
+"""
+import argparse
+import json
+import platform
+import socket
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from benchmark import fanout
+from benchmark.codec import create_packet_mix
+from chatbridge.core.network import net_util, codec, compression, cryptor
+from chatbridge.core.network.cryptor import AESCryptor
+from chatbridge.core.network.protocol import ChatBridgePacket, LoginPacket, LoginResultPacket, ChatPayload, CommandPayload, \
+	KeepAlivePayload, CustomPayload, PacketType
+
+DEFAULT_DURATION = 0.2
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2
+RECEIVER_COUNTS = fanout.RECEIVER_COUNTS
+FRAME_COUNT_PER_SOCKET_ROUND = 16  # small enough to fit in the socket buffer
+
+
+def time_per_call(func: Callable[[], None], *, duration: float, repeat: int) -> float:
+	"""
+	:return: The best seconds per call among the repeats, each repeat lasts for at least the given duration
+	"""
+	best = float('inf')
+	for _ in range(repeat):
+		count = 0
+		batch = 1
+		start = time.perf_counter()
+		while True:
+			for _ in range(batch):
+				func()
+			count += batch
+			elapsed = time.perf_counter() - start
+			if elapsed >= duration:
+				break
+			batch *= 2
+		best = min(best, elapsed / count)
+	return best
+
+
+def get_latest_wire_format() -> net_util.WireFormat:
+	"""
+	:return: The wire format that two up-to-date peers in this environment negotiate
+	"""
+	return net_util.WireFormat(
+		version=net_util.PROTOCOL_VERSION_LATEST,
+		codec=codec.negotiate_codec(codec.get_available_codec_names()),
+		compression=compression.negotiate_compression(compression.get_available_compression_names()),
+		cipher=cryptor.negotiate_cipher(cryptor.get_available_cipher_names()),
+	)
+
+
+def _get_wire_formats() -> Dict[str, net_util.WireFormat]:
+	return {
+		'v2': net_util.WireFormat(),
+		'v3-json': net_util.WireFormat(version=net_util.PROTOCOL_VERSION_BINARY),
+		'latest': get_latest_wire_format(),
+	}
+
+
+def _create_samples() -> Dict[type, dict]:
+	"""
+	:return: A serialized sample for each packet and payload class
+	"""
+	packets = create_packet_mix()
+	chat_packet = next(packet for packet in packets if packet['type'] == PacketType.chat)
+	command_packet = next(packet for packet in packets if packet['type'] == PacketType.command and packet['payload']['responded'])
+	return {
+		LoginPacket: LoginPacket(name='survival', password='password', protocol_version=net_util.PROTOCOL_VERSION_LATEST, codecs=codec.get_available_codec_names()).serialize(),
+		LoginResultPacket: LoginResultPacket(message='ok').serialize(),
+		ChatBridgePacket: chat_packet,
+		ChatPayload: chat_packet['payload'],
+		CommandPayload: command_packet['payload'],
+		KeepAlivePayload: KeepAlivePayload.ping().serialize(),
+		CustomPayload: CustomPayload(data={'players': ['Steve', 'Alex'], 'tps': 20.0}).serialize(),
+	}
+
+
+def run(*, duration: float, repeat: int, name_filter: Optional[str] = None) -> Dict[str, float]:
+	"""
+	:return: Microseconds per operation for each stage
+	"""
+	stages: Dict[str, Callable[[], None]] = {}
+	samples = _create_samples()
+	for cls, data in samples.items():
+		obj = cls.deserialize(data)
+		stages['serialize.{}'.format(cls.__name__)] = obj.serialize
+		stages['deserialize.{}'.format(cls.__name__)] = lambda cls=cls, data=data: cls.deserialize(data)
+
+	packet_data = samples[ChatBridgePacket]
+	for name in codec.get_available_codec_names():
+		c = codec.get_codec(name)
+		encoded = c.encode(packet_data)
+		stages['codec.{}.encode'.format(name)] = lambda c=c: c.encode(packet_data)
+		stages['codec.{}.decode'.format(name)] = lambda c=c, encoded=encoded: c.decode(encoded)
+
+	aes_cryptor = AESCryptor('ThisIstheSecret')
+	plain_text = json.dumps(packet_data, ensure_ascii=False)
+	plain_data = plain_text.encode('utf8')
+	encrypted_text = aes_cryptor.encrypt(plain_text)
+	encrypted_data = aes_cryptor.encrypt_bytes(plain_data)
+	stages['cryptor.aes-cbc-hex.encrypt'] = lambda: aes_cryptor.encrypt(plain_text)
+	stages['cryptor.aes-cbc-hex.decrypt'] = lambda: aes_cryptor.decrypt(encrypted_text)
+	stages['cryptor.aes-cbc.encrypt'] = lambda: aes_cryptor.encrypt_bytes(plain_data)
+	stages['cryptor.aes-cbc.decrypt'] = lambda: aes_cryptor.decrypt_bytes(encrypted_data)
+	header = b'\x03\x00\x00\x00\x00\x00'
+	for name in cryptor.get_available_cipher_names():
+		cipher = aes_cryptor.get_aead_cipher(name)
+		sealed = cipher.encrypt(plain_data, header)
+		stages['cryptor.{}.encrypt'.format(name)] = lambda cipher=cipher: cipher.encrypt(plain_data, header)
+		stages['cryptor.{}.decrypt'.format(name)] = lambda cipher=cipher, sealed=sealed: cipher.decrypt(sealed, header)
+
+	packet = ChatBridgePacket.deserialize(packet_data)
+	sockets: List[socket.socket] = []
+	for format_name, wire_format in _get_wire_formats().items():
+		sender, receiver = socket.socketpair()
+		sockets.extend((sender, receiver))
+		frame_reader = net_util.FrameReader(aes_cryptor)
+
+		def socket_round(sender=sender, receiver=receiver, frame_reader=frame_reader, wire_format=wire_format):
+			for _ in range(FRAME_COUNT_PER_SOCKET_ROUND):
+				sender.sendall(net_util.encode_packet(aes_cryptor, packet, wire_format))
+			for _ in range(FRAME_COUNT_PER_SOCKET_ROUND):
+				frame_reader.read_frame(receiver, wire_format, timeout=1)
+		stages['socket.{}'.format(format_name)] = socket_round
+
+		broadcast_packet = fanout.create_chat_packet()
+		for receiver_count in RECEIVER_COUNTS:
+			server = fanout.create_server(receiver_count, wire_format=wire_format)
+			stages['fanout.{}.{}'.format(format_name, receiver_count)] = lambda server=server: server.process_packet(server.clients['client0'], broadcast_packet)
+
+	results = {}
+	try:
+		for name, func in stages.items():
+			if name_filter is None or name.startswith(name_filter):
+				cost = time_per_call(func, duration=duration, repeat=repeat)
+				if name.startswith('socket.'):
+					cost /= FRAME_COUNT_PER_SOCKET_ROUND
+				results[name] = round(cost * 1e6, 3)
+	finally:
+		for sock in sockets:
+			sock.close()
+	return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+	"""
+	Print the comparison with the baseline to stderr
+
+	:return: Names of the regressed stages
+	"""
+	regressions = []
+	print('{:<36} {:>12} {:>12} {:>9}'.format('stage', 'baseline us', 'current us', 'change'), file=sys.stderr)
+	for name, cost in results.items():
+		base_cost = baseline.get(name)
+		if base_cost is None or base_cost <= 0:
+			print('{:<36} {:>12} {:>12.3f} {:>9}'.format(name, '-', cost, 'new'), file=sys.stderr)
+			continue
+		change = cost / base_cost - 1
+		if change > threshold:
+			regressions.append(name)
+			mark = '  REGRESSION'
+		elif change < -threshold:
+			mark = '  improved'
+		else:
+			mark = ''
+		print('{:<36} {:>12.3f} {:>12.3f} {:>+8.1f}%{}'.format(name, base_cost, cost, change * 100, mark), file=sys.stderr)
+	return regressions
+
+
+def main(args: Optional[List[str]] = None):
+	parser = argparse.ArgumentParser(prog='python -m benchmark', description='Micro-benchmarks of the ChatBridge packet hot path')
+	parser.add_argument('-o', '--output', help='Also write the results to this file, e.g. to be used as a baseline later')
+	parser.add_argument('-b', '--baseline', help='A result file to compare with. Exit with code 1 if any stage regresses')
+	parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD, help='Relative slowdown to be counted as a regression, default: %(default)s')
+	parser.add_argument('-f', '--filter', help='Only run stages whose name starts with this prefix')
+	parser.add_argument('-d', '--duration', type=float, default=DEFAULT_DURATION, help='Minimum seconds of each measurement, default: %(default)s')
+	parser.add_argument('-r', '--repeat', type=int, default=DEFAULT_REPEAT, help='Measurements of each stage, the best one is taken, default: %(default)s')
+	args = parser.parse_args(args)
+
+	report = {
+		'meta': {
+			'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'wire_format': get_latest_wire_format()._asdict(),
+		},
+		'unit': 'us',
+		'results': run(duration=args.duration, repeat=args.repeat, name_filter=args.filter),
+	}
+	text = json.dumps(report, indent=2)
+	print(text)
+	if args.output is not None:
+		with open(args.output, 'w', encoding='utf8') as file:
+			file.write(text)
+
+	if args.baseline is not None:
+		with open(args.baseline, 'r', encoding='utf8') as file:
+			baseline = json.load(file)['results']
+		regressions = compare(report['results'], baseline, args.threshold)
+		if len(regressions) > 0:
+			print('{} stage(s) regressed by more than {:.0f}%: {}'.format(len(regressions), args.threshold * 100, ', '.join(regressions)), file=sys.stderr)
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,77 @@
+"""
+Several threads sending frames to the same socket at the same time, like the MainLoop, KeepAlive and messenger threads of a client do
+
+Compares a plain locked ``sendall`` per frame with :class:`FrameWriter`.
+The socket is simulated, each ``sendall`` call blocks for a fixed time without holding the GIL, like a socket to a busy peer
+"""
+import time
+from threading import Thread, Lock
+from typing import Callable, List
+
+from chatbridge.core.network import net_util
+from chatbridge.core.network.cryptor import AESCryptor
+from chatbridge.core.network.protocol import ChatBridgePacket, PacketType, ChatPayload
+
+THREAD_COUNTS = (1, 4, 16)
+FRAMES_PER_THREAD = 1000
+SENDALL_DURATION = 0.0001
+
+
+class _SimulatedSocket:
+	def __init__(self):
+		self.call_count = 0
+		self.sent_size = 0
+
+	def sendall(self, data: bytes):
+		self.call_count += 1
+		self.sent_size += len(data)
+		time.sleep(SENDALL_DURATION)
+
+
+def _create_frame() -> bytes:
+	packet = ChatBridgePacket(
+		sender='survival', receivers=[], broadcast=True, type=PacketType.chat,
+		payload=ChatPayload(author='Steve', message='hello everyone, anyone want to go to the nether?').serialize()
+	)
+	return net_util.encode_packet(AESCryptor('ThisIsTheSecret'), packet, net_util.WireFormat(version=net_util.PROTOCOL_VERSION_BINARY))
+
+
+def measure(thread_count: int, make_sender: Callable[[_SimulatedSocket], Callable[[bytes], None]]) -> _SimulatedSocket:
+	frame = _create_frame()
+	sock = _SimulatedSocket()
+	send = make_sender(sock)
+
+	def send_loop():
+		for _ in range(FRAMES_PER_THREAD):
+			send(frame)
+
+	threads = [Thread(target=send_loop) for _ in range(thread_count)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert sock.sent_size == len(frame) * FRAMES_PER_THREAD * thread_count
+	return sock
+
+
+def main():
+	print('{:>8} {:>24} {:>24}'.format('threads', 'locked sendall', 'FrameWriter'))
+	for thread_count in THREAD_COUNTS:
+		def make_locked_sendall(sock: _SimulatedSocket):
+			lock = Lock()
+
+			def send(frame: bytes):
+				with lock:
+					sock.sendall(frame)
+			return send
+
+		results: List[str] = []
+		for make_sender in (make_locked_sendall, lambda sock: net_util.FrameWriter(sock).write):
+			start = time.perf_counter()
+			sock = measure(thread_count, make_sender)
+			results.append('{:.1f}ms, {} calls'.format((time.perf_counter() - start) * 1e3, sock.call_count))
+		print('{:>8} {:>24} {:>24}'.format(thread_count, *results))
+
+
+if __name__ == '__main__':
+	main()
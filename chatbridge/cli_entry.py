@@ -40,6 +40,11 @@ def kaiheila_bot():
 	entry.main()
 
 
+def loadtest():
+	from chatbridge.impl.loadtest import entry
+	entry.main()
+
+
 def main():
 	if len(sys.argv) == 2:
 		arg = sys.argv[1]
@@ -57,4 +62,5 @@ def main():
 		print('{} satori_bot: Start a Satori bot as client'.format(prefix))
 		print('{} kaiheila_bot: Start a Kaiheila bot as client'.format(prefix))
 		print('{} online_command: Start a OnlineCommand bot as client'.format(prefix))
+		print('{} loadtest: Start a local server and drive it with synthetic clients to measure its capacity'.format(prefix))
 
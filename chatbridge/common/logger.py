@@ -1,11 +1,15 @@
+import atexit
+import itertools
 import os
+import queue
 import sys
 import time
 import weakref
 import zipfile
-from logging import FileHandler, Formatter, Logger, DEBUG, StreamHandler, INFO
-from threading import RLock
-from typing import Optional, Set
+from concurrent.futures.thread import ThreadPoolExecutor
+from logging import FileHandler, Formatter, Logger, DEBUG, StreamHandler, INFO, LogRecord
+from threading import RLock, Thread, Lock, current_thread
+from typing import Optional, Set, Tuple
 
 from colorlog import ColoredFormatter
 
@@ -23,24 +27,106 @@ class SyncStdoutStreamHandler(StreamHandler):
 			super().emit(record)
 
 
-def _create_file_handler(name: str) -> FileHandler:
-	logging_file_path: str = os.path.join(LOGGING_DIR, 'chatbridge_{}.log'.format(name))
-	if not os.path.isdir(os.path.dirname(logging_file_path)):
-		os.makedirs(os.path.dirname(logging_file_path))
+class _LogArchiver:
+	"""
+	Compresses the rotated log files into zip files in a background thread
+	"""
+	PENDING_SUFFIX = '.pending'
 
-	if os.path.isfile(logging_file_path):
-		modify_time = '{}_{}'.format(time.strftime('%Y-%m-%d', time.localtime(os.stat(logging_file_path).st_mtime)), name)
-		counter = 0
-		while True:
-			counter += 1
-			zip_file_name = '{}/{}-{}.zip'.format(os.path.dirname(logging_file_path), modify_time, counter)
-			if not os.path.isfile(zip_file_name):
-				break
-		zipf = zipfile.ZipFile(zip_file_name, 'w')
-		zipf.write(logging_file_path, arcname=os.path.basename(logging_file_path), compress_type=zipfile.ZIP_DEFLATED)
-		zipf.close()
-		os.remove(logging_file_path)
-	file_handler = FileHandler(logging_file_path, encoding='utf8')
+	def __init__(self):
+		self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='LogArchiver')
+		self.__counter = itertools.count()
+		self.__submitted: Set[str] = set()
+		self.__lock = Lock()
+
+	def archive(self, logging_file_path: str, name: str):
+		"""
+		Move the log file away so a new one can be opened at once, and zip it later in the background
+		"""
+		if not os.path.isfile(logging_file_path):
+			return
+		pending_path = '{}.{}.{}{}'.format(logging_file_path, int(time.time() * 1000), next(self.__counter), self.PENDING_SUFFIX)
+		os.replace(logging_file_path, pending_path)
+		self.__submit(pending_path, logging_file_path, name)
+
+	def archive_leftovers(self, logging_file_path: str, name: str):
+		"""
+		Zip the log files that were moved away but not yet zipped when the previous process exited
+		"""
+		directory = os.path.dirname(logging_file_path)
+		prefix = os.path.basename(logging_file_path) + '.'
+		for file_name in os.listdir(directory):
+			if file_name.startswith(prefix) and file_name.endswith(self.PENDING_SUFFIX):
+				self.__submit(os.path.join(directory, file_name), logging_file_path, name)
+
+	def __submit(self, pending_path: str, logging_file_path: str, name: str):
+		with self.__lock:
+			if pending_path in self.__submitted:
+				return
+			self.__submitted.add(pending_path)
+		self.__executor.submit(self.__compress, pending_path, os.path.basename(logging_file_path), name)
+
+	def __compress(self, pending_path: str, arcname: str, name: str):
+		try:
+			modify_time = '{}_{}'.format(time.strftime('%Y-%m-%d', time.localtime(os.stat(pending_path).st_mtime)), name)
+			counter = 0
+			while True:
+				counter += 1
+				zip_file_name = '{}/{}-{}.zip'.format(os.path.dirname(pending_path), modify_time, counter)
+				if not os.path.isfile(zip_file_name):
+					break
+			with zipfile.ZipFile(zip_file_name, 'w') as zipf:
+				zipf.write(pending_path, arcname=arcname, compress_type=zipfile.ZIP_DEFLATED)
+			os.remove(pending_path)
+		except Exception as e:
+			print('Failed to archive log file {}: {}'.format(pending_path, e), file=sys.stderr)
+		finally:
+			with self.__lock:
+				self.__submitted.discard(pending_path)
+
+	def shutdown(self):
+		self.__executor.shutdown(wait=True)
+
+
+_archiver = _LogArchiver()
+atexit.register(_archiver.shutdown)
+
+
+class _LogFileHandler(FileHandler):
+	"""
+	A file handler that archives the previous log file on creation, and rotates the log file by size and date
+	"""
+	max_size = 0  # rotate the log file when it grows larger than this in bytes, 0 to disable
+	rotate_daily = False  # rotate the log file when the date changes
+
+	def __init__(self, name: str):
+		self.__name = name
+		logging_file_path: str = os.path.join(LOGGING_DIR, 'chatbridge_{}.log'.format(name))
+		if not os.path.isdir(os.path.dirname(logging_file_path)):
+			os.makedirs(os.path.dirname(logging_file_path))
+		_archiver.archive_leftovers(logging_file_path, name)
+		_archiver.archive(logging_file_path, name)
+		super().__init__(logging_file_path, encoding='utf8')
+		self.__date = time.strftime('%Y-%m-%d')
+
+	def __should_rotate(self, record: LogRecord) -> bool:
+		if self.stream is None:
+			return False
+		if self.max_size > 0 and self.stream.tell() >= self.max_size:
+			return True
+		return self.rotate_daily and time.strftime('%Y-%m-%d', time.localtime(record.created)) != self.__date
+
+	def emit(self, record: LogRecord) -> None:
+		if self.__should_rotate(record):
+			self.stream.close()
+			self.stream = None
+			_archiver.archive(self.baseFilename, self.__name)
+			self.__date = time.strftime('%Y-%m-%d', time.localtime(record.created))
+		super().emit(record)
+
+
+def _create_file_handler(name: str) -> FileHandler:
+	file_handler = _LogFileHandler(name)
 	file_handler.setFormatter(Formatter(
 		'[%(name)s] [%(asctime)s] [%(threadName)s/%(levelname)s]: %(message)s',
 		datefmt='%Y-%m-%d %H:%M:%S'
@@ -48,6 +134,50 @@ def _create_file_handler(name: str) -> FileHandler:
 	return file_handler
 
 
+class _AsyncLogWriter:
+	"""
+	Handles the log records of all loggers in a background thread, so the logging threads only need to enqueue the records
+	"""
+	def __init__(self):
+		self.__queue: 'queue.Queue[Tuple[Logger, LogRecord]]' = queue.Queue()
+		self.__thread = Thread(target=self.__loop, name='LogWriter', daemon=True)
+		self.__thread.start()
+
+	def submit(self, logger: Logger, record: LogRecord):
+		self.__queue.put((logger, record))
+
+	def flush(self):
+		"""
+		Wait until all submitted records are handled
+		"""
+		if current_thread() is not self.__thread:
+			self.__queue.join()
+
+	def __loop(self):
+		while True:
+			item = self.__queue.get()
+			try:
+				logger, record = item
+				Logger.handle(logger, record)
+			except Exception as e:
+				print('Failed to handle log record: {}'.format(e), file=sys.stderr)
+			finally:
+				self.__queue.task_done()
+
+
+_async_writer: Optional[_AsyncLogWriter] = None
+_async_writer_lock = Lock()
+
+
+def _get_async_writer() -> _AsyncLogWriter:
+	global _async_writer
+	with _async_writer_lock:
+		if _async_writer is None:
+			_async_writer = _AsyncLogWriter()
+			atexit.register(_async_writer.flush)
+		return _async_writer
+
+
 class ChatBridgeLogger(Logger):
 	LOG_COLORS = {
 		'DEBUG': 'blue',
@@ -64,6 +194,7 @@ class ChatBridgeLogger(Logger):
 		}
 	}
 	__DEBUG_SWITCH = False
+	__ASYNC_SWITCH = False
 	__REFS: Set['ChatBridgeLogger'] = weakref.WeakSet()
 
 	@classmethod
@@ -72,6 +203,27 @@ class ChatBridgeLogger(Logger):
 		for logger in cls.__REFS:
 			logger.__refresh_debug_level()
 
+	@classmethod
+	def set_async_all(cls, value: bool):
+		"""
+		In async mode, records are written to the console and the files in a background thread,
+		so the logging threads, e.g. network threads, never wait for the console or the disk
+		"""
+		if not value and cls.__ASYNC_SWITCH:
+			_get_async_writer().flush()
+		cls.__ASYNC_SWITCH = value
+
+	@classmethod
+	def set_file_rotation(cls, *, max_size: int = 0, daily: bool = False):
+		"""
+		Rotate the log files when they grow larger than max_size in bytes, or when the date changes.
+		Rotated log files are zipped in the background
+
+		:param max_size: 0 to disable size based rotation
+		"""
+		_LogFileHandler.max_size = max_size
+		_LogFileHandler.rotate_daily = daily
+
 	def __init__(self, name: str, *, file_name: Optional[str] = None, file_handler: Optional[FileHandler] = None):
 		super().__init__(name)
 		self.console_handler = SyncStdoutStreamHandler()
@@ -95,11 +247,29 @@ class ChatBridgeLogger(Logger):
 	def is_debug_enabled(cls) -> bool:
 		return cls.__DEBUG_SWITCH
 
+	@classmethod
+	def is_async_enabled(cls) -> bool:
+		return cls.__ASYNC_SWITCH
+
 	def __refresh_debug_level(self):
 		self.setLevel(DEBUG if self.__DEBUG_SWITCH else INFO)
+		# Logger caches the isEnabledFor results, but setLevel only clears the caches of loggers created by logging.getLogger
+		getattr(self, '_cache', {}).clear()
+
+	def handle(self, record: LogRecord) -> None:
+		if self.__ASYNC_SWITCH:
+			if record.args:
+				# the arguments might be mutated before the record is handled
+				record.msg = record.getMessage()
+				record.args = None
+			_get_async_writer().submit(self, record)
+		else:
+			super().handle(record)
 
 	def close_file(self):
 		if self.file_handler is not None:
+			if self.__ASYNC_SWITCH:
+				_get_async_writer().flush()
 			self.removeHandler(self.file_handler)
 			self.file_handler.close()
 			self.file_handler = None
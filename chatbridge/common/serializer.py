@@ -1,14 +1,252 @@
-from typing import TypeVar, Type
+import copy
+from typing import TypeVar, Type, Dict, Tuple, Optional, Callable, Any, Union, List, get_type_hints
 
 from mcdreforged.api.utils.serializer import Serializable
+from mcdreforged.utils.serializer import serialize
 
-Self = TypeVar('Self', bound='NoMissingFieldSerializable')
+Self = TypeVar('Self', bound='FastSerializable')
 
+_MISSING = object()
+_IMMUTABLE_TYPES = frozenset([type(None), bool, int, float, str])
+_default_fields_cache: Dict[type, Tuple[str, ...]] = {}
+_deserializer_cache: Dict[Tuple[type, bool], Optional[Callable[[Any], Any]]] = {}
+_serializer_cache: Dict[type, Optional[Callable[[Any], dict]]] = {}
 
-class NoMissingFieldSerializable(Serializable):
+
+def _get_field_annotations(cls: type) -> Dict[str, Any]:
+	return {name: type_ for name, type_ in get_type_hints(cls).items() if not name.startswith('_')}
+
+
+def _get_fields_with_default(cls: type) -> Tuple[str, ...]:
+	fields = _default_fields_cache.get(cls)
+	if fields is None:
+		fields = tuple(name for name in _get_field_annotations(cls).keys() if hasattr(cls, name))
+		_default_fields_cache[cls] = fields
+	return fields
+
+
+def _mismatch(cls: Any, data: Any) -> TypeError:
+	return TypeError('Mismatched input type: expected class {} but found data with class {}'.format(cls, type(data)))
+
+
+def _serialize_value(value: Any) -> Any:
+	value_type = type(value)
+	if value_type in _IMMUTABLE_TYPES:
+		return value
+	elif value_type is dict:
+		return {key if type(key) is str else serialize(key): _serialize_value(item) for key, item in value.items()}
+	elif value_type is list:
+		return [_serialize_value(item) for item in value]
+	elif isinstance(value, FastSerializable):
+		return value.serialize()
+	return serialize(value)
+
+
+# ------------------------------
+#   Deserializer code generation
+# ------------------------------
+
+def _create_value_converter(type_: Any, strict: bool) -> Optional[Callable[[Any], Any]]:
+	"""
+	Create a function that converts a serialized value into the given type, following the rules of mcdreforged's deserialize
+
+	:return: The converter function, or None if the type is not supported
+	"""
+	origin = getattr(type_, '__origin__', None)
+	args = getattr(type_, '__args__', ())
+	if type_ is Any:
+		return lambda data: data
+	elif type_ is float:
+		def convert_float(data):
+			if type(data) is float:
+				return data
+			elif type(data) is int:
+				return float(data)
+			raise _mismatch(float, data)
+		return convert_float
+	elif type_ in (type(None), bool, int, str, list, dict):
+		def convert_basic(data):
+			if type(data) is type_:
+				return data
+			raise _mismatch(type_, data)
+		return convert_basic
+	elif type_ is None:
+		return _create_value_converter(type(None), strict)
+	elif origin is Union:
+		converters = [_create_value_converter(arg, strict) for arg in args]
+		if None in converters:
+			return None
+
+		def convert_union(data):
+			for converter in converters:
+				try:
+					return converter(data)
+				except (TypeError, ValueError):
+					pass
+			raise TypeError('Data in type {} cannot match any candidate of target class {}'.format(type(data), type_))
+		return convert_union
+	elif origin in (list, List) and len(args) == 1:
+		element_converter = _create_value_converter(args[0], strict)
+		if element_converter is None:
+			return None
+
+		def convert_list(data):
+			if isinstance(data, list):
+				return [element_converter(element) for element in data]
+			raise _mismatch(list, data)
+		return convert_list
+	elif origin in (dict, Dict) and len(args) == 2:
+		key_converter = _create_value_converter(args[0], strict)
+		value_converter = _create_value_converter(args[1], strict)
+		if key_converter is None or value_converter is None:
+			return None
+
+		def convert_dict(data):
+			if isinstance(data, dict):
+				return {key_converter(key): value_converter(value) for key, value in data.items()}
+			raise _mismatch(dict, data)
+		return convert_dict
+	elif isinstance(type_, type) and issubclass(type_, FastSerializable):
+		return _get_deserializer(type_, strict)
+	return None
+
+
+def _has_custom_validation(cls: type) -> bool:
+	for klass in cls.__mro__:
+		if klass is Serializable:
+			break
+		if 'validate_attribute' in vars(klass):
+			return True
+	return False
+
+
+def _build_deserializer(cls: type, strict: bool) -> Optional[Callable[[Any], Any]]:
+	if _has_custom_validation(cls):
+		return None
+	namespace: Dict[str, Any] = {
+		'cls': cls,
+		'copy': copy.copy,
+		'_MISSING': _MISSING,
+		'_mismatch': _mismatch,
+	}
+	lines = [
+		'def deserialize(data):',
+		'	if not isinstance(data, dict):',
+		'		raise _mismatch(cls, data)',
+		'	obj = cls.__new__(cls)',
+		'	attrs = obj.__dict__',
+	]
+	for i, (name, type_) in enumerate(_get_field_annotations(cls).items()):
+		lines.append('	value = data.get({!r}, _MISSING)'.format(name))
+		lines.append('	if value is _MISSING:')
+		if hasattr(cls, name):
+			namespace['default_{}'.format(i)] = getattr(cls, name)
+			lines.append('		attrs[{!r}] = copy(default_{})'.format(name, i))
+		elif strict:
+			lines.append('		raise ValueError("Missing field {} for class {{}} in input object {{}}".format(cls, data))'.format(name))
+		else:
+			lines.append('		pass')
+		lines.append('	else:')
+		if type_ in (bool, int, str, list, dict):
+			namespace['type_{}'.format(i)] = type_
+			lines.append('		if type(value) is not type_{}:'.format(i))
+			lines.append('			raise _mismatch(type_{}, value)'.format(i))
+		else:
+			converter = _create_value_converter(type_, strict)
+			if converter is None:
+				return None
+			namespace['convert_{}'.format(i)] = converter
+			lines.append('		value = convert_{}(value)'.format(i))
+		lines.append('		attrs[{!r}] = value'.format(name))
+	lines.append('	obj.on_deserialization()')
+	lines.append('	return obj')
+	exec('\n'.join(lines), namespace)
+	return namespace['deserialize']
+
+
+def _build_serializer(cls: type) -> Callable[[Any], dict]:
+	namespace: Dict[str, Any] = {
+		'_MISSING': _MISSING,
+		'_IMMUTABLE_TYPES': _IMMUTABLE_TYPES,
+		'_serialize_value': _serialize_value,
+	}
+	fields = list(_get_field_annotations(cls).keys())
+	lines = [
+		'def serialize(obj):',
+		'	attrs = obj.__dict__',
+		'	result = {}',
+	]
+	for name in fields:
+		lines.append('	value = attrs.get({!r}, _MISSING)'.format(name))
+		lines.append('	if value is not _MISSING:')
+		lines.append('		result[{!r}] = value if type(value) in _IMMUTABLE_TYPES else _serialize_value(value)'.format(name))
+	# public attributes that are not declared in the class annotation are serialized too, like what mcdreforged does
+	lines.append('	if len(result) != len(attrs):')
+	lines.append('		for key, value in attrs.items():')
+	lines.append('			if key not in result and not key.startswith("_"):')
+	lines.append('				result[key] = _serialize_value(value)')
+	lines.append('	return result')
+	exec('\n'.join(lines), namespace)
+	return namespace['serialize']
+
+
+def _get_deserializer(cls: type, strict: bool) -> Optional[Callable[[Any], Any]]:
+	key = (cls, strict)
+	try:
+		return _deserializer_cache[key]
+	except KeyError:
+		deserializer = _deserializer_cache[key] = _build_deserializer(cls, strict)
+		return deserializer
+
+
+def _get_serializer(cls: type) -> Callable[[Any], dict]:
+	serializer = _serializer_cache.get(cls)
+	if serializer is None:
+		serializer = _serializer_cache[cls] = _build_serializer(cls)
+	return serializer
+
+
+class FastSerializable(Serializable):
+	"""
+	A Serializable whose serialize / deserialize are done by functions generated from its field annotations,
+	instead of reflecting over the type hints for every object
+
+	The generated functions are built on first use and cached per class.
+	It falls back to mcdreforged's implementation for unsupported field types or extra deserialize arguments
+	"""
+	def serialize(self) -> dict:
+		return _get_serializer(type(self))(self)
+
+	@classmethod
+	def deserialize(cls: Type[Self], data: dict, **kwargs) -> Self:
+		if kwargs.keys() <= {'error_at_missing'}:
+			deserializer = _get_deserializer(cls, kwargs.get('error_at_missing', False))
+			if deserializer is not None:
+				return deserializer(data)
+		# noinspection PyTypeChecker
+		return super().deserialize(data, **kwargs)
+
+
+class NoMissingFieldSerializable(FastSerializable):
+	"""
+	Missing fields are not allowed during deserialization, unless the field has a default value
+
+	So new fields with default values can be added to the protocol, and data from older peers can still be accepted
+	"""
 	@classmethod
 	def deserialize(cls: Type[Self], data: dict, **kwargs) -> Self:
 		kwargs.setdefault('error_at_missing', True)
+		if kwargs.keys() == {'error_at_missing'}:
+			deserializer = _get_deserializer(cls, kwargs['error_at_missing'])
+			if deserializer is not None:
+				return deserializer(data)
+		# fallback to mcdreforged's implementation, where missing fields with default values need to be filled manually
+		if kwargs['error_at_missing'] and isinstance(data, dict):
+			missing_fields = [name for name in _get_fields_with_default(cls) if name not in data]
+			if len(missing_fields) > 0:
+				data = data.copy()
+				for name in missing_fields:
+					data[name] = serialize(getattr(cls, name))
 		# noinspection PyTypeChecker
 		return super().deserialize(data, **kwargs)
 
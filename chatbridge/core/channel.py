@@ -0,0 +1,57 @@
+"""
+Named channels on the server. Clients subscribe to channels at login, and packets sent to a channel are only delivered to its members
+"""
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable
+
+
+class ChannelIndex:
+	"""
+	An index from channel names to the subscribed client names, so routing a packet to a channel only touches its members
+
+	Lookups are lock-free: the member sets are immutable and replaced as a whole when the subscriptions change.
+	Clients stay subscribed while offline, so packets sent to their channels can still be kept by their replay buffers
+	"""
+	def __init__(self):
+		self.__lock = Lock()
+		self.__members: Dict[str, FrozenSet[str]] = {}
+		self.__subscriptions: Dict[str, FrozenSet[str]] = {}
+
+	def set_subscriptions(self, client_name: str, channels: Iterable[str]):
+		"""
+		Replace the channels subscribed by the client
+		"""
+		channels = frozenset(channels)
+		with self.__lock:
+			old_channels = self.__subscriptions.get(client_name, frozenset())
+			if channels == old_channels:
+				return
+			members = dict(self.__members)
+			for channel in old_channels - channels:
+				remaining = members[channel] - {client_name}
+				if len(remaining) > 0:
+					members[channel] = remaining
+				else:
+					del members[channel]
+			for channel in channels - old_channels:
+				members[channel] = members.get(channel, frozenset()) | {client_name}
+			self.__members = members
+			if len(channels) > 0:
+				self.__subscriptions[client_name] = channels
+			else:
+				self.__subscriptions.pop(client_name, None)
+
+	def get_members(self, channel: str) -> FrozenSet[str]:
+		return self.__members.get(channel, frozenset())
+
+	def get_subscriptions(self, client_name: str) -> FrozenSet[str]:
+		return self.__subscriptions.get(client_name, frozenset())
+
+	def is_member(self, channel: str, client_name: str) -> bool:
+		return client_name in self.__members.get(channel, ())
+
+	def get_channels(self) -> Dict[str, FrozenSet[str]]:
+		"""
+		:return: A snapshot of all channels and their members
+		"""
+		return self.__members
@@ -1,22 +1,25 @@
-import json
+import queue
 import random
 import socket
 import time
 from enum import Enum, auto
 from socket import timeout
-from threading import Event, RLock
-from threading import Thread
-from typing import Optional, Iterable, Callable, Any, Union, Collection, TypeVar, Type
+from threading import Event, RLock, Lock
+from typing import Optional, Iterable, Callable, Any, Union, Collection, TypeVar, Type, List, Dict
 
 from mcdreforged.utils.serializer import Serializable
 
 from chatbridge.common import constants
+from chatbridge.core import keep_alive
 from chatbridge.core.config import ClientInfo, ClientConfig
-from chatbridge.core.network import net_util
+from chatbridge.core.network import net_util, codec, compression, cryptor
 from chatbridge.core.network.basic import ChatBridgeBase, Address
 from chatbridge.core.network.protocol import ChatBridgePacket, PacketType, AbstractPacket, ChatPayload, \
-	KeepAlivePayload, AbstractPayload, CommandPayload, CustomPayload
+	KeepAlivePayload, AbstractPayload, CommandPayload, CustomPayload, StreamPayload
 from chatbridge.core.network.protocol import LoginPacket, LoginResultPacket
+from chatbridge.core.outbound_journal import OutboundJournal, OutboundJournalSettings
+from chatbridge.core.packet_trace import PacketTraceFilter
+from chatbridge.core.reconnect import ReconnectSettings, ReconnectBackoff, ReconnectStats
 
 
 class ClientStatus(Enum):
@@ -29,28 +32,65 @@ class ClientStatus(Enum):
 
 
 class ChatBridgeClient(ChatBridgeBase):
-	KEEP_ALIVE_INTERVAL = 60
-	KEEP_ALIVE_TIMEOUT = 15
 	_PACKET_CALLBACK = Callable[[dict], Any]
 	TIMEOUT = 10
 
-	def __init__(self, aes_key: str, info: ClientInfo, *, server_address: Optional[Address] = None):
+	def __init__(self, aes_key: str, info: ClientInfo, *, server_address: Optional[Address] = None, compression_threshold: int = compression.DEFAULT_THRESHOLD, keep_alive_settings: keep_alive.KeepAliveSettings = keep_alive.KeepAliveSettings(), outbound_journal_settings: Optional[OutboundJournalSettings] = None, channels: Collection[str] = (), multiplex_with: Optional['ChatBridgeClient'] = None, reconnect_settings: Optional[ReconnectSettings] = None):
+		"""
+		:param compression_threshold: Packets larger than this in bytes are sent compressed. -1 to disable compression
+		:param keep_alive_settings: When to send keep-alive pings and when to consider the connection dead
+		:param outbound_journal_settings: Where and how long to keep the packets sent while offline, so they are sent after logging in again.
+			None to drop the packets sent while offline
+		:param channels: The channels to subscribe at login, see :meth:`send_to_channel`
+		:param multiplex_with: Share the connection of this client instead of opening a new one. This client logs in on a stream
+			of the connection, and goes offline when the connection is lost. The server address and keep-alive settings are not used then
+		:param reconnect_settings: How long to wait before connecting again after the connection is lost or fails, until :meth:`stop` is called.
+			None to stay stopped until started again
+		"""
 		super().__init__(info.name, aes_key)
 		self.__server_address: Optional[Address] = server_address
+		self.__compression_threshold = compression_threshold
 		self.__sock: Optional[socket.socket] = None
 		self.__sock_lock = RLock()
+		self.__wire_format = net_util.WireFormat()
+		self.__frame_reader: Optional[net_util.FrameReader] = None
+		self.__frame_writer: Optional[net_util.FrameWriter] = None
 		self.__start_stop_lock = RLock()
 		self.__status = ClientStatus.STOPPED
 		self.__status_lock = RLock()
 		self.__connection_done = Event()
-		self.__keep_alive_received = Event()
-		self.__ping_array = []
+		self.__keep_alive_lock = Lock()
+		self.__keep_alive_task: Optional[keep_alive.KeepAliveTask] = None
+		self.__keep_alive_tracker = keep_alive.KeepAliveTracker(keep_alive_settings)
 		self.__info = info
-		self.__thread_keep_alive: Optional[Thread] = None
+		self.__channels = list(channels)
+		self.__outbound_journal = OutboundJournal(outbound_journal_settings, self.logger) if outbound_journal_settings is not None else None
+		self.packet_trace_filter = PacketTraceFilter()
+		# the session to resume after reconnecting, see :class:`chatbridge.core.session.Session`
+		self.__resume_token = ''
+		self.__received_frame_count = 0
+		# the streams opened on the connection of this client
+		self.__streams: Dict[int, ChatBridgeClient] = {}
+		self.__streams_lock = Lock()
+		self.__next_stream_id = 1
+		# the stream of this client on the connection of another client
+		self.__multiplex_owner = multiplex_with
+		self.__stream_id = 0
+		self.__stream_packets: 'queue.Queue[Optional[ChatBridgePacket]]' = queue.Queue()
+		self.__stream_open_result: Optional[StreamPayload] = None
+		self.__stream_open_done = Event()
+		# reconnection, enabled by start() and disabled by stop()
+		self.__reconnect_backoff = ReconnectBackoff(reconnect_settings) if reconnect_settings is not None else None
+		self.__reconnect_enabled = False
+		self.__reconnect_lock = Lock()
+		self.__reconnect_task: Optional[keep_alive.KeepAliveTask] = None
+		self.__reconnect_delay = 0.0
+		self.__reconnect_count = 0
+		self.__online_time: Optional[float] = None
 
 	@classmethod
 	def create(cls, config: ClientConfig):
-		return cls(config.aes_key, config.client_info, server_address=config.server_address)
+		return cls(config.aes_key, config.client_info, server_address=config.server_address, compression_threshold=config.compression_threshold, keep_alive_settings=config.keep_alive_settings, outbound_journal_settings=config.outbound_journal_settings, channels=config.channels, reconnect_settings=config.reconnect_settings)
 
 	# --------------
 	#     Status
@@ -101,7 +141,9 @@ class ChatBridgeClient(ChatBridgeBase):
 		"""
 		ping in second
 		"""
-		return -1 if len(self.__ping_array) == 0 else sum(self.__ping_array) / len(self.__ping_array)
+		if self.__multiplex_owner is not None:
+			return self.__multiplex_owner.ping
+		return self.__keep_alive_tracker.get_ping()
 
 	def get_ping_text(self) -> str:
 		if self.ping >= 0:
@@ -109,9 +151,31 @@ class ChatBridgeClient(ChatBridgeBase):
 		else:
 			return 'N/A'
 
-	def _set_socket(self, sock: Optional[socket.socket]):
+	def _set_socket(self, sock: Optional[socket.socket], frame_reader: Optional[net_util.FrameReader] = None):
+		"""
+		:param frame_reader: The receive buffer of the socket, if some data has already been read from the socket
+		"""
 		with self.__sock_lock:
 			self.__sock = sock
+			self.__wire_format = net_util.WireFormat()  # a new connection always starts with the legacy format for login
+			if sock is not None and frame_reader is None:
+				frame_reader = net_util.FrameReader(self._cryptor)
+			self.__frame_reader = frame_reader
+			self.__frame_writer = net_util.FrameWriter(sock) if sock is not None else None
+
+	def get_wire_format(self) -> net_util.WireFormat:
+		return self.__wire_format
+
+	def get_send_queue_size(self) -> int:
+		"""
+		The amount of bytes waiting to be sent, see :meth:`net_util.FrameWriter.get_queue_size`
+		"""
+		writer = self.__frame_writer
+		return writer.get_queue_size() if writer is not None else 0
+
+	def _set_wire_format(self, wire_format: net_util.WireFormat):
+		self.__wire_format = wire_format
+		self.logger.debug('Wire format set to {}'.format(wire_format))
 
 	def __connect(self):
 		"""
@@ -132,6 +196,11 @@ class ChatBridgeClient(ChatBridgeBase):
 		"""
 		if self._is_stopped():
 			return
+		if self.__multiplex_owner is not None:
+			self._set_status(ClientStatus.DISCONNECTED)
+			self.__multiplex_owner._close_stream(self.__stream_id, self)
+			self.__stream_packets.put(None)  # wake up the MainLoop thread
+			return
 		with self.__sock_lock:
 			self._set_status(ClientStatus.DISCONNECTED)  # set the status first so no exception errors get spammed
 			if self.__sock is not None:
@@ -139,9 +208,16 @@ class ChatBridgeClient(ChatBridgeBase):
 					self.__sock.close()
 				except:
 					pass
+			if self.__frame_writer is not None:
+				self.logger.debug('Sent {} frames with {} sendall calls'.format(self.__frame_writer.get_frame_count(), self.__frame_writer.get_batch_count()))
 			self._set_socket(None)
+		self.__close_all_streams()
 
 	def _tick_connection(self):
+		if self.__multiplex_owner is not None:
+			self.__tick_stream()
+			return
+		frame_reader = self.__frame_reader
 		try:
 			# self.logger.debug('Waiting for data received')
 			packet = self._receive_packet(ChatBridgePacket)
@@ -149,7 +225,14 @@ class ChatBridgeClient(ChatBridgeBase):
 			# self.logger.debug('Timeout, ignore')
 			pass
 		else:
-			self.logger.debug('Received packet with type {}: {}'.format(packet.type, packet.payload))
+			self.__received_frame_count += 1
+			self.__keep_alive_tracker.on_received(time.monotonic())
+			stream_id = frame_reader.get_stream_id()
+			if stream_id != 0:
+				self._on_stream_packet(stream_id, packet)
+				return
+			if self._should_trace_packet(packet):
+				self.logger.debug('Received packet with type {}: {}'.format(packet.type, packet.payload))
 			try:
 				self._on_packet(packet)
 			except:
@@ -160,8 +243,15 @@ class ChatBridgeClient(ChatBridgeBase):
 	# --------------
 
 	def start(self):
+		self.__start(reconnecting=False)
+
+	def __start(self, *, reconnecting: bool):
 		self.logger.debug('Starting client')
 		with self.__start_stop_lock:
+			if reconnecting and not self.__reconnect_enabled:
+				return  # stopped meanwhile
+			self.__reconnect_enabled = True
+			self.__cancel_reconnect()
 			if self.is_running():
 				self.logger.warning('Client is running, cannot start again')
 				return
@@ -174,6 +264,8 @@ class ChatBridgeClient(ChatBridgeBase):
 	def stop(self):
 		self.logger.debug('Stopping client')
 		with self.__start_stop_lock:
+			self.__reconnect_enabled = False
+			self.__cancel_reconnect()
 			if self._is_stopped():
 				self.logger.warning('Client is stopped, cannot stop again')
 				return
@@ -189,17 +281,72 @@ class ChatBridgeClient(ChatBridgeBase):
 			self.start()
 
 	def _connect_and_login(self):
+		if self.__multiplex_owner is not None:
+			self.__open_stream()
+			return
 		self.__connect()
-		self._send_packet(LoginPacket(name=self.__info.name, password=self.__info.password))
-		self._receive_packet(LoginResultPacket)
-		self.logger.info('Connected to the server')
+		self._send_packet(LoginPacket(
+			name=self.__info.name,
+			password=self.__info.password,
+			protocol_version=net_util.PROTOCOL_VERSION_LATEST,
+			codecs=codec.get_available_codec_names(),
+			compressions=compression.get_available_compression_names() if self.__compression_threshold >= 0 else [],
+			ciphers=cryptor.get_available_cipher_names() if not self._cryptor.is_key_empty() else [],
+			channels=self.__channels,
+			multiplex=True,
+			resume_token=self.__resume_token,
+			received_count=self.__received_frame_count,
+		))
+		result = self._receive_packet(LoginResultPacket)
+		if not net_util.PROTOCOL_VERSION_LEGACY <= result.protocol_version <= net_util.PROTOCOL_VERSION_LATEST:
+			raise ValueError('Unsupported protocol version {} from the server'.format(result.protocol_version))
+		if codec.get_codec(result.codec) is None:
+			raise ValueError('Unsupported codec {} from the server'.format(result.codec))
+		if result.compression != compression.NO_COMPRESSION and compression.get_compression(result.compression) is None:
+			raise ValueError('Unsupported compression {} from the server'.format(result.compression))
+		if result.cipher != cryptor.CIPHER_AES_CBC and self._cryptor.get_aead_cipher(result.cipher) is None:
+			raise ValueError('Unsupported cipher {} from the server'.format(result.cipher))
+		self._set_wire_format(net_util.WireFormat(
+			version=result.protocol_version,
+			codec=result.codec,
+			compression=result.compression,
+			compression_threshold=self.__compression_threshold,
+			cipher=result.cipher,
+			multiplex=result.multiplex and result.protocol_version != net_util.PROTOCOL_VERSION_LEGACY,
+		))
+		if not result.resumed:
+			self.__received_frame_count = 0
+		self.__resume_token = result.resume_token
+		self.logger.info('Connected to the server' if not result.resumed else 'Connected to the server, resumed the previous session')
+
+	def __go_online(self):
+		journal = self.__outbound_journal
+		if journal is None:
+			self._set_status(ClientStatus.ONLINE)
+			return
+		with journal.lock:
+			self._set_status(ClientStatus.ONLINE)
+
+			def send(packet: ChatBridgePacket):
+				if not self.is_online():
+					raise ConnectionError('Connection lost')
+				self._send_packet(packet)
+
+			try:
+				sent_count, expired_count = journal.replay(send)
+			except Exception as e:
+				self.logger.warning('Failed to send the packets in the outbound journal, {} packets left: {}'.format(len(journal), e))
+			else:
+				if sent_count > 0 or expired_count > 0:
+					self.logger.info('Sent {} packets from the outbound journal, {} too old packets discarded'.format(sent_count, expired_count))
 
 	def _main_loop(self):
 		try:
 			self._connect_and_login()
-			self._set_status(ClientStatus.ONLINE)
+			self.__go_online()
 		except Exception as e:
-			(self.logger.exception if self.logger.is_debug_enabled() else self.logger.error)('Failed to connect to {}: {}'.format(self.__server_address, e))
+			target = self.__server_address if self.__multiplex_owner is None else 'the connection of {}'.format(self.__multiplex_owner.get_name())
+			(self.logger.exception if self.logger.is_debug_enabled() else self.logger.error)('Failed to connect to {}: {}'.format(target, e))
 			self.__disconnect()
 			self.__connection_done.set()
 		else:
@@ -223,35 +370,102 @@ class ChatBridgeClient(ChatBridgeBase):
 			self._set_status(ClientStatus.STOPPED)
 
 	def _on_started(self):
+		self.__online_time = time.monotonic()
 		self.__connection_done.set()
-		self.__thread_keep_alive = self._start_keep_alive_thread()
-		self.__ping_array.clear()
+		if self.__multiplex_owner is None:  # the owner of the connection keeps it alive
+			self.__start_keep_alive()
 
 	def _on_stopped(self):
 		if self._is_connected():
 			self.__disconnect()
-		self.logger.debug('Joining keep alive thread')
-		self.__thread_keep_alive.join()
-		self.logger.debug('Joined keep alive thread')
+		self.__stop_keep_alive()
+
+	# ---------------------
+	#     Reconnection
+	# ---------------------
+
+	def _on_main_loop_exited(self):
+		backoff = self.__reconnect_backoff
+		if backoff is None:
+			return
+		with self.__reconnect_lock:
+			if not self.__reconnect_enabled or self.__reconnect_task is not None:
+				return
+			online_time, self.__online_time = self.__online_time, None
+			if online_time is not None and time.monotonic() - online_time >= backoff.settings.reset_after:
+				backoff.reset()
+			delay = backoff.next_delay()
+			self.__reconnect_delay = delay
+			self.__reconnect_task = keep_alive.get_scheduler().schedule(self.__on_reconnect_due, time.monotonic() + delay)
+		self.logger.info('Reconnecting in {}s'.format(round(delay, 1)))
+
+	def __on_reconnect_due(self, now: float) -> Optional[float]:
+		"""
+		Invoked on the keep-alive scheduler thread. Connecting might take a while, so it's done in a new thread
+		"""
+		with self.__reconnect_lock:
+			self.__reconnect_task = None
+			self.__reconnect_delay = 0.0
+			self.__reconnect_count += 1
+		self._start_thread(self.__reconnect, 'Reconnect')
+		return None
+
+	def __reconnect(self):
+		try:
+			self.__start(reconnecting=True)
+		except:
+			self.logger.exception('Failed to reconnect')
+
+	def __cancel_reconnect(self):
+		with self.__reconnect_lock:
+			if self.__reconnect_task is not None:
+				self.__reconnect_task.cancel()
+				self.__reconnect_task = None
+				self.__reconnect_delay = 0.0
+
+	def get_reconnect_stats(self) -> ReconnectStats:
+		backoff = self.__reconnect_backoff
+		with self.__reconnect_lock:
+			return ReconnectStats(reconnect_count=self.__reconnect_count, attempt_count=backoff.get_attempt() if backoff is not None else 0, backoff=self.__reconnect_delay)
 
 	# ---------------------
 	#   Packet core logic
 	# ---------------------
 
 	def _send_packet(self, packet: AbstractPacket):
-		if self._is_connected():
-			net_util.send_data(self.__sock, self._cryptor, packet)
+		if self.__multiplex_owner is not None:
+			if self._is_connected():
+				self.__multiplex_owner._send_stream_packet(self.__stream_id, packet)
+			else:
+				self.logger.warning('Trying to send a packet when not connected')
+			return
+		self._send_frame(net_util.encode_packet(self._cryptor, packet, self.__wire_format))
+
+	def _send_frame(self, frame: bytes):
+		"""
+		Send an already encoded packet, see :func:`net_util.encode_packet`
+
+		Can be called from any thread, the frame is sent through the send queue of the connection
+		"""
+		writer = self.__frame_writer
+		if self._is_connected() and writer is not None:
+			writer.write(frame)
 		else:
 			self.logger.warning('Trying to send a packet when not connected')
 
+	def _should_trace_packet(self, packet: ChatBridgePacket) -> bool:
+		"""
+		:return: If the received packet should be logged, according to the debug switch and the packet trace filter
+		"""
+		return self.logger.is_debug_enabled() and self.packet_trace_filter.accept((packet.sender,), packet.type)
+
 	T = TypeVar('T')
 
 	def _receive_packet(self, packet_type: Type[T]) -> T:
-		data_string = net_util.receive_data(self.__sock, self._cryptor, timeout=self.TIMEOUT)
 		try:
-			js_dict = json.loads(data_string)
+			js_dict = self.__frame_reader.read_frame(self.__sock, self.__wire_format, timeout=self.TIMEOUT)
 		except ValueError:
-			self.logger.exception('Fail to decode received string: {}'.format(data_string))
+			self.logger.exception('Fail to decode received data with wire format {}'.format(self.__wire_format))
 			raise
 		if packet_type is dict:
 			return js_dict
@@ -262,14 +476,30 @@ class ChatBridgeClient(ChatBridgeBase):
 			raise
 		return packet
 
-	def __build_and_send_packet(self, type_: str, receiver: Iterable[str], payload: AbstractPayload, *, is_broadcast: bool):
-		self._send_packet(ChatBridgePacket(
+	def __build_and_send_packet(self, type_: str, receiver: Iterable[str], payload: AbstractPayload, *, is_broadcast: bool, channel: str = ''):
+		packet = ChatBridgePacket(
 			sender=self.get_name(),
 			receivers=list(receiver),
 			broadcast=is_broadcast,
 			type=type_,
-			payload=payload.serialize()
-		))
+			payload=payload.serialize(),
+			channel=channel,
+		)
+		journal = self.__outbound_journal
+		if journal is not None and type_ != PacketType.keep_alive:
+			with journal.lock:
+				if not self.is_online():
+					journal.append(packet)
+					return
+				self._send_packet(packet)
+		else:
+			self._send_packet(packet)
+
+	def is_outbound_journal_enabled(self) -> bool:
+		"""
+		If the packets sent while offline are kept and sent after logging in again
+		"""
+		return self.__outbound_journal is not None
 
 	def send_to(self, type_: str, clients: Union[str, Iterable[str]], payload: AbstractPayload):
 		if isinstance(clients, str):
@@ -279,6 +509,18 @@ class ChatBridgeClient(ChatBridgeBase):
 	def send_to_all(self, type_: str, payload: AbstractPayload):
 		self.__build_and_send_packet(type_, [], payload, is_broadcast=True)
 
+	def send_to_channel(self, type_: str, channel: str, payload: AbstractPayload):
+		"""
+		Send to the members of the channel. The client needs to subscribe the channel at login
+		"""
+		self.__build_and_send_packet(type_, [], payload, is_broadcast=False, channel=channel)
+
+	def get_channels(self) -> List[str]:
+		"""
+		The channels to subscribe at login
+		"""
+		return list(self.__channels)
+
 	# -------------------------
 	#      Packet handlers
 	# -------------------------
@@ -295,12 +537,14 @@ class ChatBridgeClient(ChatBridgeBase):
 			self.on_command(packet.sender, CommandPayload.deserialize(packet.payload))
 		elif packet.type == PacketType.custom:
 			self.on_custom(packet.sender, CustomPayload.deserialize(packet.payload))
+		elif packet.type == PacketType.stream and packet.sender == constants.SERVER_NAME:
+			self.__on_stream_payload(StreamPayload.deserialize(packet.payload))
 
 	def _on_keep_alive(self, sender: str, payload: KeepAlivePayload):
 		if payload.is_ping():
 			self.send_to(PacketType.keep_alive, sender, KeepAlivePayload.pong())
 		elif payload.is_pong():
-			self.__keep_alive_received.set()
+			self.__on_keep_alive_pong()
 		else:
 			self.logger.warning('Unknown keep alive type: {}'.format(payload.ping_type))
 
@@ -313,6 +557,136 @@ class ChatBridgeClient(ChatBridgeBase):
 	def on_custom(self, sender: str, payload: CustomPayload):
 		pass
 
+	# -------------------------
+	#       Multiplexing
+	# -------------------------
+
+	def __open_stream(self):
+		"""
+		status: STARTING -> CONNECTED
+		"""
+		owner = self.__multiplex_owner
+		self._assert_status(ClientStatus.STARTING)
+		self._set_status(ClientStatus.CONNECTING)
+		self.logger.info('Opening a stream on the connection of {}'.format(owner.get_name()))
+		self.__stream_packets = queue.Queue()
+		self.__stream_open_result = None
+		self.__stream_open_done.clear()
+		self.__stream_id = owner._register_stream(self)
+		self._set_status(ClientStatus.CONNECTED)
+		try:
+			owner.__send_stream_payload(StreamPayload.open(self.__stream_id, self.__info.name, self.__info.password, self.__channels))
+			if not self.__stream_open_done.wait(self.TIMEOUT):
+				raise TimeoutError('No response from the server')
+			result = self.__stream_open_result
+			if result is None:
+				raise ConnectionError('Connection lost')
+			if not result.is_opened():
+				raise ConnectionRefusedError('Rejected by the server: {}'.format(result.message))
+		except:
+			owner._close_stream(self.__stream_id, self)
+			raise
+		self.logger.info('Logged in on stream {}'.format(self.__stream_id))
+
+	def __tick_stream(self):
+		try:
+			packet = self.__stream_packets.get(timeout=self.TIMEOUT)
+		except queue.Empty:
+			return
+		if packet is None:
+			return
+		if self._should_trace_packet(packet):
+			self.logger.debug('Received packet with type {}: {}'.format(packet.type, packet.payload))
+		try:
+			self._on_packet(packet)
+		except:
+			self.logger.exception('Fail to process packet {}'.format(packet))
+
+	def _register_stream(self, client: 'ChatBridgeClient') -> int:
+		"""
+		Allocate a stream on the connection of this client for the given client
+
+		:return: The stream id
+		"""
+		if not self.is_online():
+			raise ConnectionError('{} is not online'.format(self.get_name()))
+		if not self.__wire_format.multiplex:
+			raise ConnectionError('The server does not support multiplexing')
+		with self.__streams_lock:
+			if len(self.__streams) >= net_util.MAX_STREAM_ID:
+				raise ConnectionError('Too many streams')
+			while self.__next_stream_id in self.__streams:
+				self.__next_stream_id = self.__next_stream_id % net_util.MAX_STREAM_ID + 1
+			stream_id = self.__next_stream_id
+			self.__next_stream_id = self.__next_stream_id % net_util.MAX_STREAM_ID + 1
+			self.__streams[stream_id] = client
+		return stream_id
+
+	def _close_stream(self, stream_id: int, client: 'ChatBridgeClient'):
+		"""
+		Free the stream of the given client, and tell the server if the stream is still open
+		"""
+		with self.__streams_lock:
+			if self.__streams.get(stream_id) is not client:
+				return
+			del self.__streams[stream_id]
+		if self.is_online():
+			try:
+				self.__send_stream_payload(StreamPayload.close(stream_id))
+			except Exception as e:
+				self.logger.warning('Failed to close stream {}: {}'.format(stream_id, e))
+
+	def __send_stream_payload(self, payload: StreamPayload):
+		# not through send_to, so it's never kept in the outbound journal, whose packets are sent on a later connection
+		self._send_packet(ChatBridgePacket(
+			sender=self.get_name(),
+			receivers=[constants.SERVER_NAME],
+			broadcast=False,
+			type=PacketType.stream,
+			payload=payload.serialize(),
+		))
+
+	def __close_all_streams(self):
+		with self.__streams_lock:
+			streams = list(self.__streams.values())
+			self.__streams.clear()
+		for client in streams:
+			client._on_stream_closed()
+
+	def _send_stream_packet(self, stream_id: int, packet: AbstractPacket):
+		self._send_frame(net_util.encode_packet(self._cryptor, packet, self.__wire_format, stream_id))
+
+	def _on_stream_packet(self, stream_id: int, packet: ChatBridgePacket):
+		"""
+		Invoked on the MainLoop thread when a packet of the stream is received on the connection of this client
+		"""
+		client = self.__streams.get(stream_id)
+		if client is not None:
+			client.__stream_packets.put(packet)
+		else:
+			self.logger.debug('Discarded a packet of closed stream {}'.format(stream_id))
+
+	def __on_stream_payload(self, payload: StreamPayload):
+		with self.__streams_lock:
+			client = self.__streams.get(payload.stream_id)
+			if client is not None and (payload.is_rejected() or payload.is_close()):
+				del self.__streams[payload.stream_id]
+		if client is None:
+			return
+		if payload.is_opened() or payload.is_rejected():
+			client.__stream_open_result = payload
+			client.__stream_open_done.set()
+		elif payload.is_close():
+			client.logger.info('Stream {} closed by the server'.format(payload.stream_id))
+			client._on_stream_closed()
+
+	def _on_stream_closed(self):
+		"""
+		Invoked when the stream of this client is closed by the owner of the connection or the server
+		"""
+		self.__stream_open_done.set()
+		self.__disconnect()
+
 	# -------------------------
 	#   Send packet shortcuts
 	# -------------------------
@@ -338,47 +712,53 @@ class ChatBridgeClient(ChatBridgeBase):
 	def broadcast_custom(self, data: dict):
 		self.send_to_all(PacketType.chat, CustomPayload(data=data))
 
+	def send_chat_to_channel(self, channel: str, message: str, author: str = ''):
+		self.send_to_channel(PacketType.chat, channel, ChatPayload(author=author, message=message))
+
 	# -------------------
 	#   Keep Alive Impl
 	# -------------------
 
-	def _get_keep_alive_thread_name(self):
-		return 'KeepAlive'
-
-	def _start_keep_alive_thread(self) -> Thread:
-		return self._start_thread(self._keep_alive_loop, self._get_keep_alive_thread_name())
-
 	def _keep_alive_target(self) -> str:
 		return constants.SERVER_NAME
 
-	def _keep_alive_loop(self):
+	def __start_keep_alive(self):
+		now = time.monotonic()
+		self.__keep_alive_tracker.reset(now)
+		with self.__keep_alive_lock:
+			self.__keep_alive_task = keep_alive.get_scheduler().schedule(self.__tick_keep_alive, now + random.random())
+
+	def __stop_keep_alive(self):
+		with self.__keep_alive_lock:
+			if self.__keep_alive_task is not None:
+				self.__keep_alive_task.cancel()
+				self.__keep_alive_task = None
+
+	def __tick_keep_alive(self, now: float) -> Optional[float]:
 		"""
-		Except to have the same life-span as the connection
+		Invoked on the keep-alive scheduler thread, see :data:`keep_alive.KeepAliveTick`
 		"""
-		while self.is_online():
-			time.sleep(random.random())
-			if not self.is_online():
-				break
-			self.__keep_alive_received.clear()
-			time_sent = time.monotonic()
-			try:
-				self._send_keep_alive_ping()
-			except:
+		if not self.is_online():
+			return None
+		action = self.__keep_alive_tracker.update(now)
+		if action.timed_out:
+			self.logger.warning('Disconnect due to keep-alive timeout')
+			self.__disconnect()
+			return None
+		if action.send_ping:
+			keep_alive.get_scheduler().submit(self.__send_keep_alive_ping)
+		return action.next_time
+
+	def __send_keep_alive_ping(self):
+		if not self.is_online():
+			return
+		try:
+			self._send_keep_alive_ping()
+		except:
+			if self.is_online():
 				self.logger.exception('Disconnect due to keep-alive ping error')
 				self.__disconnect()
-				continue
-			self.__keep_alive_received.wait(self.KEEP_ALIVE_TIMEOUT)
-			if not self.is_online():
-				break
-			if self.__keep_alive_received.is_set():
-				self.__ping_array.append(time.monotonic() - time_sent)
-				if len(self.__ping_array) > 5:
-					self.__ping_array.pop(0)
-				self.logger.debug('Keep-alive responded, ping = {}ms'.format(round(self.ping * 1000, 2)))
-			else:
-				self.logger.warning('Disconnect due to keep-alive ping timeout')
-				self.__disconnect()
-			for i in range(self.KEEP_ALIVE_INTERVAL * 10):
-				time.sleep(0.1)
-				if not self.is_online():
-					break
+
+	def __on_keep_alive_pong(self):
+		if self.__keep_alive_tracker.on_pong(time.monotonic()) is not None:
+			self.logger.debug('Keep-alive responded, ping = {}ms'.format(round(self.ping * 1000, 2)))
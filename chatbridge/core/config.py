@@ -1,19 +1,47 @@
 from abc import ABC
-from typing import List
+from typing import List, Optional, NamedTuple, Tuple
 
 from mcdreforged.utils.serializer import Serializable
 
 from chatbridge.common.serializer import NoMissingFieldSerializable
+from chatbridge.core.keep_alive import KeepAliveSettings
 from chatbridge.core.network.basic import Address
+from chatbridge.core.outbound_journal import OutboundJournalSettings
+from chatbridge.core.reconnect import ReconnectSettings
+from chatbridge.core.replay_buffer import ReplayBufferSettings
+from chatbridge.core.send_queue import SendQueueSettings, OverflowPolicy
+from chatbridge.core.session import SessionSettings
 
 
 class BasicConfig(Serializable, ABC):
 	aes_key: str = 'ThisIstheSecret'
+	compression_threshold: int = 1024  # packets larger than this in bytes are sent compressed. -1 to disable compression
+	keep_alive_interval: float = 60  # send a keep-alive ping after this many seconds without receiving anything
+	keep_alive_timeout: float = 15  # disconnect if still nothing is received this many seconds after the keep-alive ping
+	ping_sample_interval: float = 300  # send a keep-alive ping at least this often on busy connections, to measure the ping
+
+	@property
+	def keep_alive_settings(self) -> KeepAliveSettings:
+		return KeepAliveSettings(interval=self.keep_alive_interval, timeout=self.keep_alive_timeout, ping_sample_interval=self.ping_sample_interval)
 
 
 class ClientInfo(NoMissingFieldSerializable):
 	name: str
 	password: str
+	replay_missed_packets: bool = False  # keep the packets sent to the client while it's offline, and deliver them after it reconnects
+	session_resume_timeout: float = 0  # the client reconnecting within this many seconds after losing its connection resumes its session. 0 to disable
+
+
+class FederationPeerInfo(NoMissingFieldSerializable):
+	name: str  # the hub name of the peer
+	password: str  # the password used by the hub that dials the link. Both hubs of a link should use the same one
+	hostname: str = ''  # the address to dial the peer. Leave it empty to wait for the peer to dial this hub instead
+	port: int = 30001
+
+
+class FederationSettings(NamedTuple):
+	hub_name: str  # the name of this hub, used as the client name when dialing the peers
+	peers: Tuple[FederationPeerInfo, ...] = ()
 
 
 class ClientConfig(BasicConfig):
@@ -21,6 +49,14 @@ class ClientConfig(BasicConfig):
 	password: str = 'MyClientPassword'
 	server_hostname: str = '127.0.0.1'
 	server_port: int = 30001
+	channels: List[str] = []  # the channels to subscribe at login, so packets sent to these channels are received
+	outbound_journal: bool = False  # keep the packets sent while offline on the disk, and send them after logging in again
+	outbound_journal_directory: str = 'outbound_journal'
+	outbound_journal_max_size: int = 64  # the maximum total size of the journal in MiB. The oldest packets are discarded when it's full
+	outbound_journal_max_age: float = 600  # packets older than this in seconds are discarded instead of sent
+	auto_reconnect: bool = True  # connect again when the connection is lost or fails, waiting longer after every failed attempt
+	reconnect_initial_delay: float = 1  # the maximum delay before the first attempt in seconds
+	reconnect_max_delay: float = 60  # the cap of the delay between the attempts in seconds
 
 	@property
 	def client_info(self) -> ClientInfo:
@@ -30,10 +66,57 @@ class ClientConfig(BasicConfig):
 	def server_address(self) -> Address:
 		return Address(hostname=self.server_hostname, port=self.server_port)
 
+	@property
+	def outbound_journal_settings(self) -> Optional[OutboundJournalSettings]:
+		if not self.outbound_journal:
+			return None
+		return OutboundJournalSettings(directory=self.outbound_journal_directory, max_size=self.outbound_journal_max_size * 2 ** 20, max_age=self.outbound_journal_max_age)
+
+	@property
+	def reconnect_settings(self) -> Optional[ReconnectSettings]:
+		if not self.auto_reconnect:
+			return None
+		return ReconnectSettings(initial_delay=self.reconnect_initial_delay, max_delay=self.reconnect_max_delay)
+
+
+class ServerEngine:
+	thread = 'thread'  # one thread per client connection
+	selector = 'selector'  # all client connections multiplexed on a single event loop thread
+
 
 class ServerConfig(BasicConfig):
 	hostname: str = 'localhost'
 	port: int = 30001
+	engine: str = ServerEngine.thread
+	async_logging: bool = False  # write the logs in a background thread, so the network threads never wait for the console or the disk
+	log_rotate_size: int = 0  # rotate the log file when it grows larger than this in MiB, 0 to disable
+	log_rotate_daily: bool = False  # rotate the log file when the date changes
+	replay_buffer_max_count: int = 1000  # the maximum amount of missed packets kept for each offline client with replay_missed_packets enabled
+	replay_buffer_max_size: int = 1024  # the maximum total size of the missed packets kept for each offline client in KiB
+	replay_buffer_max_age: float = 300  # missed packets older than this in seconds are discarded
+	send_queue_max_size: int = 4096  # the maximum total size of the packets queued for each client in KiB
+	send_queue_overflow_policy: str = OverflowPolicy.drop_oldest_chat  # what to do when a client cannot receive packets fast enough: "drop_oldest_chat", "disconnect" or "block"
+	session_resume_window_size: int = 256  # the maximum total size of the latest packets kept for each client with session_resume_timeout set in KiB, to be sent again when it resumes
+	federation_hub_name: str = ''  # the name of this hub in the federation. Leave it empty to disable the federation
+	federation_peers: List[FederationPeerInfo] = []  # the peer hubs linked to this hub
 	clients: List[ClientInfo] = [
 		ClientInfo(name='MyClientName', password='MyClientPassword')
 	]
+
+	@property
+	def replay_buffer_settings(self) -> ReplayBufferSettings:
+		return ReplayBufferSettings(max_count=self.replay_buffer_max_count, max_size=self.replay_buffer_max_size * 2 ** 10, max_age=self.replay_buffer_max_age)
+
+	@property
+	def send_queue_settings(self) -> SendQueueSettings:
+		return SendQueueSettings(max_size=self.send_queue_max_size * 2 ** 10, overflow_policy=self.send_queue_overflow_policy)
+
+	@property
+	def session_settings(self) -> SessionSettings:
+		return SessionSettings(window_size=self.session_resume_window_size * 2 ** 10)
+
+	@property
+	def federation_settings(self) -> Optional[FederationSettings]:
+		if self.federation_hub_name == '':
+			return None
+		return FederationSettings(hub_name=self.federation_hub_name, peers=tuple(self.federation_peers))
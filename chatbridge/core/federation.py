@@ -0,0 +1,332 @@
+"""
+Server-to-server federation, so the clients can be spread over several hubs
+
+Each pair of peer hubs shares one link, dialed by the hub that has the address of the other.
+The dialing hub logs in to the other hub like a client, with its hub name and the peer password, so the link is authenticated
+and uses the same encryption and keep-alive as the client connections
+
+Hubs exchange their client directories over the links, and route the packets to the hub that owns the receivers.
+A directory sent to a peer includes the clients learned from the other peers, so hubs without a direct link can reach each other.
+Every routed packet carries the hubs that have received it, and is never sent to them again, so it cannot loop.
+It also carries an id given by the hub where it entered the federation. A hub reached by several paths, e.g. in a cycle of links,
+drops the copies with an id it has seen recently, so the packet is delivered once per hub
+"""
+import collections
+import itertools
+import secrets
+import time
+from threading import Thread, Event, Lock
+from typing import TYPE_CHECKING, Dict, List, FrozenSet, Optional, Tuple, Deque, Set
+
+from chatbridge.core.client import ChatBridgeClient
+from chatbridge.core.config import FederationPeerInfo, ClientInfo, FederationSettings
+from chatbridge.core.network.basic import Address
+from chatbridge.core.network.protocol import ChatBridgePacket, PacketType, FederationPayload, ChatPayload
+
+if TYPE_CHECKING:
+	from chatbridge.core.server import ChatBridgeServer, AnyClientConnection
+
+
+class _PeerLink(ChatBridgeClient):
+	"""
+	The link dialed to a peer hub
+	"""
+	def __init__(self, federation: 'Federation', peer: FederationPeerInfo):
+		self.federation = federation
+		self.peer = peer
+		server = federation.server
+		super().__init__(server.aes_key, ClientInfo(name=federation.hub_name, password=peer.password), server_address=Address(peer.hostname, peer.port), compression_threshold=server.compression_threshold, keep_alive_settings=server.keep_alive_settings)
+		if server.logger.file_handler is not None:
+			self.logger.addHandler(server.logger.file_handler)
+
+	def get_logging_name(self) -> str:
+		return 'Federation.{}'.format(self.peer.name)
+
+	def get_logging_file_name(self) -> Optional[str]:
+		return None
+
+	def _get_main_loop_thread_name(self):
+		return super()._get_main_loop_thread_name() + '.' + self.peer.name
+
+	def _on_started(self):
+		super()._on_started()
+		self.federation._on_link_started(self.peer.name)
+
+	def _on_packet(self, packet: ChatBridgePacket):
+		if packet.type == PacketType.federation:
+			self.federation.on_peer_packet(self.peer.name, packet)
+		else:
+			super()._on_packet(packet)
+
+
+class _PacketIdWindow:
+	"""
+	The ids of the recently routed packets. Thread safe
+	"""
+	def __init__(self, duration: float, capacity: int):
+		self.duration = duration
+		self.capacity = capacity
+		self.__lock = Lock()
+		self.__ids: Set[str] = set()
+		self.__queue: Deque[Tuple[float, str]] = collections.deque()  # (time, id), the oldest first
+
+	def add(self, packet_id: str) -> bool:
+		"""
+		:return: If the id is new, False if it's still in the window
+		"""
+		now = time.monotonic()
+		with self.__lock:
+			while len(self.__queue) > 0 and (now - self.__queue[0][0] > self.duration or len(self.__queue) >= self.capacity):
+				self.__ids.discard(self.__queue.popleft()[1])
+			if packet_id in self.__ids:
+				return False
+			self.__ids.add(packet_id)
+			self.__queue.append((now, packet_id))
+			return True
+
+
+class Federation:
+	RECONNECT_INTERVAL = 5
+	DEDUP_WINDOW = 60  # a packet reaching a hub again within this many seconds is dropped
+	DEDUP_CAPACITY = 100000  # the maximum amount of packet ids kept for that
+	_ACTION_DIRECTORY = 'directory'
+	_ACTION_ROUTE = 'route'
+
+	def __init__(self, server: 'ChatBridgeServer', settings: FederationSettings):
+		self.server = server
+		self.logger = server.logger
+		self.hub_name = settings.hub_name
+		self.peers: Dict[str, FederationPeerInfo] = {peer.name: peer for peer in settings.peers}
+		self.__links: Dict[str, _PeerLink] = {}  # the links dialed by this hub
+		self.__connections: Dict[str, 'AnyClientConnection'] = {}  # the links dialed by the peer hubs
+		for peer in settings.peers:
+			if peer.hostname != '':
+				self.__links[peer.name] = _PeerLink(self, peer)
+			else:
+				self.__connections[peer.name] = server._create_connection(ClientInfo(name=peer.name, password=peer.password))
+		self.__lock = Lock()
+		self.__directories: Dict[str, Tuple[FrozenSet[str], FrozenSet[str]]] = {}  # peer name -> (clients of the peer, clients relayed by the peer)
+		self.__routes: Dict[str, str] = {}  # client name -> the peer to pass the packets to
+		self.__advertised: Dict[str, Tuple[FrozenSet[str], FrozenSet[str]]] = {}  # the directory last sent to each peer
+		self.__packet_id_prefix = '{}.{}.'.format(self.hub_name, secrets.token_hex(4))  # a restarted hub doesn't reuse the ids
+		self.__packet_id_counter = itertools.count()
+		self.__seen_packet_ids = _PacketIdWindow(self.DEDUP_WINDOW, self.DEDUP_CAPACITY)
+		self.__stop_event = Event()
+		self.__thread: Optional[Thread] = None
+
+	# --------------
+	#   Lifecycle
+	# --------------
+
+	def start(self):
+		self.__stop_event.clear()
+		if len(self.__links) > 0:
+			self.__thread = Thread(target=self.__link_loop, name='Federation', daemon=True)
+			self.__thread.start()
+
+	def stop(self):
+		self.__stop_event.set()
+		if self.__thread is not None:
+			self.__thread.join()
+			self.__thread = None
+		for link in self.__links.values():
+			if link.is_running():
+				link.stop()
+		for connection in self.__connections.values():
+			if connection.is_running():
+				connection.stop()
+
+	def __link_loop(self):
+		while not self.__stop_event.is_set():
+			for link in self.__links.values():
+				if not link.is_running() and not self.__stop_event.is_set():
+					try:
+						link.start()
+					except:
+						self.logger.exception('Error starting the federation link to {}'.format(link.peer.name))
+			self.__stop_event.wait(self.RECONNECT_INTERVAL)
+
+	def get_connection(self, peer_name: str) -> Optional['AnyClientConnection']:
+		"""
+		:return: The connection for the peer hub that dials this hub
+		"""
+		return self.__connections.get(peer_name)
+
+	def is_peer_connection(self, connection: 'AnyClientConnection') -> bool:
+		return self.__connections.get(connection.info.name) is connection
+
+	def is_peer_online(self, peer_name: str) -> bool:
+		link = self.__links.get(peer_name)
+		if link is not None:
+			return link.is_online()
+		connection = self.__connections.get(peer_name)
+		return connection is not None and connection.is_online()
+
+	def get_directory(self, peer_name: str) -> FrozenSet[str]:
+		"""
+		:return: The clients reachable through the peer hub
+		"""
+		owned, relayed = self.__directories.get(peer_name, (frozenset(), frozenset()))
+		return owned | relayed
+
+	# --------------
+	#   Directories
+	# --------------
+
+	def __get_directory_for(self, peer_name: str) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+		"""
+		:return: The clients of this hub, and the clients learned from the other peers
+		"""
+		owned = frozenset(self.server.clients.keys())
+		relayed = set()
+		for other_peer, (other_owned, other_relayed) in self.__directories.items():
+			if other_peer != peer_name:  # the peer already knows the clients it told us, and must not route them back here
+				relayed.update(other_owned)
+				relayed.update(other_relayed)
+		relayed.difference_update(owned)
+		relayed.difference_update(self.__directories.get(peer_name, (frozenset(), frozenset()))[0])
+		relayed.difference_update(self.peers.keys())
+		relayed.discard(self.hub_name)
+		return owned, frozenset(relayed)
+
+	def __send_directory(self, peer_name: str, *, force: bool, reply: bool = False):
+		with self.__lock:
+			directory = self.__get_directory_for(peer_name)
+			if not force and self.__advertised.get(peer_name) == directory:
+				return
+			self.__advertised[peer_name] = directory
+		owned, relayed = directory
+		self.__send_to_peer(peer_name, FederationPayload(action=self._ACTION_DIRECTORY, hub=self.hub_name, clients=sorted(owned), relayed_clients=sorted(relayed), reply=reply))
+
+	def advertise_directory(self):
+		"""
+		Send the directory to the peers whose view of it is outdated, e.g. after a client is added
+		"""
+		for peer_name in self.peers.keys():
+			if self.is_peer_online(peer_name):
+				self.__send_directory(peer_name, force=False)
+
+	def _on_link_started(self, peer_name: str):
+		self.logger.info('Federation link to {} established'.format(peer_name))
+		self.__send_directory(peer_name, force=True, reply=True)
+
+	def __on_directory(self, peer_name: str, payload: FederationPayload):
+		with self.__lock:
+			# clients of this hub relayed back by the peer are ignored, they are always delivered locally
+			self.__directories[peer_name] = (frozenset(payload.clients), frozenset(payload.relayed_clients).difference(self.server.clients.keys()))
+			# prefer the hub owning the client over the hubs relaying it
+			routes = {}
+			for name, (owned, relayed) in self.__directories.items():
+				for client_name in relayed:
+					routes.setdefault(client_name, name)
+			for name, (owned, relayed) in self.__directories.items():
+				for client_name in owned:
+					routes[client_name] = name
+			self.__routes = routes
+		self.logger.info('Received the directory of {} with {} clients and {} relayed clients'.format(peer_name, len(payload.clients), len(payload.relayed_clients)))
+		if payload.reply:
+			self.__send_directory(peer_name, force=True)
+		for other_peer in self.peers.keys():
+			if other_peer != peer_name and self.is_peer_online(other_peer):
+				self.__send_directory(other_peer, force=False)
+
+	# --------------
+	#    Routing
+	# --------------
+
+	def __send_to_peer(self, peer_name: str, payload: FederationPayload):
+		link = self.__links.get(peer_name)
+		if link is not None:
+			if link.is_online():
+				link.send_to(PacketType.federation, peer_name, payload)
+			return
+		connection = self.__connections.get(peer_name)
+		if connection is not None:
+			self.server._send_or_buffer(connection, ChatBridgePacket(
+				sender=self.hub_name,
+				receivers=[peer_name],
+				broadcast=False,
+				type=PacketType.federation,
+				payload=payload.serialize()
+			))
+
+	def __send_route(self, peer_name: str, packet: ChatBridgePacket, visited: List[str], packet_id: str):
+		self.__send_to_peer(peer_name, FederationPayload(action=self._ACTION_ROUTE, hub=self.hub_name, visited=visited, packet=packet.serialize(), packet_id=packet_id))
+
+	def forward(self, packet: ChatBridgePacket, remote_receivers: List[str], visited: List[str], packet_id: str = ''):
+		"""
+		Forward the packet to the peer hubs
+
+		:param remote_receivers: The receivers not on this hub. Ignored for broadcasts and channel packets, which go to every hub
+		:param visited: The hubs that have received the packet. The packet is never sent to them again, so it cannot loop
+		:param packet_id: The id of the packet given by the hub where it entered the federation, empty to give it a new one
+		"""
+		if self.hub_name not in visited:
+			visited = visited + [self.hub_name]
+		if packet_id == '':
+			packet_id = self.__packet_id_prefix + str(next(self.__packet_id_counter))
+			self.__seen_packet_ids.add(packet_id)
+		if packet.broadcast or packet.channel != '':
+			targets = [peer_name for peer_name in self.peers.keys() if peer_name not in visited and self.is_peer_online(peer_name)]
+			# the peers receiving the packet from this hub are marked as visited too, so they don't pass it to each other
+			visited = visited + targets
+			for peer_name in targets:
+				self.__send_route(peer_name, packet, visited, packet_id)
+		else:
+			routes = self.__routes
+			receivers_by_peer: Dict[str, List[str]] = {}
+			for receiver_name in remote_receivers:
+				peer_name = routes.get(receiver_name)
+				if peer_name is None:
+					self.logger.warning('Unknown client name {}'.format(receiver_name))
+				elif peer_name in visited:
+					pass
+				elif not self.is_peer_online(peer_name):
+					self.logger.debug('Dropped a packet to {} since peer hub {} is offline'.format(receiver_name, peer_name))
+				else:
+					receivers_by_peer.setdefault(peer_name, []).append(receiver_name)
+			for peer_name, receivers in receivers_by_peer.items():
+				self.__send_route(peer_name, ChatBridgePacket(
+					sender=packet.sender,
+					receivers=receivers,
+					broadcast=False,
+					type=packet.type,
+					payload=packet.payload,
+					channel=packet.channel,
+				), visited, packet_id)
+
+	def on_peer_packet(self, peer_name: str, packet: ChatBridgePacket):
+		try:
+			payload = FederationPayload.deserialize(packet.payload)
+		except:
+			self.logger.exception('Error when deserialize federation packet from {}'.format(peer_name))
+			return
+		if payload.action == self._ACTION_DIRECTORY:
+			self.__on_directory(peer_name, payload)
+		elif payload.action == self._ACTION_ROUTE:
+			try:
+				routed_packet = ChatBridgePacket.deserialize(payload.packet)
+			except:
+				self.logger.exception('Error when deserialize routed packet from {}'.format(peer_name))
+				return
+			if payload.packet_id != '' and not self.__seen_packet_ids.add(payload.packet_id):
+				self.logger.debug('Dropped packet {} from {} since it has been routed here through another hub'.format(payload.packet_id, peer_name))
+				return
+			self.server.log_packet(routed_packet, to_client=False)
+			if routed_packet.type == PacketType.chat:
+				try:
+					self.server.on_chat(routed_packet.sender, ChatPayload.deserialize(routed_packet.payload))
+				except:
+					self.logger.exception('Error when deserialize chat packet routed from {}'.format(peer_name))
+			self.server._route_packet(routed_packet, payload.visited, payload.packet_id)
+		else:
+			self.logger.warning('Unknown federation action {} from {}'.format(payload.action, peer_name))
+
+	def get_status_lines(self) -> List[str]:
+		lines = []
+		for peer_name, peer in self.peers.items():
+			lines.append('- {} ({}): online = {}, clients = {}'.format(
+				peer_name, 'dialing {}:{}'.format(peer.hostname, peer.port) if peer.hostname != '' else 'dialed by the peer',
+				self.is_peer_online(peer_name), len(self.get_directory(peer_name))
+			))
+		return lines
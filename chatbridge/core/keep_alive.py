@@ -0,0 +1,206 @@
+"""
+Keep-alive of the connections
+
+A process-wide scheduler drives the keep-alive of all client connections. Instead of a thread per connection
+waking up periodically, a single thread keeps the keep-alive tasks in a heap ordered by the time they need attention
+next, and sleeps until the earliest one is due. So the idle cost and the thread count no longer grow with the amount of connections
+
+The liveness of a connection is judged by the last time a frame is received from it, so busy connections don't need pings.
+Pings are sent when the connection is idle, and occasionally on busy connections to keep the ping value up to date
+"""
+import collections
+import heapq
+import itertools
+import time
+from concurrent.futures.thread import ThreadPoolExecutor
+from threading import Condition, Thread, Lock
+from typing import Callable, Optional, List, Tuple, NamedTuple, Deque
+
+from chatbridge.common.logger import ChatBridgeLogger
+
+
+class KeepAliveSettings(NamedTuple):
+	interval: float = 60  # send a ping after this many seconds without receiving anything
+	timeout: float = 15  # disconnect if still nothing is received this many seconds after the ping
+	ping_sample_interval: float = 300  # send a ping at least this often even if the connection is busy, to measure the ping
+
+
+class KeepAliveAction(NamedTuple):
+	timed_out: bool  # the connection should be closed
+	send_ping: bool  # a ping should be sent now
+	next_time: float  # the time.monotonic() value when the tracker should be updated next time
+
+
+class KeepAliveTracker:
+	"""
+	Liveness and ping bookkeeping of a connection, based on the receive time of the frames. Thread safe
+	"""
+	PING_SAMPLE_COUNT = 5
+
+	def __init__(self, settings: KeepAliveSettings):
+		self.settings = settings
+		self.__lock = Lock()
+		self.__last_receive_time = 0.0
+		self.__ping_sent_time: Optional[float] = None
+		self.__last_ping_time = float('-inf')
+		self.__pings: Deque[float] = collections.deque(maxlen=self.PING_SAMPLE_COUNT)
+
+	def reset(self, now: float):
+		"""
+		Invoked when the connection starts
+		"""
+		with self.__lock:
+			self.__last_receive_time = now
+			self.__ping_sent_time = None
+			self.__last_ping_time = float('-inf')
+			self.__pings.clear()
+
+	def on_received(self, now: float):
+		"""
+		Invoked when some data is received from the connection
+		"""
+		self.__last_receive_time = now  # a single assignment, no need to lock for this hot path
+
+	def on_pong(self, now: float) -> Optional[float]:
+		"""
+		:return: The ping in second, or None if no ping is waiting for response
+		"""
+		with self.__lock:
+			if self.__ping_sent_time is None:
+				return None
+			ping = now - self.__ping_sent_time
+			self.__pings.append(ping)
+			self.__ping_sent_time = None
+			return ping
+
+	def get_ping(self) -> float:
+		"""
+		:return: The average ping of the recent samples in second, or -1 if there's no sample
+		"""
+		pings = list(self.__pings)
+		return -1 if len(pings) == 0 else sum(pings) / len(pings)
+
+	def update(self, now: float) -> KeepAliveAction:
+		"""
+		Check the liveness of the connection and decide whether to send a ping
+		"""
+		settings = self.settings
+		with self.__lock:
+			last_receive_time = self.__last_receive_time
+			if now - last_receive_time >= settings.interval + settings.timeout:
+				return KeepAliveAction(timed_out=True, send_ping=False, next_time=now)
+			if self.__ping_sent_time is not None and now - self.__ping_sent_time >= settings.timeout:
+				self.__ping_sent_time = None  # the pong is lost, but the liveness is still judged by the receive time
+			send_ping = False
+			if self.__ping_sent_time is None and (now - last_receive_time >= settings.interval or now - self.__last_ping_time >= settings.ping_sample_interval):
+				self.__ping_sent_time = self.__last_ping_time = now
+				send_ping = True
+			next_time = last_receive_time + settings.interval + settings.timeout
+			if self.__ping_sent_time is not None:
+				next_time = min(next_time, self.__ping_sent_time + settings.timeout)
+			else:
+				next_time = min(next_time, last_receive_time + settings.interval, self.__last_ping_time + settings.ping_sample_interval)
+			return KeepAliveAction(timed_out=False, send_ping=send_ping, next_time=next_time)
+
+
+# Invoked with the current time.monotonic() value on the scheduler thread
+# Returns the time.monotonic() value to be invoked next time, or None to finish the task
+KeepAliveTick = Callable[[float], Optional[float]]
+
+
+class KeepAliveTask:
+	def __init__(self, tick: KeepAliveTick):
+		self.tick = tick
+		self.__cancelled = False
+
+	def cancel(self):
+		"""
+		The task is dropped the next time it's due. Thread safe
+		"""
+		self.__cancelled = True
+
+	def is_cancelled(self) -> bool:
+		return self.__cancelled
+
+
+class KeepAliveScheduler:
+	# blocking I/O, e.g. sending a ping to a stalled peer, is done in these threads to keep the scheduler thread responsive
+	MAX_SENDER_COUNT = 4
+
+	def __init__(self):
+		self.logger = ChatBridgeLogger('KeepAlive')
+		self.__condition = Condition(Lock())
+		self.__heap: List[Tuple[float, int, KeepAliveTask]] = []
+		self.__counter = itertools.count()  # breaks ties in the heap
+		self.__thread: Optional[Thread] = None
+		self.__executor = ThreadPoolExecutor(max_workers=self.MAX_SENDER_COUNT, thread_name_prefix='KeepAliveSender')
+
+	def get_task_count(self) -> int:
+		with self.__condition:
+			return len(self.__heap)
+
+	def schedule(self, tick: KeepAliveTick, when: float) -> KeepAliveTask:
+		"""
+		Schedule a keep-alive task. Thread safe
+
+		:param tick: The tick function of the task, see :data:`KeepAliveTick`
+		:param when: The time.monotonic() value when the task is firstly ticked
+		"""
+		task = KeepAliveTask(tick)
+		with self.__condition:
+			self.__push(task, when)
+			if self.__thread is None:
+				self.__thread = Thread(target=self.__loop, name='KeepAlive', daemon=True)
+				self.__thread.start()
+		return task
+
+	def submit(self, func: Callable[[], None]):
+		"""
+		Execute a function that might block, e.g. sending a packet, in the sender threads
+		"""
+		self.__executor.submit(func)
+
+	def __push(self, task: KeepAliveTask, when: float):
+		heapq.heappush(self.__heap, (when, next(self.__counter), task))
+		if self.__heap[0][2] is task:
+			self.__condition.notify()
+
+	def __pop_due_task(self) -> Tuple[float, KeepAliveTask]:
+		with self.__condition:
+			while True:
+				now = time.monotonic()
+				if len(self.__heap) == 0:
+					self.__condition.wait()
+				elif self.__heap[0][0] > now:
+					self.__condition.wait(self.__heap[0][0] - now)
+				else:
+					return now, heapq.heappop(self.__heap)[2]
+
+	def __loop(self):
+		while True:
+			now, task = self.__pop_due_task()
+			if task.is_cancelled():
+				continue
+			try:
+				next_time = task.tick(now)
+			except:
+				self.logger.exception('Error ticking keep-alive task {}'.format(task.tick))
+				continue
+			if next_time is not None and not task.is_cancelled():
+				with self.__condition:
+					self.__push(task, next_time)
+
+
+_scheduler: Optional[KeepAliveScheduler] = None
+_scheduler_lock = Lock()
+
+
+def get_scheduler() -> KeepAliveScheduler:
+	"""
+	:return: The keep-alive scheduler shared by all clients and server connections in the process
+	"""
+	global _scheduler
+	with _scheduler_lock:
+		if _scheduler is None:
+			_scheduler = KeepAliveScheduler()
+		return _scheduler
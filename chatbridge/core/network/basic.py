@@ -50,6 +50,7 @@ class ChatBridgeBase:
 			self.logger.close_file()
 			with self.__thread_run_lock:
 				self.__thread_run = None
+			self._on_main_loop_exited()
 
 		with self.__thread_run_lock:
 			if self.__thread_run is not None:
@@ -73,3 +74,9 @@ class ChatBridgeBase:
 
 	def _main_loop(self):
 		pass
+
+	def _on_main_loop_exited(self):
+		"""
+		Invoked on the MainLoop thread when it's about to exit, and it can be started again
+		"""
+		pass
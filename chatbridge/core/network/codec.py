@@ -0,0 +1,125 @@
+"""
+Codecs that turn the serialized packets into bytes and back
+
+JSON is always available. Compact binary codecs are used when their optional library is installed on both sides
+"""
+import json
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+try:
+	import cbor2
+except ImportError:
+	cbor2 = None
+
+__all__ = [
+	'AbstractCodec',
+	'JsonCodec',
+	'MsgpackCodec',
+	'CborCodec',
+	'DEFAULT_CODEC',
+	'get_codec',
+	'get_available_codec_names',
+	'negotiate_codec',
+]
+
+
+class AbstractCodec(ABC):
+	name: str
+
+	@classmethod
+	def is_available(cls) -> bool:
+		return True
+
+	@abstractmethod
+	def encode(self, data: dict) -> bytes:
+		raise NotImplementedError()
+
+	@abstractmethod
+	def decode(self, data: bytes) -> dict:
+		"""
+		:param data: A bytes-like object
+		:raise ValueError: If the data cannot be decoded
+		"""
+		raise NotImplementedError()
+
+
+class JsonCodec(AbstractCodec):
+	name = 'json'
+
+	def encode(self, data: dict) -> bytes:
+		return json.dumps(data, ensure_ascii=False).encode('utf8')
+
+	def decode(self, data: bytes) -> dict:
+		return json.loads(str(data, 'utf8'))
+
+
+class MsgpackCodec(AbstractCodec):
+	name = 'msgpack'
+
+	@classmethod
+	def is_available(cls) -> bool:
+		return msgpack is not None
+
+	def encode(self, data: dict) -> bytes:
+		return msgpack.packb(data, use_bin_type=True)
+
+	def decode(self, data: bytes) -> dict:
+		try:
+			return msgpack.unpackb(data, raw=False)
+		except Exception as e:
+			raise ValueError('Invalid msgpack data: {}'.format(e))
+
+
+class CborCodec(AbstractCodec):
+	name = 'cbor'
+
+	@classmethod
+	def is_available(cls) -> bool:
+		return cbor2 is not None
+
+	def encode(self, data: dict) -> bytes:
+		return cbor2.dumps(data)
+
+	def decode(self, data: bytes) -> dict:
+		try:
+			return cbor2.loads(data)
+		except Exception as e:
+			raise ValueError('Invalid cbor data: {}'.format(e))
+
+
+DEFAULT_CODEC = JsonCodec.name
+
+# in the order of preference
+_CODECS: Dict[str, AbstractCodec] = {
+	codec.name: codec
+	for codec in (MsgpackCodec(), CborCodec(), JsonCodec())
+	if codec.is_available()
+}
+
+
+def get_codec(name: str) -> Optional[AbstractCodec]:
+	return _CODECS.get(name)
+
+
+def get_available_codec_names() -> List[str]:
+	"""
+	:return: Names of the codecs that can be used in this environment, in the order of preference
+	"""
+	return list(_CODECS.keys())
+
+
+def negotiate_codec(client_codecs: List[str]) -> str:
+	"""
+	:param client_codecs: Codecs the client supports, in the order of the client's preference
+	:return: The first codec in the client's list that is also available here, or the default codec
+	"""
+	for name in client_codecs:
+		if name in _CODECS:
+			return name
+	return DEFAULT_CODEC
@@ -0,0 +1,133 @@
+"""
+Compression of the frame payloads, applied to the codec output before the encryption
+
+A frame is compressed only if its payload is larger than the compression threshold of the sender,
+and the frame header carries a flag for it, so small packets skip the compressor entirely
+"""
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+__all__ = [
+	'AbstractCompression',
+	'ZlibCompression',
+	'DictionaryZlibCompression',
+	'NO_COMPRESSION',
+	'DEFAULT_THRESHOLD',
+	'get_compression',
+	'get_available_compression_names',
+	'negotiate_compression',
+]
+
+NO_COMPRESSION = ''
+DEFAULT_THRESHOLD = 1024  # in bytes
+MAXIMUM_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+
+# Common fragments of ChatBridge packets, e.g. command results like !!online and !!stats.
+# zlib favors the strings at the end of the dictionary, so the most common ones are placed last
+_PRESET_DICTIONARY = ''.join([
+	'Players in 2 Minecraft servers:", "[survival] (3): ", "[creative] (1): ", "[mirror] (0): ", "Total players online: ',
+	'§r §e§l#1§r §a§l#2§r §b§l#3§r §6§l#4§r §7#5 §7#6 §7#7 §7#8 §7#9 §7#10 §7#11 §7#12 §7#13 §7#14 §7#15 ',
+	'"stats_name": "Used Diamond Pickaxe", "minecraft:used", "minecraft:mined", "minecraft:killed", "minecraft:custom", ',
+	'"error_code": 0, "total": ',
+	'"result": {"data": ["',
+	'"command": "!!online", "command": "!!stats rank ',
+	'"params": {"player": "',
+	'"cid": "',
+	'"responded": false, "responded": true, ',
+	'"ping_type": "ping", "ping_type": "pong"',
+	'{"sender": "', '"receivers": [], "receivers": ["', '"broadcast": true, "broadcast": false, ',
+	'"type": "chatbridge.command", "type": "chatbridge.custom", "type": "chatbridge.chat", ',
+	'"payload": {"author": "', '"message": "',
+]).encode('utf8')
+
+
+class AbstractCompression(ABC):
+	name: str
+
+	@classmethod
+	def is_available(cls) -> bool:
+		return True
+
+	@abstractmethod
+	def compress(self, data: bytes) -> bytes:
+		raise NotImplementedError()
+
+	@abstractmethod
+	def decompress(self, data: bytes) -> bytes:
+		"""
+		:param data: A bytes-like object
+		:raise ValueError: If the data cannot be decompressed, or the decompressed data is too large
+		"""
+		raise NotImplementedError()
+
+
+class ZlibCompression(AbstractCompression):
+	name = 'zlib'
+	LEVEL = 6
+	DICTIONARY: Optional[bytes] = None
+
+	def __init__(self):
+		# creating the zlib objects, especially with a dictionary, costs more than copying them
+		# raw deflate stream without the zlib header, since the peers have agreed on everything at login
+		if self.DICTIONARY is not None:
+			self.__compressor = zlib.compressobj(self.LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.DICTIONARY)
+			self.__decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=self.DICTIONARY)
+		else:
+			self.__compressor = zlib.compressobj(self.LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+			self.__decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+	def compress(self, data: bytes) -> bytes:
+		compressor = self.__compressor.copy()
+		return compressor.compress(data) + compressor.flush()
+
+	def decompress(self, data: bytes) -> bytes:
+		decompressor = self.__decompressor.copy()
+		try:
+			result = decompressor.decompress(data, MAXIMUM_DECOMPRESSED_SIZE)
+		except zlib.error as e:
+			raise ValueError('Invalid {} data: {}'.format(self.name, e))
+		if len(decompressor.unconsumed_tail) > 0:
+			raise ValueError('Decompressed data is larger than {} bytes'.format(MAXIMUM_DECOMPRESSED_SIZE))
+		if not decompressor.eof:
+			raise ValueError('Incomplete {} data'.format(self.name))
+		return result
+
+
+class DictionaryZlibCompression(ZlibCompression):
+	"""
+	zlib with a preset dictionary for ChatBridge packets. The dictionary is part of the protocol and must never be changed,
+	add a new compression with a new name instead
+	"""
+	name = 'zlib-dict'
+	DICTIONARY = _PRESET_DICTIONARY
+
+
+# in the order of preference
+_COMPRESSIONS: Dict[str, AbstractCompression] = {
+	compression.name: compression
+	for compression in (DictionaryZlibCompression(), ZlibCompression())
+	if compression.is_available()
+}
+
+
+def get_compression(name: str) -> Optional[AbstractCompression]:
+	return _COMPRESSIONS.get(name)
+
+
+def get_available_compression_names() -> List[str]:
+	"""
+	:return: Names of the compressions that can be used in this environment, in the order of preference
+	"""
+	return list(_COMPRESSIONS.keys())
+
+
+def negotiate_compression(client_compressions: List[str]) -> str:
+	"""
+	:param client_compressions: Compressions the client supports, in the order of the client's preference
+	:return: The first compression in the client's list that is also available here, or :data:`NO_COMPRESSION`
+	"""
+	for name in client_compressions:
+		if name in _COMPRESSIONS:
+			return name
+	return NO_COMPRESSION
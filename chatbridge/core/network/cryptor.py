@@ -1,8 +1,138 @@
 import hashlib
+import itertools
+import os
+from abc import ABC, abstractmethod
 from binascii import b2a_hex, a2b_hex
+from threading import Lock
+from typing import Dict, List, Optional
 
 from Crypto.Cipher import AES
 
+try:
+	from cryptography.exceptions import InvalidTag
+	from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+except ImportError:
+	InvalidTag = AESGCM = ChaCha20Poly1305 = None
+
+# The cipher of the legacy protocol, and the default one of the binary protocol
+CIPHER_AES_CBC = 'aes-cbc'
+
+
+class AeadCipher(ABC):
+	"""
+	An authenticated cipher with a key derived from the AES key. Corrupted or forged frames fail the tag check,
+	and are rejected before being decoded
+
+	Encrypted data layout: nonce (12 bytes), ciphertext, tag (16 bytes)
+
+	Each nonce is an 8-byte random prefix plus a 4-byte counter, the prefix is re-generated after the counter wraps.
+	So the nonces never repeat for a cipher object, and can hardly collide with the ones from other peers sharing the key
+
+	The key schedule is computed once in the constructor, the nonce is passed to every call
+	"""
+	name: str
+	NONCE_SIZE = 12
+	TAG_SIZE = 16
+	OVERHEAD = NONCE_SIZE + TAG_SIZE
+	__COUNTER_LIMIT = 2 ** 32
+
+	def __init__(self, aes_key: bytes):
+		self._aead = self._create(hashlib.sha256(aes_key + b'\0chatbridge.' + self.name.encode('utf8')).digest())
+		self.__nonce_lock = Lock()
+		self.__nonce_prefix = os.urandom(8)
+		self.__nonce_counter = itertools.count()
+
+	@classmethod
+	def is_available(cls) -> bool:
+		return True
+
+	def __next_nonce(self) -> bytes:
+		with self.__nonce_lock:
+			counter = next(self.__nonce_counter)
+			if counter >= self.__COUNTER_LIMIT:
+				self.__nonce_prefix = os.urandom(8)
+				self.__nonce_counter = itertools.count(1)
+				counter = 0
+			return self.__nonce_prefix + counter.to_bytes(4, 'big')
+
+	@classmethod
+	@abstractmethod
+	def _create(cls, key: bytes):
+		"""
+		:return: A reusable AEAD object of the cryptography package, with the encrypt(nonce, data, associated_data) api
+		"""
+		raise NotImplementedError()
+
+	def encrypt(self, data: bytes, associated_data: bytes) -> bytes:
+		"""
+		:param associated_data: Data that is authenticated but not encrypted, e.g. the frame header
+		"""
+		nonce = self.__next_nonce()
+		return nonce + self._aead.encrypt(nonce, bytes(data), associated_data)  # the tag is appended to the ciphertext
+
+	def decrypt(self, data: bytes, associated_data: bytes) -> bytes:
+		"""
+		:param data: A bytes-like object
+		:raise ValueError: If the data is too short, or the authentication fails
+		"""
+		if len(data) < self.OVERHEAD:
+			raise ValueError('Encrypted data too short')
+		try:
+			return self._aead.decrypt(bytes(data[:self.NONCE_SIZE]), bytes(data[self.NONCE_SIZE:]), associated_data)
+		except InvalidTag:
+			raise ValueError('MAC check failed') from None
+
+
+class AesGcmCipher(AeadCipher):
+	name = 'aes-gcm'
+
+	@classmethod
+	def is_available(cls) -> bool:
+		return AESGCM is not None
+
+	@classmethod
+	def _create(cls, key: bytes):
+		return AESGCM(key)
+
+
+class ChaCha20Poly1305Cipher(AeadCipher):
+	name = 'chacha20-poly1305'
+
+	@classmethod
+	def is_available(cls) -> bool:
+		return ChaCha20Poly1305 is not None
+
+	@classmethod
+	def _create(cls, key: bytes):
+		return ChaCha20Poly1305(key)
+
+
+# in the order of preference. The AEAD ciphers need the optional cryptography package, without it AES-CBC is used.
+# pycryptodome is not used for them, since it builds a cipher object for every frame, which is a few times slower than AES-CBC
+_AEAD_CIPHER_CLASSES = tuple(cipher_class for cipher_class in (AesGcmCipher, ChaCha20Poly1305Cipher) if cipher_class.is_available())
+
+
+def get_available_cipher_names() -> List[str]:
+	"""
+	:return: Names of the AEAD ciphers, in the order of preference. The legacy AES-CBC cipher is not included
+	"""
+	return [cipher_class.name for cipher_class in _AEAD_CIPHER_CLASSES]
+
+
+def negotiate_cipher(client_ciphers: List[str]) -> str:
+	"""
+	The AEAD ciphers need the optional cryptography package. If it's not installed on either side,
+	AES-CBC is negotiated silently, without any warning
+
+	:param client_ciphers: AEAD ciphers the client supports, in the order of the client's preference
+	:return: The first cipher in the client's list that is also available here, or :data:`CIPHER_AES_CBC`
+	"""
+	available = get_available_cipher_names()
+	for name in client_ciphers:
+		if name in available:
+			return name
+	return CIPHER_AES_CBC
+
 
 class AESCryptor:
 	def __init__(self, key: str, mode=AES.MODE_CBC):
@@ -10,14 +140,27 @@ class AESCryptor:
 		self.__key_empty = len(key) == 0
 		self.__hashed_key = hashlib.sha256(self.key).digest()  # a 32-length bytes
 		self.mode = mode
+		self.__aead_ciphers: Dict[str, AeadCipher] = {cipher_class.name: cipher_class(self.__hashed_key) for cipher_class in _AEAD_CIPHER_CLASSES}
+
+	def is_key_empty(self) -> bool:
+		"""
+		With an empty key, data is sent as plain text
+		"""
+		return self.__key_empty
+
+	def get_aead_cipher(self, name: str) -> Optional[AeadCipher]:
+		return self.__aead_ciphers.get(name)
 
 	def get_cryptor(self):
 		return AES.new(self.__hashed_key, self.mode, self.__hashed_key[:16])
 
 	@staticmethod
 	def __to_16_length_bytes(text: str) -> bytes:
-		text_bytes = text.encode('utf8')
-		return text_bytes + (b'\0' * ((16 - (len(text_bytes) % 16)) % 16))
+		return AESCryptor.__pad_16_length(text.encode('utf8'))
+
+	@staticmethod
+	def __pad_16_length(data: bytes) -> bytes:
+		return data + (b'\0' * ((16 - (len(data) % 16)) % 16))
 
 	def encrypt(self, text: str) -> bytes:
 		if self.__key_empty:
@@ -26,9 +169,32 @@ class AESCryptor:
 
 	def decrypt(self, byte_data: bytes) -> str:
 		if self.__key_empty:
-			return byte_data.decode('utf8')
+			return str(byte_data, 'utf8')
 		return self.get_cryptor().decrypt(a2b_hex(byte_data)).decode('utf8').rstrip('\0')
 
+	def encrypt_bytes(self, data: bytes) -> bytes:
+		"""
+		Encrypt into raw ciphertext, without the hex armoring in :meth:`encrypt`
+
+		PKCS#7 padding is used instead of the zero padding in :meth:`encrypt`, since binary data might end with zeros
+		"""
+		if self.__key_empty:
+			return data
+		padding = 16 - len(data) % 16
+		return self.get_cryptor().encrypt(bytes(data) + bytes((padding,)) * padding)
+
+	def decrypt_bytes(self, data: bytes) -> bytes:
+		"""
+		:raise ValueError: If the data is not a valid ciphertext from :meth:`encrypt_bytes`
+		"""
+		if self.__key_empty:
+			return bytes(data)
+		plain = self.get_cryptor().decrypt(data)
+		padding = plain[-1] if len(plain) > 0 else 0
+		if not 1 <= padding <= 16 or plain[-padding:] != bytes((padding,)) * padding:
+			raise ValueError('Invalid padding')
+		return plain[:-padding]
+
 
 if __name__ == '__main__':
 	aes = AESCryptor('test_pwd')
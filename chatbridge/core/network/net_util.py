@@ -1,38 +1,318 @@
 import json
 import socket
 import struct
+from threading import Condition, Lock
+from typing import NamedTuple, Optional, Union, List, Tuple
 
-from chatbridge.core.network.cryptor import AESCryptor
+from chatbridge.core.network import codec, compression
+from chatbridge.core.network.codec import DEFAULT_CODEC
+from chatbridge.core.network.compression import NO_COMPRESSION, DEFAULT_THRESHOLD
+from chatbridge.core.network.cryptor import AESCryptor, CIPHER_AES_CBC
 from chatbridge.core.network.protocol import AbstractPacket
 
 __all__ = [
+	'PROTOCOL_VERSION_LEGACY',
+	'PROTOCOL_VERSION_BINARY',
+	'PROTOCOL_VERSION_LATEST',
+	'FRAME_FLAG_COMPRESSED',
+	'FRAME_FLAG_STREAM',
+	'MAX_STREAM_ID',
+	'WireFormat',
+	'negotiate_protocol_version',
+	'encode_packet',
 	'send_data',
-	'receive_data',
+	'FrameReader',
+	'FrameWriter',
 	'EmptyContent',
+	'InvalidFrame',
 ]
 
-RECEIVE_BUFFER_SIZE = 1024
+RECEIVE_BUFFER_SIZE = 64 * 1024
+MAX_FRAME_SIZE = 16 * 2 ** 20  # larger frames are rejected, so a broken peer can't make the receive buffer grow without bound
+
+# Frame: native-endian uint32 length header, then the hex armored ciphertext
+PROTOCOL_VERSION_LEGACY = 2
+# Frame: network-order header with uint8 version, uint8 flags and uint32 length, then the raw ciphertext
+PROTOCOL_VERSION_BINARY = 3
+PROTOCOL_VERSION_LATEST = PROTOCOL_VERSION_BINARY
+
+# Frame flags of the binary version
+FRAME_FLAG_COMPRESSED = 0x01  # the payload is compressed with the negotiated compression before encrypted
+FRAME_FLAG_STREAM = 0x02  # the header is followed by a uint16 stream id, which is a part of the header. Only with multiplex negotiated
+MAX_STREAM_ID = 0xFFFF
+
+_LEGACY_HEADER = struct.Struct('I')
+_BINARY_HEADER = struct.Struct('!BBI')
+_STREAM_ID = struct.Struct('!H')
 
 
 class EmptyContent(socket.error):
 	pass
 
 
-def send_data(sock: socket.socket, cryptor: AESCryptor, packet: AbstractPacket):
-	encrypted_data = cryptor.encrypt(json.dumps(packet.serialize(), ensure_ascii=False))
-	packet_data = struct.pack('I', len(encrypted_data)) + encrypted_data
-	sock.sendall(packet_data)
-
-
-def receive_data(sock: socket.socket, cryptor: AESCryptor, *, timeout: float) -> str:
-	sock.settimeout(timeout)
-	header = sock.recv(4)
-	if len(header) < 4:
-		raise EmptyContent('Empty content received')
-	remaining_data_length = struct.unpack('I', header)[0]
-	encrypted_data = bytes()
-	while remaining_data_length > 0:
-		buf = sock.recv(min(remaining_data_length, RECEIVE_BUFFER_SIZE))
-		encrypted_data += buf
-		remaining_data_length -= len(buf)
-	return cryptor.decrypt(encrypted_data)
+class InvalidFrame(socket.error):
+	pass
+
+
+class WireFormat(NamedTuple):
+	"""
+	How packets are encoded on the wire for a connection. Negotiated during login
+	"""
+	version: int = PROTOCOL_VERSION_LEGACY
+	codec: str = DEFAULT_CODEC  # always the default codec in the legacy version
+	compression: str = NO_COMPRESSION  # always no compression in the legacy version
+	compression_threshold: int = DEFAULT_THRESHOLD  # of the sender, payloads not larger than it are sent uncompressed
+	cipher: str = CIPHER_AES_CBC  # always AES-CBC in the legacy version
+	multiplex: bool = False  # if frames can be tagged with stream ids, so several logical clients share the connection. Never in the legacy version
+
+	@property
+	def header(self) -> struct.Struct:
+		return _LEGACY_HEADER if self.version == PROTOCOL_VERSION_LEGACY else _BINARY_HEADER
+
+
+def negotiate_protocol_version(client_version: int) -> int:
+	"""
+	:param client_version: The latest protocol version the client supports
+	:return: The protocol version to be used by the connection
+	"""
+	return max(PROTOCOL_VERSION_LEGACY, min(client_version, PROTOCOL_VERSION_LATEST))
+
+
+def encode_packet(cryptor: AESCryptor, packet: AbstractPacket, wire_format: WireFormat = WireFormat(), stream_id: int = 0) -> bytes:
+	"""
+	Build the bytes to be sent on the wire for the given packet, header included
+
+	:param stream_id: The stream of the logical client the packet belongs to, 0 for the client owning the connection
+	"""
+	if wire_format.version == PROTOCOL_VERSION_LEGACY:
+		encrypted_data = cryptor.encrypt(json.dumps(packet.serialize(), ensure_ascii=False))
+		return _LEGACY_HEADER.pack(len(encrypted_data)) + encrypted_data
+	else:
+		data = codec.get_codec(wire_format.codec).encode(packet.serialize())
+		flags = 0
+		if wire_format.compression != NO_COMPRESSION and len(data) > wire_format.compression_threshold:
+			data = compression.get_compression(wire_format.compression).compress(data)
+			flags |= FRAME_FLAG_COMPRESSED
+		stream_header = b''
+		if stream_id != 0:
+			assert wire_format.multiplex
+			flags |= FRAME_FLAG_STREAM
+			stream_header = _STREAM_ID.pack(stream_id)
+		if wire_format.cipher == CIPHER_AES_CBC:
+			encrypted_data = cryptor.encrypt_bytes(data)
+			return _BINARY_HEADER.pack(wire_format.version, flags, len(encrypted_data)) + stream_header + encrypted_data
+		else:
+			aead_cipher = cryptor.get_aead_cipher(wire_format.cipher)
+			header = _BINARY_HEADER.pack(wire_format.version, flags, len(data) + aead_cipher.OVERHEAD) + stream_header
+			return header + aead_cipher.encrypt(data, header)
+
+
+def _parse_header(buffer: Union[bytes, bytearray], offset: int, wire_format: WireFormat) -> Tuple[int, int]:
+	"""
+	:return: A tuple of the frame flags and the length of the frame body
+	"""
+	if wire_format.version == PROTOCOL_VERSION_LEGACY:
+		return 0, _LEGACY_HEADER.unpack_from(buffer, offset)[0]
+	version, flags, length = _BINARY_HEADER.unpack_from(buffer, offset)
+	if version != wire_format.version:
+		raise InvalidFrame('Unexpected frame version {}, expected {}'.format(version, wire_format.version))
+	allowed_flags = FRAME_FLAG_COMPRESSED if wire_format.compression != NO_COMPRESSION else 0
+	if wire_format.multiplex:
+		allowed_flags |= FRAME_FLAG_STREAM
+	if flags & ~allowed_flags != 0:
+		raise InvalidFrame('Unknown frame flags {}'.format(flags))
+	return flags, length
+
+
+def _decode_body(cryptor: AESCryptor, header: memoryview, body: memoryview, flags: int, wire_format: WireFormat) -> dict:
+	if wire_format.version == PROTOCOL_VERSION_LEGACY:
+		return json.loads(cryptor.decrypt(body))
+	else:
+		if wire_format.cipher == CIPHER_AES_CBC:
+			data = cryptor.decrypt_bytes(body)
+		else:
+			data = cryptor.get_aead_cipher(wire_format.cipher).decrypt(body, header)
+		if flags & FRAME_FLAG_COMPRESSED:
+			data = compression.get_compression(wire_format.compression).decompress(data)
+		return codec.get_codec(wire_format.codec).decode(data)
+
+
+def send_data(sock: socket.socket, cryptor: AESCryptor, packet: AbstractPacket, wire_format: WireFormat = WireFormat()):
+	sock.sendall(encode_packet(cryptor, packet, wire_format))
+
+
+class FrameReader:
+	"""
+	The receive buffer of a connection
+
+	Data is received in large chunks with ``recv_into`` into a reused buffer, so a single syscall can deliver several frames.
+	Frames are decoded straight from the buffer through memoryviews, without copying the received data around
+	"""
+	def __init__(self, cryptor: AESCryptor, buffer_size: int = RECEIVE_BUFFER_SIZE, max_frame_size: int = MAX_FRAME_SIZE):
+		self.__cryptor = cryptor
+		self.__max_frame_size = max_frame_size
+		self.__buffer = bytearray(buffer_size)
+		self.__start = 0  # where the unconsumed data starts
+		self.__end = 0  # where the received data ends
+		self.__stream_id = 0
+
+	def get_stream_id(self) -> int:
+		"""
+		:return: The stream id of the last popped frame, 0 if it's not tagged with a stream
+		"""
+		return self.__stream_id
+
+	def get_buffered_size(self) -> int:
+		return self.__end - self.__start
+
+	def __reserve(self):
+		"""
+		Make sure there's free space at the tail of the buffer
+		"""
+		if self.__end < len(self.__buffer):
+			return
+		size = self.__end - self.__start
+		if self.__start > 0:
+			view = memoryview(self.__buffer)
+			view[:size] = view[self.__start:self.__end]
+			view.release()
+			self.__start, self.__end = 0, size
+		if size == len(self.__buffer):
+			# a frame larger than the whole buffer, grow as the data arrives
+			self.__buffer.extend(bytes(len(self.__buffer)))
+
+	def receive(self, sock: socket.socket) -> int:
+		"""
+		Receive available data from the socket into the buffer with a single recv call
+
+		:return: The amount of bytes received
+		:raise EmptyContent: If the connection is closed by the peer
+		"""
+		self.__reserve()
+		amount = sock.recv_into(memoryview(self.__buffer)[self.__end:])
+		if amount == 0:
+			raise EmptyContent('Empty content received')
+		self.__end += amount
+		return amount
+
+	def pop_frame(self, wire_format: WireFormat) -> Optional[dict]:
+		"""
+		Pop the first complete frame from the buffer and decode it
+
+		:return: The decoded serialized packet, or None if there's no complete frame in the buffer
+		:raise ValueError: If the frame content cannot be decoded
+		:raise InvalidFrame: If the frame header is invalid, or the frame is larger than the size limit
+		"""
+		header_size = wire_format.header.size
+		if self.__end - self.__start < header_size:
+			return None
+		frame_start = self.__start
+		flags, body_length = _parse_header(self.__buffer, frame_start, wire_format)
+		if body_length > self.__max_frame_size:
+			raise InvalidFrame('Frame of {} bytes is larger than the limit {}'.format(body_length, self.__max_frame_size))
+		stream_id = 0
+		if flags & FRAME_FLAG_STREAM:
+			if self.__end - frame_start < header_size + _STREAM_ID.size:
+				return None
+			stream_id = _STREAM_ID.unpack_from(self.__buffer, frame_start + header_size)[0]
+			header_size += _STREAM_ID.size
+		body_start = frame_start + header_size
+		body_end = body_start + body_length
+		if body_end > self.__end:
+			return None
+		self.__stream_id = stream_id
+		self.__start = body_end
+		if self.__start == self.__end:
+			self.__start = self.__end = 0
+		header = memoryview(self.__buffer)[frame_start:body_start]
+		body = memoryview(self.__buffer)[body_start:body_end]
+		try:
+			return _decode_body(self.__cryptor, header, body, flags, wire_format)
+		finally:
+			header.release()
+			body.release()
+
+	def read_frame(self, sock: socket.socket, wire_format: WireFormat, *, timeout: float) -> dict:
+		"""
+		Block until a frame is available, then pop and decode it
+
+		Data of an incomplete frame is kept in the buffer if the socket times out
+		"""
+		sock.settimeout(timeout)
+		while True:
+			data = self.pop_frame(wire_format)
+			if data is not None:
+				return data
+			self.receive(sock)
+
+
+class FrameWriter:
+	"""
+	The send queue of a connection, shared by all threads that send data to the socket
+
+	Frames are queued first. If no thread is sending, the current thread becomes the sender and keeps sending out the queue,
+	all frames queued so far in a single ``sendall``, until the queue is empty.
+	Other threads just wait for their frames to be sent. Frames never interleave on the socket,
+	and a burst of frames from several threads costs only a few syscalls
+	"""
+	def __init__(self, sock: socket.socket):
+		self.__sock = sock
+		self.__condition = Condition(Lock())
+		self.__queue: List[bytes] = []
+		self.__sending = False
+		self.__queued_frame_count = 0
+		self.__sent_frame_count = 0  # frames with index below this have been handed to the socket
+		self.__batch_count = 0
+
+	def get_queue_size(self) -> int:
+		"""
+		:return: The amount of bytes queued and not yet handed to the socket
+		"""
+		with self.__condition:
+			return sum(map(len, self.__queue))
+
+	def get_frame_count(self) -> int:
+		return self.__sent_frame_count
+
+	def get_batch_count(self) -> int:
+		"""
+		:return: The amount of ``sendall`` calls done
+		"""
+		return self.__batch_count
+
+	def write(self, frame: bytes):
+		"""
+		Queue the frame and wait until it's handed to the socket, by the current thread or by the thread that is sending
+
+		Exceptions from the socket are raised in the sending thread
+		"""
+		with self.__condition:
+			self.__queue.append(frame)
+			self.__queued_frame_count += 1
+			frame_index = self.__queued_frame_count
+			while self.__sending and self.__sent_frame_count < frame_index:
+				self.__condition.wait()
+			if self.__sent_frame_count >= frame_index:
+				return
+			self.__sending = True
+			frames, self.__queue = self.__queue, []
+			sent_frame_count = self.__queued_frame_count
+		while True:
+			self.__batch_count += 1
+			try:
+				self.__sock.sendall(frames[0] if len(frames) == 1 else b''.join(frames))
+			except BaseException:
+				# the remaining frames are left to their own threads, which get the error when they send
+				with self.__condition:
+					self.__sent_frame_count = sent_frame_count
+					self.__sending = False
+					self.__condition.notify_all()
+				raise
+			with self.__condition:
+				self.__sent_frame_count = sent_frame_count
+				self.__condition.notify_all()
+				if len(self.__queue) == 0:
+					self.__sending = False
+					return
+				frames, self.__queue = self.__queue, []
+				sent_frame_count = self.__queued_frame_count
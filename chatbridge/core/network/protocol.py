@@ -19,10 +19,25 @@ class AbstractPacket(NoMissingFieldSerializable, ABC):
 class LoginPacket(AbstractPacket):
 	name: str
 	password: str
+	protocol_version: int = 2  # the latest protocol version supported by the client
+	codecs: List[str] = ['json']  # payload codecs supported by the client, in the order of preference
+	compressions: List[str] = []  # payload compressions supported by the client, in the order of preference
+	ciphers: List[str] = []  # AEAD ciphers supported by the client, in the order of preference
+	channels: List[str] = []  # the channels to subscribe
+	multiplex: bool = False  # if the client wants to open streams for other logical clients on the connection
+	resume_token: str = ''  # the token from the last login result, to resume that session instead of starting a new one
+	received_count: int = 0  # the amount of frames received after the last login result, so the server knows what to send again
 
 
 class LoginResultPacket(AbstractPacket):
 	message: str  # will be "ok"
+	protocol_version: int = 2  # the protocol version to be used after login
+	codec: str = 'json'  # the payload codec to be used after login
+	compression: str = ''  # the payload compression to be used after login, empty for no compression
+	cipher: str = 'aes-cbc'  # the cipher to be used after login
+	multiplex: bool = False  # if frames can be tagged with stream ids after login
+	resume_token: str = ''  # the token to resume the session after reconnecting, empty if it cannot be resumed
+	resumed: bool = False  # if the session of the resume token in the login packet is resumed, so the frames it missed are sent again
 
 
 class PacketType:
@@ -30,6 +45,8 @@ class PacketType:
 	chat = 'chatbridge.chat'
 	command = 'chatbridge.command'
 	custom = 'chatbridge.custom'
+	federation = 'chatbridge.federation'  # exchanged between peer hubs only
+	stream = 'chatbridge.stream'  # opens and closes the streams of a multiplexed connection, exchanged between its owner and the server only
 
 
 class ChatBridgePacket(AbstractPacket):
@@ -38,6 +55,7 @@ class ChatBridgePacket(AbstractPacket):
 	broadcast: bool
 	type: str
 	payload: dict
+	channel: str = ''  # if not empty, the packet is delivered to the members of this channel, instead of the receivers or everyone
 
 # ==============
 #     Payload
@@ -116,3 +134,56 @@ class CommandPayload(AbstractPayload):
 
 class CustomPayload(AbstractPayload):
 	data: dict
+
+
+class StreamPayload(AbstractPayload):
+	_OPEN = 'open'
+	_OPENED = 'opened'
+	_REJECTED = 'rejected'
+	_CLOSE = 'close'
+
+	action: str
+	stream_id: int
+	name: str = ''  # for "open", the logical client to log in on the stream
+	password: str = ''
+	channels: List[str] = []
+	message: str = ''  # for "rejected", the reason
+
+	def is_open(self) -> bool:
+		return self.action == self._OPEN
+
+	def is_opened(self) -> bool:
+		return self.action == self._OPENED
+
+	def is_rejected(self) -> bool:
+		return self.action == self._REJECTED
+
+	def is_close(self) -> bool:
+		return self.action == self._CLOSE
+
+	@classmethod
+	def open(cls, stream_id: int, name: str, password: str, channels: List[str]) -> 'StreamPayload':
+		return StreamPayload(action=cls._OPEN, stream_id=stream_id, name=name, password=password, channels=channels)
+
+	@classmethod
+	def opened(cls, stream_id: int) -> 'StreamPayload':
+		return StreamPayload(action=cls._OPENED, stream_id=stream_id)
+
+	@classmethod
+	def rejected(cls, stream_id: int, message: str) -> 'StreamPayload':
+		return StreamPayload(action=cls._REJECTED, stream_id=stream_id, message=message)
+
+	@classmethod
+	def close(cls, stream_id: int) -> 'StreamPayload':
+		return StreamPayload(action=cls._CLOSE, stream_id=stream_id)
+
+
+class FederationPayload(AbstractPayload):
+	action: str  # "directory" to announce the reachable clients, or "route" to pass a packet on
+	hub: str  # the hub that sent this payload
+	clients: List[str] = []  # for "directory", the clients of the hub
+	relayed_clients: List[str] = []  # for "directory", the clients of the other hubs reachable through the hub
+	reply: bool = False  # for "directory", if the receiving hub should send its directory back
+	visited: List[str] = []  # for "route", the hubs that have received the packet, so it's never sent to them again
+	packet_id: str = ''  # for "route", the id given by the hub where the packet entered the federation, so a hub reached by several paths delivers it once
+	packet: dict = {}  # for "route", the serialized packet
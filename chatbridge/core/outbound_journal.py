@@ -0,0 +1,197 @@
+"""
+Keeps the packets sent while the client is offline in append-only segment files, so they are sent after the client logs in again,
+even if the process is restarted in between
+"""
+import os
+import struct
+import time
+import zlib
+from threading import RLock
+from typing import NamedTuple, List, Callable, Tuple, Optional
+
+from chatbridge.common.logger import ChatBridgeLogger
+from chatbridge.core.network import codec
+from chatbridge.core.network.protocol import ChatBridgePacket
+
+
+class OutboundJournalSettings(NamedTuple):
+	directory: str = 'outbound_journal'
+	max_size: int = 64 * 2 ** 20  # the maximum total size of the journal in bytes. The oldest packets are discarded when it's full
+	max_age: float = 600  # packets older than this in seconds are discarded instead of sent
+	segment_size: int = 4 * 2 ** 20  # start a new segment file when the current one grows larger than this in bytes
+
+
+class _Segment:
+	def __init__(self, path: str, size: int = 0, record_count: int = 0, last_time: float = 0):
+		self.path = path
+		self.size = size
+		self.record_count = record_count
+		self.last_time = last_time
+
+
+class OutboundJournal:
+	"""
+	Each record is a header with the data length, the crc32 of the data and the time, followed by the packet encoded with the default codec.
+	A record torn by a crash fails the length or crc check, and is truncated when the journal is loaded
+
+	Packets are delivered at least once: a segment file is deleted only after all its packets are sent,
+	so the packets of a partially sent segment are sent again if the client goes offline during the replay
+
+	Hold :attr:`lock` when checking if the client is online and appending packets, and when replaying the journal,
+	so no packet is sent before the journaled ones
+	"""
+	SEGMENT_SUFFIX = '.journal'
+	__HEADER = struct.Struct('<IId')  # data length, crc32 of the data, time
+
+	def __init__(self, settings: OutboundJournalSettings, logger: ChatBridgeLogger):
+		self.settings = settings
+		self.logger = logger
+		self.lock = RLock()
+		self.__segment_size = min(settings.segment_size, max(settings.max_size // 4, 1))  # so discarding the oldest segment never empties the journal
+		self.__segments: List[_Segment] = []
+		self.__next_segment_id = 0
+		self.__dropped_count = 0
+		os.makedirs(settings.directory, exist_ok=True)
+		self.__load()
+
+	def __len__(self) -> int:
+		return sum(segment.record_count for segment in self.__segments)
+
+	def get_size(self) -> int:
+		return sum(segment.size for segment in self.__segments)
+
+	def get_dropped_count(self) -> int:
+		"""
+		The amount of packets discarded since the journal is full or they are too old
+		"""
+		return self.__dropped_count
+
+	# --------------
+	#    Loading
+	# --------------
+
+	def __read_records(self, segment: _Segment) -> Tuple[List[Tuple[float, bytes]], int]:
+		"""
+		:return: The valid records of the segment as (time, data) and the length of the valid part of the file
+		"""
+		with open(segment.path, 'rb') as file:
+			content = file.read()
+		records = []
+		offset = 0
+		while offset + self.__HEADER.size <= len(content):
+			length, crc, timestamp = self.__HEADER.unpack_from(content, offset)
+			data_start = offset + self.__HEADER.size
+			data = content[data_start:data_start + length]
+			if len(data) != length or zlib.crc32(data) != crc:
+				break
+			records.append((timestamp, data))
+			offset = data_start + length
+		return records, offset
+
+	def __load(self):
+		file_names = sorted(
+			file_name for file_name in os.listdir(self.settings.directory)
+			if file_name.endswith(self.SEGMENT_SUFFIX) and file_name[:-len(self.SEGMENT_SUFFIX)].isdigit()
+		)
+		for file_name in file_names:
+			segment = _Segment(os.path.join(self.settings.directory, file_name))
+			self.__next_segment_id = int(file_name[:-len(self.SEGMENT_SUFFIX)]) + 1
+			try:
+				records, valid_size = self.__read_records(segment)
+				if valid_size < os.path.getsize(segment.path):
+					self.logger.warning('Truncating {} broken bytes at the end of journal segment {}'.format(os.path.getsize(segment.path) - valid_size, segment.path))
+					with open(segment.path, 'r+b') as file:
+						file.truncate(valid_size)
+			except OSError as e:
+				self.logger.error('Failed to load journal segment {}: {}'.format(segment.path, e))
+				continue
+			if len(records) == 0:
+				self.__remove_segment(segment)
+				continue
+			segment.size = valid_size
+			segment.record_count = len(records)
+			segment.last_time = records[-1][0]
+			self.__segments.append(segment)
+		if len(self.__segments) > 0:
+			self.logger.info('Loaded {} packets from the outbound journal'.format(len(self)))
+
+	# --------------
+	#    Writing
+	# --------------
+
+	def __remove_segment(self, segment: _Segment):
+		try:
+			os.remove(segment.path)
+		except OSError as e:
+			self.logger.error('Failed to remove journal segment {}: {}'.format(segment.path, e))
+
+	def __discard_oldest_segment(self):
+		segment = self.__segments.pop(0)
+		self.__dropped_count += segment.record_count
+		self.__remove_segment(segment)
+
+	def append(self, packet: ChatBridgePacket):
+		data = codec.get_codec(codec.DEFAULT_CODEC).encode(packet.serialize())
+		now = time.time()
+		record = self.__HEADER.pack(len(data), zlib.crc32(data), now) + data
+		with self.lock:
+			while len(self.__segments) > 0 and now - self.__segments[0].last_time > self.settings.max_age:
+				self.__discard_oldest_segment()
+			while len(self.__segments) > 0 and self.get_size() + len(record) > self.settings.max_size:
+				self.__discard_oldest_segment()
+			if len(record) > self.settings.max_size:
+				self.__dropped_count += 1
+				return
+			if len(self.__segments) == 0 or self.__segments[-1].size + len(record) > self.__segment_size:
+				self.__segments.append(_Segment(os.path.join(self.settings.directory, '{:012d}{}'.format(self.__next_segment_id, self.SEGMENT_SUFFIX))))
+				self.__next_segment_id += 1
+			segment = self.__segments[-1]
+			try:
+				with open(segment.path, 'ab') as file:
+					file.write(record)
+			except OSError as e:
+				self.logger.error('Failed to write the packet to journal segment {}: {}'.format(segment.path, e))
+				self.__dropped_count += 1
+				return
+			segment.size += len(record)
+			segment.record_count += 1
+			segment.last_time = now
+
+	# --------------
+	#    Replaying
+	# --------------
+
+	def replay(self, send: Callable[[ChatBridgePacket], None]) -> Tuple[int, int]:
+		"""
+		Send all journaled packets from the oldest to the newest, and remove them from the journal
+
+		:param send: The callback to send a packet. It should raise an exception to stop the replay if the packet can't be sent
+		:return: A tuple of the amount of packets sent, and the amount of packets discarded since they are too old
+		"""
+		sent_count = 0
+		expired_count = 0
+		with self.lock:
+			while len(self.__segments) > 0:
+				segment = self.__segments[0]
+				records: List[Tuple[float, bytes]] = []
+				try:
+					records, _ = self.__read_records(segment)
+				except OSError as e:
+					self.logger.error('Failed to read journal segment {}: {}'.format(segment.path, e))
+				expire_time = time.time() - self.settings.max_age
+				for timestamp, data in records:
+					if timestamp < expire_time:
+						expired_count += 1
+						continue
+					packet: Optional[ChatBridgePacket] = None
+					try:
+						packet = ChatBridgePacket.deserialize(codec.get_codec(codec.DEFAULT_CODEC).decode(data))
+					except Exception as e:
+						self.logger.error('Failed to decode a journaled packet, skipped: {}'.format(e))
+					if packet is not None:
+						send(packet)
+						sent_count += 1
+				self.__segments.pop(0)
+				self.__remove_segment(segment)
+		self.__dropped_count += expired_count
+		return sent_count, expired_count
@@ -0,0 +1,67 @@
+"""
+Selects the packets to be logged when debug logging is on, so live traffic can be traced without flooding the log
+"""
+import itertools
+from typing import Optional, Collection, FrozenSet, Iterable
+
+
+class PacketTraceFilter:
+	def __init__(self, *, clients: Optional[Collection[str]] = None, packet_types: Optional[Collection[str]] = None, sample_rate: int = 1):
+		"""
+		:param clients: Only trace packets from or to these clients. None for all clients
+		:param packet_types: Only trace packets with these types, e.g. "chat" or "chatbridge.chat". None for all types
+		:param sample_rate: Only trace 1 in every n packets that match the filters above
+		"""
+		if sample_rate < 1:
+			raise ValueError('Sample rate should be a positive integer, found {}'.format(sample_rate))
+		self.clients: Optional[FrozenSet[str]] = frozenset(clients) if clients is not None else None
+		self.packet_types: Optional[FrozenSet[str]] = frozenset(map(self.__normalize_type, packet_types)) if packet_types is not None else None
+		self.sample_rate = sample_rate
+		self.__counter = itertools.count()
+
+	@staticmethod
+	def __normalize_type(packet_type: str) -> str:
+		return packet_type if '.' in packet_type else 'chatbridge.' + packet_type
+
+	@classmethod
+	def parse(cls, args: Iterable[str]) -> 'PacketTraceFilter':
+		"""
+		Parse a filter from arguments like ``client=survival,creative``, ``type=chat`` and ``sample=10``
+
+		:raise ValueError: If there's any invalid argument
+		"""
+		kwargs = {}
+		for arg in args:
+			key, sep, value = arg.partition('=')
+			if sep == '' or value == '':
+				raise ValueError('Invalid argument {}'.format(arg))
+			if key == 'client':
+				kwargs['clients'] = value.split(',')
+			elif key == 'type':
+				kwargs['packet_types'] = value.split(',')
+			elif key == 'sample':
+				kwargs['sample_rate'] = int(value)
+			else:
+				raise ValueError('Unknown argument {}'.format(arg))
+		return cls(**kwargs)
+
+	def is_tracing_all(self) -> bool:
+		return self.clients is None and self.packet_types is None and self.sample_rate == 1
+
+	def accept(self, client_names: Iterable[str], packet_type: str) -> bool:
+		"""
+		:param client_names: Names of the clients involved in the packet, e.g. the sender and the receiver
+		:param packet_type: The type of the packet, see :class:`chatbridge.core.network.protocol.PacketType`
+		"""
+		if self.clients is not None and self.clients.isdisjoint(client_names):
+			return False
+		if self.packet_types is not None and packet_type not in self.packet_types:
+			return False
+		return self.sample_rate == 1 or next(self.__counter) % self.sample_rate == 0
+
+	def __str__(self):
+		return 'clients = {}, types = {}, sample = 1/{}'.format(
+			','.join(sorted(self.clients)) if self.clients is not None else '*',
+			','.join(sorted(self.packet_types)) if self.packet_types is not None else '*',
+			self.sample_rate
+		)
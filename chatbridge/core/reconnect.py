@@ -0,0 +1,52 @@
+"""
+Reconnection of the clients after their connection is lost
+
+A client schedules its next connection attempt as soon as its MainLoop exits, instead of being polled by a watcher thread.
+The delay grows exponentially with the failed attempts up to a cap, and is picked randomly below that bound,
+so the clients of a restarted server don't reconnect all at the same moment
+"""
+import random
+from typing import NamedTuple
+
+
+class ReconnectSettings(NamedTuple):
+	initial_delay: float = 1  # the maximum delay before the first attempt in seconds
+	max_delay: float = 60  # the cap of the delay in seconds
+	multiplier: float = 2  # the delay bound grows by this factor after every failed attempt
+	reset_after: float = 60  # the backoff starts over once a connection stays online this many seconds
+
+
+class ReconnectStats(NamedTuple):
+	reconnect_count: int  # the amount of reconnection attempts made
+	attempt_count: int  # the amount of attempts since the backoff started over
+	backoff: float  # the delay of the pending attempt in seconds, 0 if there's none
+
+
+class ReconnectBackoff:
+	"""
+	Exponential backoff with full jitter. Not thread safe
+	"""
+	def __init__(self, settings: ReconnectSettings):
+		self.settings = settings
+		self.__attempt = 0
+
+	def get_attempt(self) -> int:
+		"""
+		The amount of delays taken since the backoff started over
+		"""
+		return self.__attempt
+
+	def get_bound(self) -> float:
+		"""
+		The upper bound of the next delay
+		"""
+		exponent = min(self.__attempt, 64)  # the cap is reached long before, and the power would overflow eventually
+		return min(self.settings.max_delay, self.settings.initial_delay * self.settings.multiplier ** exponent)
+
+	def next_delay(self) -> float:
+		delay = random.uniform(0, self.get_bound())
+		self.__attempt += 1
+		return delay
+
+	def reset(self):
+		self.__attempt = 0
@@ -0,0 +1,89 @@
+"""
+Keeps the packets that could not be delivered to an offline client, so they can be delivered after it reconnects
+"""
+import collections
+import time
+from threading import RLock
+from typing import NamedTuple, Optional, Deque, Tuple, List
+
+from chatbridge.core.network import codec
+from chatbridge.core.network.protocol import ChatBridgePacket
+
+
+class ReplayBufferSettings(NamedTuple):
+	max_count: int = 1000  # the maximum amount of packets kept
+	max_size: int = 2 ** 20  # the maximum total size of the packets kept in bytes
+	max_age: float = 300  # packets older than this in seconds are discarded
+
+
+class ReplayBuffer:
+	"""
+	A bounded buffer of the packets missed by an offline client. The oldest packets are discarded when it's full
+
+	Hold :attr:`lock` when checking if the client is online and adding packets, and when bringing the client
+	online and draining the buffer, so no packet is delivered before the missed ones
+	"""
+	def __init__(self, settings: Optional[ReplayBufferSettings]):
+		"""
+		:param settings: None to disable the buffer
+		"""
+		self.settings = settings
+		self.lock = RLock()
+		self.__packets: Deque[Tuple[float, int, ChatBridgePacket]] = collections.deque()  # (time, size, packet)
+		self.__size = 0
+		self.__dropped_count = 0
+
+	@property
+	def enabled(self) -> bool:
+		return self.settings is not None
+
+	def __len__(self) -> int:
+		return len(self.__packets)
+
+	def get_size(self) -> int:
+		"""
+		The estimated memory used by the buffered packets in bytes
+		"""
+		return self.__size
+
+	def get_dropped_count(self) -> int:
+		"""
+		The amount of packets discarded since the buffer is full or they are too old
+		"""
+		return self.__dropped_count
+
+	def __pop_oldest(self):
+		_, size, _ = self.__packets.popleft()
+		self.__size -= size
+		self.__dropped_count += 1
+
+	def __discard_expired(self, now: float):
+		while len(self.__packets) > 0 and now - self.__packets[0][0] > self.settings.max_age:
+			self.__pop_oldest()
+
+	def add(self, packet: ChatBridgePacket):
+		if self.settings is None:
+			return
+		size = len(codec.get_codec(codec.DEFAULT_CODEC).encode(packet.serialize()))
+		with self.lock:
+			now = time.monotonic()
+			self.__discard_expired(now)
+			if size > self.settings.max_size or self.settings.max_count <= 0:
+				self.__dropped_count += 1
+				return
+			self.__packets.append((now, size, packet))
+			self.__size += size
+			while len(self.__packets) > self.settings.max_count or self.__size > self.settings.max_size:
+				self.__pop_oldest()
+
+	def drain(self) -> List[ChatBridgePacket]:
+		"""
+		Remove and return all buffered packets that are not too old, from the oldest to the newest
+		"""
+		with self.lock:
+			if self.settings is not None:
+				self.__discard_expired(time.monotonic())
+			packets = [packet for _, _, packet in self.__packets]
+			self.__packets.clear()
+			self.__size = 0
+			return packets
@@ -0,0 +1,601 @@
+"""
+An event-loop based server engine, which multiplexes all client connections on a single thread with selectors
+
+The amount of threads used by the server stays the same no matter how many clients are connected
+"""
+import collections
+import functools
+import random
+import selectors
+import socket
+import time
+from threading import RLock, Event, Thread, current_thread
+from typing import TYPE_CHECKING, Optional, Dict, Set, Callable, Deque
+
+from chatbridge.common import constants
+from chatbridge.common.logger import ChatBridgeLogger
+from chatbridge.core.client import ChatBridgeClient
+from chatbridge.core.config import ClientInfo
+from chatbridge.core.keep_alive import KeepAliveTracker
+from chatbridge.core.network import net_util
+from chatbridge.core.network.basic import Address
+from chatbridge.core.network.cryptor import AESCryptor
+from chatbridge.core.network.protocol import AbstractPacket, ChatBridgePacket, LoginPacket, PacketType, \
+	KeepAlivePayload
+from chatbridge.core.replay_buffer import ReplayBuffer
+from chatbridge.core.send_queue import SendQueue
+from chatbridge.core.session import Session
+
+if TYPE_CHECKING:
+	from chatbridge.core.server import ChatBridgeServer, AnyClientConnection
+
+
+class SelectorClientConnection:
+	"""
+	The selector engine counterpart of the thread-based client connection
+
+	It owns no thread. All socket events and the keep-alive logic are driven by the :class:`SelectorServerEngine`
+	"""
+	TIMEOUT = ChatBridgeClient.TIMEOUT
+
+	def __init__(self, server: 'ChatBridgeServer', info: ClientInfo):
+		self.info = info
+		self.server = server
+		self.logger = ChatBridgeLogger(self.get_logging_name())
+		if self.server.logger.file_handler is not None:
+			self.logger.addHandler(self.server.logger.file_handler)
+		self.__cryptor = AESCryptor(server.aes_key)
+		self.__engine: Optional['SelectorServerEngine'] = None
+		self.__sock: Optional[socket.socket] = None
+		self.__lock = RLock()
+		self.__frame_reader: Optional[net_util.FrameReader] = None
+		self.__send_buffer = bytearray()
+		self.__wire_format = net_util.WireFormat()
+		self.__keep_alive_tracker = KeepAliveTracker(server.keep_alive_settings)
+		self.__next_keep_alive_time = 0.0
+		self.replay_buffer = ReplayBuffer(server.replay_buffer_settings if info.replay_missed_packets else None)
+		self.send_queue = SendQueue(server.send_queue_settings)  # the frames waiting for the send buffer to be empty
+		self.session = Session(server.session_settings._replace(resume_timeout=info.session_resume_timeout))
+		self.streams: Dict[int, 'AnyClientConnection'] = {}  # the logical clients on the streams of this connection
+		self.__stream_owner: Optional['AnyClientConnection'] = None  # the connection this logical client is on, if it's on a stream
+		self.__stream_id = 0
+
+	def get_logging_name(self) -> str:
+		return 'Server.{}'.format(self.get_connection_client_name())
+
+	def get_connection_client_name(self) -> str:
+		return self.info.name
+
+	def get_socket(self) -> Optional[socket.socket]:
+		return self.__sock
+
+	def get_wire_format(self) -> net_util.WireFormat:
+		return self.__wire_format
+
+	def get_send_queue_size(self) -> int:
+		"""
+		The amount of bytes waiting for the socket to be writable
+		"""
+		return len(self.__send_buffer) + self.send_queue.get_size()
+
+	def is_online(self) -> bool:
+		return self.__sock is not None or self.__stream_owner is not None
+
+	def is_running(self) -> bool:
+		return self.is_online()
+
+	@property
+	def ping(self) -> float:
+		"""
+		ping in second
+		"""
+		owner = self.__stream_owner
+		return owner.ping if owner is not None else self.__keep_alive_tracker.get_ping()
+
+	def get_ping_text(self) -> str:
+		if self.ping >= 0:
+			return '{}ms'.format(round(self.ping * 1000, 2))
+		else:
+			return 'N/A'
+
+	def stop(self):
+		"""
+		Disconnect the client. Can be called on any thread
+		"""
+		if self.__stream_owner is not None:
+			self._detach_stream(notify=True)
+			return
+		engine = self.__engine
+		if engine is None or not self.is_online():
+			return
+		if engine.is_in_loop_thread() or not engine.is_running():
+			self._close()
+		else:
+			done = Event()
+
+			def func():
+				self._close()
+				done.set()
+
+			engine.call_soon(func)
+			if not done.wait(self.TIMEOUT):
+				self.logger.warning('Timeout waiting for the connection to be closed')
+
+	# ------------------------------
+	#   Engine callbacks (loop thread)
+	# ------------------------------
+
+	def _attach(self, engine: 'SelectorServerEngine', sock: socket.socket, frame_reader: net_util.FrameReader, login_packet: LoginPacket):
+		if self.is_online():
+			self.logger.info('Replacing the existing connection with the new one')
+			self._close()
+		with self.replay_buffer.lock:
+			with self.__lock:
+				self.__engine = engine
+				self.__sock = sock
+				self.__frame_reader = frame_reader
+				self.__send_buffer = bytearray()
+				self.send_queue.open()
+				self.__wire_format = net_util.WireFormat()
+				now = time.monotonic()
+				self.__keep_alive_tracker.reset(now)
+				self.__next_keep_alive_time = now + random.random()
+			engine.register_connection(self)
+			self.logger.info('Started client connection')
+			started = self.server._start_session(self, login_packet)
+			if started is None:
+				self._close()
+				return
+			login_result, wire_format, frames = started
+			self.__write(net_util.encode_packet(self.__cryptor, login_result, self.__wire_format), record=False)  # not counted in the session
+			self.server.log_packet(login_result, to_client=True, client_name=self.get_connection_client_name())
+			self.__wire_format = wire_format
+			for frame in frames:
+				self.__write(frame)
+			self.server._replay_missed_packets(self)
+		self.__process_received_frames()
+
+	def _close(self):
+		if self.__stream_owner is not None:
+			self._detach_stream(notify=True)
+			return
+		with self.replay_buffer.lock:
+			with self.__lock:
+				sock = self.__sock
+				if sock is None:
+					return
+				self.__sock = None
+				self.__frame_reader = None
+				self.__send_buffer = bytearray()
+				# keep the frames still queued in the session before the client is seen offline,
+				# so the frames for the disconnected client are kept after them
+				for frame in self.send_queue.close():
+					self.session.record(frame)
+				self.session.on_disconnected()
+		self.__engine.unregister_connection(self, sock)
+		try:
+			sock.close()
+		except:
+			pass
+		self.server._close_streams(self)
+		self.logger.info('Stopped client connection')
+
+	# --------------
+	#    Streams
+	# --------------
+
+	def get_stream_owner(self) -> Optional['AnyClientConnection']:
+		"""
+		:return: The connection this logical client is on, or None if it's not on a stream of a multiplexed connection
+		"""
+		return self.__stream_owner
+
+	def _attach_stream(self, owner: 'AnyClientConnection', stream_id: int):
+		"""
+		Bring the client online on the stream of the owner connection
+		"""
+		self.__stream_id = stream_id
+		self.__stream_owner = owner
+		self.logger.info('Started client connection on stream {} of {}'.format(stream_id, owner.get_connection_client_name()))
+
+	def _detach_stream(self, *, notify: bool):
+		"""
+		:param notify: If the owner connection should be told that the stream is closed
+		"""
+		owner, stream_id = self.__stream_owner, self.__stream_id
+		if owner is None:
+			return
+		self.__stream_owner = None
+		self.server._remove_stream(owner, stream_id, self, notify=notify)
+		self.logger.info('Stopped client connection on stream {} of {}'.format(stream_id, owner.get_connection_client_name()))
+
+	def _get_selector_events(self) -> int:
+		with self.__lock:
+			return selectors.EVENT_READ | (selectors.EVENT_WRITE if len(self.__send_buffer) > 0 or len(self.send_queue) > 0 else 0)
+
+	def _on_selector_event(self, mask: int):
+		if mask & selectors.EVENT_WRITE:
+			self.__on_writable()
+		if mask & selectors.EVENT_READ and self.is_online():
+			self.__on_readable()
+
+	def _tick(self, now: float):
+		if now < self.__next_keep_alive_time:
+			return
+		action = self.__keep_alive_tracker.update(now)
+		if action.timed_out:
+			self.logger.warning('Disconnect due to keep-alive timeout')
+			self._close()
+			return
+		if action.send_ping:
+			self.__send_keep_alive(KeepAlivePayload.ping())
+		self.__next_keep_alive_time = action.next_time
+
+	# --------------
+	#    Reading
+	# --------------
+
+	def __on_readable(self):
+		try:
+			self.__frame_reader.receive(self.__sock)
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError as e:
+			self.logger.warning('Connection closed: {}'.format(e))
+			self._close()
+			return
+		self.__keep_alive_tracker.on_received(time.monotonic())
+		self.__process_received_frames()
+
+	def __process_received_frames(self):
+		while self.is_online():
+			try:
+				data = self.__frame_reader.pop_frame(self.__wire_format)
+				if data is None:
+					break
+				packet = ChatBridgePacket.deserialize(data)
+			except Exception:
+				self.logger.exception('Fail to decode received packet, disconnecting')
+				self._close()
+				break
+			stream_id = self.__frame_reader.get_stream_id()
+			if stream_id != 0:
+				self.__on_stream_packet(stream_id, packet)
+				continue
+			if self.server.should_trace_packet(packet, self.get_connection_client_name()):
+				self.logger.debug('Received packet with type {}: {}'.format(packet.type, packet.payload))
+			try:
+				self.__on_packet(packet)
+			except:
+				self.logger.exception('Fail to process packet {}'.format(packet))
+
+	def __on_stream_packet(self, stream_id: int, packet: ChatBridgePacket):
+		client = self.streams.get(stream_id)
+		if client is None:
+			self.logger.debug('Discarded a packet of closed stream {}'.format(stream_id))
+			return
+		if self.server.should_trace_packet(packet, client.get_connection_client_name()):
+			self.logger.debug('Received packet on stream {} with type {}: {}'.format(stream_id, packet.type, packet.payload))
+		try:
+			self.server.process_packet(client, packet)
+		except:
+			self.logger.exception('Fail to process packet {}'.format(packet))
+
+	def __on_packet(self, packet: ChatBridgePacket):
+		if packet.type == PacketType.keep_alive:
+			payload = KeepAlivePayload.deserialize(packet.payload)
+			if payload.is_ping():
+				self.__send_keep_alive(KeepAlivePayload.pong())
+			elif payload.is_pong():
+				self.__on_pong()
+			else:
+				self.logger.warning('Unknown keep alive type: {}'.format(payload.ping_type))
+		self.server.process_packet(self, packet)
+
+	def __on_pong(self):
+		if self.__keep_alive_tracker.on_pong(time.monotonic()) is not None:
+			self.logger.debug('Keep-alive responded, ping = {}ms'.format(round(self.ping * 1000, 2)))
+
+	# --------------
+	#    Writing
+	# --------------
+
+	def __on_writable(self):
+		with self.__lock:
+			if self.__sock is None:
+				return
+			if len(self.__send_buffer) == 0:
+				frames = self.send_queue.poll_all()
+				for frame in frames:
+					self.session.record(frame)
+				self.__send_buffer += b''.join(frames)
+			try:
+				sent = self.__sock.send(self.__send_buffer)
+			except (BlockingIOError, InterruptedError):
+				return
+			except OSError as e:
+				error = e
+			else:
+				error = None
+				del self.__send_buffer[:sent]
+				if len(self.__send_buffer) == 0 and len(self.send_queue) == 0:
+					self.__engine.update_interest(self)
+		if error is not None:  # closed outside the lock, since closing takes the replay buffer lock first
+			self.logger.warning('Connection closed: {}'.format(error))
+			self._close()
+
+	def __write(self, data: bytes, droppable: bool = False, record: bool = True):
+		"""
+		:param droppable: If the frame can be discarded when the send queue is full
+		:param record: If the frame is counted in the session. The frames are kept in the session in the order they are sent
+		"""
+		with self.__lock:
+			if self.__sock is None:
+				self.logger.warning('Trying to send a packet when not connected')
+				return
+			if len(self.__send_buffer) == 0 and len(self.send_queue) == 0:
+				if record:
+					self.session.record(data)
+				try:
+					sent = self.__sock.send(data)
+				except (BlockingIOError, InterruptedError):
+					sent = 0
+				except OSError as e:
+					self.logger.warning('Failed to send data: {}'.format(e))
+					self.__engine.call_soon(self._close)
+					return
+				if sent == len(data):
+					return
+				self.__send_buffer += data[sent:]
+				self.__engine.update_interest(self)
+			elif not self.send_queue.put(data, droppable, can_block=False):
+				self.logger.warning('Disconnecting since the client cannot receive packets fast enough, send queue size limit {}B'.format(self.send_queue.settings.max_size))
+				self.__engine.call_soon(self._close)
+
+	def __send_keep_alive(self, payload: KeepAlivePayload):
+		self._send_packet(ChatBridgePacket(
+			sender=constants.SERVER_NAME,
+			receivers=[self.get_connection_client_name()],
+			broadcast=False,
+			type=PacketType.keep_alive,
+			payload=payload.serialize()
+		))
+
+	def _send_packet(self, packet: AbstractPacket):
+		self.__write(net_util.encode_packet(self.__cryptor, packet, self.__wire_format))
+		self.server.log_packet(packet, to_client=True, client_name=self.get_connection_client_name())
+
+	def send_packet_invoker(self, packet: AbstractPacket, frame_cache: Optional[Dict[net_util.WireFormat, bytes]] = None, *, can_block: bool = True):
+		"""
+		:param can_block: Unused, since the selector engine never waits for a slow client
+		"""
+		owner = self.__stream_owner
+		if owner is not None:
+			if owner.send_stream_packet(self.__stream_id, packet):
+				self.server.log_packet(packet, to_client=True, client_name=self.get_connection_client_name())
+			return
+		wire_format = self.__wire_format
+		frame = frame_cache.get(wire_format) if frame_cache is not None else None
+		if frame is None:
+			frame = net_util.encode_packet(self.__cryptor, packet, wire_format)
+			if frame_cache is not None:
+				frame_cache[wire_format] = frame
+		self.__write(frame, droppable=isinstance(packet, ChatBridgePacket) and packet.type == PacketType.chat)
+		self.server.log_packet(packet, to_client=True, client_name=self.get_connection_client_name())
+
+	def send_stream_packet(self, stream_id: int, packet: AbstractPacket, *, can_block: bool = True) -> bool:
+		"""
+		Send the packet of the logical client on the stream of this connection
+
+		:return: If the packet is sent or queued
+		"""
+		if self.__sock is None:
+			return False
+		self.__write(net_util.encode_packet(self.__cryptor, packet, self.__wire_format, stream_id), droppable=isinstance(packet, ChatBridgePacket) and packet.type == PacketType.chat)
+		return True
+
+	def wait_for_send_queue(self):
+		pass  # the selector engine never waits for a slow client
+
+
+class _ComingConnection:
+	def __init__(self, sock: socket.socket, addr: Address, frame_reader: net_util.FrameReader):
+		self.sock = sock
+		self.addr = addr
+		self.frame_reader = frame_reader
+		self.start_time = time.time()
+
+
+class SelectorServerEngine:
+	TICK_INTERVAL = 1
+
+	def __init__(self, server: 'ChatBridgeServer', listen_sock: socket.socket):
+		self.server = server
+		self.logger = server.logger
+		self.__listen_sock = listen_sock
+		self.__cryptor = AESCryptor(server.aes_key)
+		self.__selector = selectors.DefaultSelector()
+		self.__waker_r, self.__waker_w = socket.socketpair()
+		self.__tasks: Deque[Callable[[], None]] = collections.deque()
+		self.__coming_connections: Dict[socket.socket, _ComingConnection] = {}
+		self.__connections: Set[SelectorClientConnection] = set()
+		self.__thread: Optional[Thread] = None
+		self.__running = False
+		self.__counter = 0
+
+	def is_running(self) -> bool:
+		return self.__running
+
+	def is_in_loop_thread(self) -> bool:
+		return self.__thread is current_thread()
+
+	def wakeup(self):
+		try:
+			self.__waker_w.send(b'\0')
+		except OSError:
+			pass  # buffer full or closed, the loop is going to wake up anyway
+
+	def call_soon(self, func: Callable[[], None]):
+		"""
+		Schedule a function to be executed in the loop thread. Thread safe
+		"""
+		self.__tasks.append(func)
+		self.wakeup()
+
+	def run(self):
+		self.__thread = current_thread()
+		self.__running = True
+		self.__listen_sock.setblocking(False)
+		self.__waker_r.setblocking(False)
+		self.__waker_w.setblocking(False)
+		self.__selector.register(self.__listen_sock, selectors.EVENT_READ, self.__on_accept)
+		self.__selector.register(self.__waker_r, selectors.EVENT_READ, self.__on_wakeup)
+		next_tick = time.monotonic()
+		try:
+			while self.server.is_running():
+				for key, mask in self.__selector.select(self.TICK_INTERVAL):
+					try:
+						key.data(mask)
+					except:
+						self.logger.exception('Error handling selector event')
+				self.__run_tasks()
+				now = time.monotonic()
+				if now >= next_tick:
+					next_tick = now + self.TICK_INTERVAL
+					self.__tick(now)
+		except:
+			self.logger.exception('Error ticking server')
+		finally:
+			self.__close_all()
+			self.__running = False
+
+	# --------------------------
+	#   Connection management
+	# --------------------------
+
+	def register_connection(self, conn: SelectorClientConnection):
+		self.__connections.add(conn)
+		self.__selector.register(conn.get_socket(), conn._get_selector_events(), conn._on_selector_event)
+
+	def unregister_connection(self, conn: SelectorClientConnection, sock: socket.socket):
+		self.__connections.discard(conn)
+		try:
+			self.__selector.unregister(sock)
+		except (KeyError, ValueError):
+			pass
+
+	def update_interest(self, conn: SelectorClientConnection):
+		if self.is_in_loop_thread():
+			self.__apply_interest(conn)
+		else:
+			self.call_soon(functools.partial(self.__apply_interest, conn))
+
+	def __apply_interest(self, conn: SelectorClientConnection):
+		sock = conn.get_socket()
+		if sock is not None:
+			try:
+				self.__selector.modify(sock, conn._get_selector_events(), conn._on_selector_event)
+			except (KeyError, ValueError):
+				pass
+
+	# --------------
+	#    Handlers
+	# --------------
+
+	def __on_wakeup(self, mask: int):
+		try:
+			while self.__waker_r.recv(1024):
+				pass
+		except (BlockingIOError, InterruptedError):
+			pass
+
+	def __run_tasks(self):
+		while len(self.__tasks) > 0:
+			func = self.__tasks.popleft()
+			try:
+				func()
+			except:
+				self.logger.exception('Error executing task {}'.format(func))
+
+	def __on_accept(self, mask: int):
+		while True:
+			try:
+				conn, addr = self.__listen_sock.accept()
+			except (BlockingIOError, InterruptedError):
+				break
+			address = Address(*addr[:2])
+			self.__counter += 1
+			self.logger.info('New connection #{} from {}'.format(self.__counter, address))
+			conn.setblocking(False)
+			cc = _ComingConnection(conn, address, net_util.FrameReader(self.__cryptor))
+			self.__coming_connections[conn] = cc
+			self.__selector.register(conn, selectors.EVENT_READ, functools.partial(self.__on_coming_connection_readable, cc))
+
+	def __drop_coming_connection(self, cc: _ComingConnection, close: bool):
+		self.__coming_connections.pop(cc.sock, None)
+		try:
+			self.__selector.unregister(cc.sock)
+		except (KeyError, ValueError):
+			pass
+		if close:
+			try:
+				cc.sock.close()
+			except:
+				pass
+			self.logger.warning('Closed connection from {}'.format(cc.addr))
+
+	def __on_coming_connection_readable(self, cc: _ComingConnection, mask: int):
+		try:
+			cc.frame_reader.receive(cc.sock)
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError as e:
+			self.logger.error('Failed reading client\'s login packet: {}'.format(e))
+			self.__drop_coming_connection(cc, True)
+			return
+		try:
+			login_data = cc.frame_reader.pop_frame(net_util.WireFormat())
+			if login_data is None:
+				return
+			login_packet = LoginPacket.deserialize(login_data)
+		except Exception as e:
+			self.logger.error('Failed reading client\'s login packet: {}'.format(e))
+			self.__drop_coming_connection(cc, True)
+			return
+		self.server.log_packet(login_packet, to_client=False)
+		client = self.server._authenticate_login(login_packet, cc.addr)
+		if isinstance(client, SelectorClientConnection):
+			self.__drop_coming_connection(cc, False)
+			client._attach(self, cc.sock, cc.frame_reader, login_packet)
+		else:
+			self.__drop_coming_connection(cc, True)
+
+	def __tick(self, now: float):
+		current_time = time.time()
+		for cc in list(self.__coming_connections.values()):
+			if current_time - cc.start_time > self.server.MAXIMUM_LOGIN_DURATION:
+				self.logger.warning('Terminating coming connection from {} due to login timeout'.format(cc.addr))
+				self.__drop_coming_connection(cc, True)
+		for conn in list(self.__connections):
+			try:
+				conn._tick(now)
+			except:
+				self.logger.exception('Error ticking connection of {}'.format(conn.get_connection_client_name()))
+
+	def __close_all(self):
+		self.__run_tasks()
+		for conn in list(self.__connections):
+			try:
+				conn._close()
+			except:
+				self.logger.exception('Error closing connection of {}'.format(conn.get_connection_client_name()))
+		for cc in list(self.__coming_connections.values()):
+			self.__drop_coming_connection(cc, True)
+		for sock in (self.__listen_sock, self.__waker_r):
+			try:
+				self.__selector.unregister(sock)
+			except (KeyError, ValueError):
+				pass
+		self.__selector.close()
+		self.__waker_r.close()
+		self.__waker_w.close()
@@ -0,0 +1,175 @@
+"""
+Bounded per-receiver queues of the frames to be sent, so a slow receiver only delays itself instead of every sender
+"""
+import collections
+from threading import Condition
+from typing import NamedTuple, Deque, Tuple, List, Optional, Callable
+
+
+class OverflowPolicy:
+	drop_oldest_chat = 'drop_oldest_chat'  # discard the oldest queued chat packets. Other packets are never discarded
+	disconnect = 'disconnect'  # disconnect the receiver
+	block = 'block'  # wait until the receiver catches up. With the selector engine, which never waits, the queue grows instead
+
+
+class SendQueueSettings(NamedTuple):
+	max_size: int = 4 * 2 ** 20  # the maximum total size of the queued frames in bytes
+	overflow_policy: str = OverflowPolicy.drop_oldest_chat
+
+
+class SendQueue:
+	def __init__(self, settings: SendQueueSettings):
+		if settings.overflow_policy not in (OverflowPolicy.drop_oldest_chat, OverflowPolicy.disconnect, OverflowPolicy.block):
+			raise ValueError('Unknown overflow policy {}'.format(settings.overflow_policy))
+		self.settings = settings
+		self.__condition = Condition()
+		self.__frames: Deque[Tuple[bytes, bool]] = collections.deque()  # (frame, droppable)
+		self.__size = 0
+		self.__closed = False
+		self.__dropped_count = 0
+		self.__overflow_count = 0
+
+	def __len__(self) -> int:
+		return len(self.__frames)
+
+	def get_size(self) -> int:
+		"""
+		The total size of the queued frames in bytes
+		"""
+		return self.__size
+
+	def get_dropped_count(self) -> int:
+		"""
+		The amount of packets discarded since the queue is full
+		"""
+		return self.__dropped_count
+
+	def get_overflow_count(self) -> int:
+		"""
+		The amount of packets that arrived when the queue is full, i.e. how often the receiver lagged behind
+		"""
+		return self.__overflow_count
+
+	def is_closed(self) -> bool:
+		return self.__closed
+
+	def open(self):
+		with self.__condition:
+			self.__frames.clear()
+			self.__size = 0
+			self.__closed = False
+			self.__condition.notify_all()
+
+	def wait_for_open(self, timeout: Optional[float] = None) -> bool:
+		"""
+		Wait until the queue is opened again after closing
+
+		:return: If the queue is open
+		"""
+		with self.__condition:
+			if self.__closed:
+				self.__condition.wait(timeout)
+			return not self.__closed
+
+	def close(self) -> List[bytes]:
+		"""
+		Discard all queued frames and wake up all waiting threads. Frames put after closing are discarded
+
+		:return: The discarded frames, including the frames left when the queue is closed by the disconnect policy
+		"""
+		with self.__condition:
+			frames = [frame for frame, _ in self.__frames]
+			self.__frames.clear()
+			self.__size = 0
+			self.__closed = True
+			self.__condition.notify_all()
+			return frames
+
+	def put(self, frame: bytes, droppable: bool, *, can_block: bool = True) -> bool:
+		"""
+		:param droppable: If the frame can be discarded by the drop_oldest_chat policy
+		:param can_block: If the current thread can wait for the queue to have enough space
+		:return: False if the receiver should be disconnected by the disconnect policy. The queue is closed then
+		"""
+		with self.__condition:
+			if self.__closed:
+				return True
+			if self.__size + len(frame) > self.settings.max_size and len(self.__frames) > 0:
+				self.__overflow_count += 1
+				policy = self.settings.overflow_policy
+				if policy == OverflowPolicy.disconnect:
+					self.__closed = True  # the queued frames are kept for close()
+					self.__condition.notify_all()
+					return False
+				elif policy == OverflowPolicy.block:
+					while can_block and not self.__closed and len(self.__frames) > 0 and self.__size + len(frame) > self.settings.max_size:
+						self.__condition.wait()
+					if self.__closed:
+						return True
+				else:
+					self.__drop_oldest(len(frame))
+					if self.__size + len(frame) > self.settings.max_size and droppable:
+						self.__dropped_count += 1
+						return True
+			self.__frames.append((frame, droppable))
+			self.__size += len(frame)
+			self.__condition.notify_all()
+			return True
+
+	def wait_for_space(self):
+		"""
+		With the block policy, wait until the queued frames fit in the size limit again, or the queue is closed
+
+		Frames put with can_block=False, e.g. while holding a lock the receiver needs for disconnecting,
+		can be followed by this call after releasing the lock, so the sender still waits for a slow receiver
+		"""
+		if self.settings.overflow_policy != OverflowPolicy.block:
+			return
+		with self.__condition:
+			while not self.__closed and self.__size > self.settings.max_size:
+				self.__condition.wait()
+
+	def __drop_oldest(self, needed_size: int):
+		kept: Deque[Tuple[bytes, bool]] = collections.deque()
+		while len(self.__frames) > 0 and self.__size + needed_size > self.settings.max_size:
+			frame, droppable = self.__frames.popleft()
+			if droppable:
+				self.__size -= len(frame)
+				self.__dropped_count += 1
+			else:
+				kept.append((frame, droppable))
+		kept.extend(self.__frames)
+		self.__frames = kept
+
+	def take_all(self, timeout: Optional[float] = None, on_taken: Optional[Callable[[List[bytes]], None]] = None) -> Optional[List[bytes]]:
+		"""
+		Wait until there are frames queued, and take all of them
+
+		:param on_taken: Invoked with the taken frames before the queue can be changed again, e.g. closed
+		:return: The queued frames, an empty list on timeout, or None if the queue is closed
+		"""
+		with self.__condition:
+			if len(self.__frames) == 0 and not self.__closed:
+				self.__condition.wait(timeout)
+			if self.__closed:
+				return None
+			frames = self.__take_all()
+			if on_taken is not None and len(frames) > 0:
+				on_taken(frames)
+			return frames
+
+	def poll_all(self) -> List[bytes]:
+		"""
+		Take all queued frames without waiting
+		"""
+		with self.__condition:
+			if self.__closed:
+				return []
+			return self.__take_all()
+
+	def __take_all(self) -> List[bytes]:
+		frames = [frame for frame, _ in self.__frames]
+		self.__frames.clear()
+		self.__size = 0
+		self.__condition.notify_all()
+		return frames
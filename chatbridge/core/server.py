@@ -1,25 +1,42 @@
-import json
 import socket
 import time
 from concurrent.futures.thread import ThreadPoolExecutor
 from threading import Thread, Event, RLock, Lock, current_thread
-from typing import Dict, Optional, List, NamedTuple
+from typing import Dict, Optional, List, NamedTuple, Union, Tuple
 
 from chatbridge.common import constants
+from chatbridge.core import keep_alive
+from chatbridge.core.channel import ChannelIndex
 from chatbridge.core.client import ChatBridgeClient, ClientStatus
-from chatbridge.core.config import ClientInfo
-from chatbridge.core.network import net_util
+from chatbridge.core.config import ClientInfo, ServerEngine, FederationSettings
+from chatbridge.core.federation import Federation
+from chatbridge.core.network import net_util, codec, compression, cryptor
 from chatbridge.core.network.basic import Address, ChatBridgeBase
 from chatbridge.core.network.protocol import LoginPacket, ChatBridgePacket, AbstractPacket, LoginResultPacket, \
-	PacketType, ChatPayload
+	PacketType, ChatPayload, StreamPayload
+from chatbridge.core.packet_trace import PacketTraceFilter
+from chatbridge.core.replay_buffer import ReplayBuffer, ReplayBufferSettings
+from chatbridge.core.selector_engine import SelectorServerEngine, SelectorClientConnection
+from chatbridge.core.send_queue import SendQueue, SendQueueSettings
+from chatbridge.core.session import Session, SessionSettings
 
 
 class _ClientConnection(ChatBridgeClient):
 	def __init__(self, server: 'ChatBridgeServer', info: ClientInfo):
 		self.info = info
 		self.server = server
-		super().__init__(server.aes_key, ClientInfo(name=constants.SERVER_NAME, password=''))
-		self.logger.addHandler(self.server.logger.file_handler)
+		super().__init__(server.aes_key, ClientInfo(name=constants.SERVER_NAME, password=''), keep_alive_settings=server.keep_alive_settings)
+		if self.server.logger.file_handler is not None:
+			self.logger.addHandler(self.server.logger.file_handler)
+		self.__login_packet: Optional[LoginPacket] = None
+		self.replay_buffer = ReplayBuffer(server.replay_buffer_settings if info.replay_missed_packets else None)
+		self.send_queue = SendQueue(server.send_queue_settings)
+		self.session = Session(server.session_settings._replace(resume_timeout=info.session_resume_timeout))
+		self.__send_thread: Optional[Thread] = None
+		self.__send_thread_lock = RLock()
+		self.streams: Dict[int, 'AnyClientConnection'] = {}  # the logical clients on the streams of this connection
+		self.__stream_owner: Optional['AnyClientConnection'] = None  # the connection this logical client is on, if it's on a stream
+		self.__stream_id = 0
 
 	def get_logging_name(self) -> str:
 		return 'Server.{}'.format(self.get_connection_client_name())
@@ -27,8 +44,8 @@ class _ClientConnection(ChatBridgeClient):
 	def _get_main_loop_thread_name(self):
 		return super()._get_main_loop_thread_name() + '.' + self.get_connection_client_name()
 
-	def _get_keep_alive_thread_name(self):
-		return super()._get_main_loop_thread_name() + '.' + self.get_connection_client_name()
+	def _should_trace_packet(self, packet: ChatBridgePacket) -> bool:
+		return self.server.should_trace_packet(packet, self.get_connection_client_name())
 
 	def get_logging_file_name(self) -> Optional[str]:
 		return None
@@ -43,15 +60,174 @@ class _ClientConnection(ChatBridgeClient):
 		"""
 		No need to login for this class
 		"""
-		self._set_status(ClientStatus.CONNECTED)
-		self._send_packet(LoginResultPacket(message='ok'))
+		with self.replay_buffer.lock:
+			self._set_status(ClientStatus.CONNECTED)
+			started = self.server._start_session(self, self.__login_packet)
+			if started is None:
+				raise ConnectionError('The session to resume has expired')
+			login_result, wire_format, frames = started
+			self.__start_send_thread()
+			super()._send_packet(login_result)  # not through the send queue, so it's not counted in the session
+			self.server.log_packet(login_result, to_client=True, client_name=self.get_connection_client_name())
+			self._set_wire_format(wire_format)  # the one of the session if it's resumed, not negotiated again
+			for frame in frames:
+				self.__queue_frame(frame, droppable=False, can_block=False)
+			self.server._replay_missed_packets(self)
+
+	def _set_status(self, status: ClientStatus):
+		if status != ClientStatus.ONLINE and self.is_online():
+			# keep the frames still queued in the session before the client is seen offline,
+			# so the frames for the disconnected client are kept after them
+			with self.replay_buffer.lock:
+				super()._set_status(status)
+				for frame in self.send_queue.close():
+					self.session.record(frame)
+				self.session.on_disconnected()
+		else:
+			super()._set_status(status)
 
 	def _send_packet(self, packet: AbstractPacket):
-		super()._send_packet(packet)
-		self.server.log_packet(packet, to_client=True, client_name=self.get_connection_client_name())
+		if self.__queue_frame(net_util.encode_packet(self._cryptor, packet, self.get_wire_format()), droppable=False):
+			self.server.log_packet(packet, to_client=True, client_name=self.get_connection_client_name())
+
+	def send_packet_invoker(self, packet: AbstractPacket, frame_cache: Optional[Dict[net_util.WireFormat, bytes]] = None, *, can_block: bool = True):
+		"""
+		Queue the packet to be sent by the send thread of the connection, so the current thread never waits for a slow client
+
+		:param packet: The packet to send
+		:param frame_cache: Encoded frames of the packet for each wire format. If provided, it's used to
+			skip encoding the packet again for connections that share the same wire format
+		:param can_block: If the current thread can wait for a full send queue with the block policy.
+			Call :meth:`wait_for_send_queue` later if it's False
+		"""
+		owner = self.__stream_owner
+		if owner is not None:
+			if owner.send_stream_packet(self.__stream_id, packet, can_block=can_block):
+				self.server.log_packet(packet, to_client=True, client_name=self.get_connection_client_name())
+			return
+		wire_format = self.get_wire_format()
+		frame = frame_cache.get(wire_format) if frame_cache is not None else None
+		if frame is None:
+			frame = net_util.encode_packet(self._cryptor, packet, wire_format)
+			if frame_cache is not None:
+				frame_cache[wire_format] = frame
+		if self.__queue_frame(frame, droppable=self.__is_droppable(packet), can_block=can_block):
+			self.server.log_packet(packet, to_client=True, client_name=self.get_connection_client_name())
+
+	def send_stream_packet(self, stream_id: int, packet: AbstractPacket, *, can_block: bool = True) -> bool:
+		"""
+		Queue the packet of the logical client on the stream of this connection
+
+		:return: If the packet is queued
+		"""
+		return self.__queue_frame(net_util.encode_packet(self._cryptor, packet, self.get_wire_format(), stream_id), droppable=self.__is_droppable(packet), can_block=can_block)
+
+	def wait_for_send_queue(self):
+		"""
+		Wait until the send queue has space again with the block policy, after sending packets with can_block=False
+		"""
+		owner = self.__stream_owner
+		(owner if owner is not None else self).send_queue.wait_for_space()
+
+	@classmethod
+	def __is_droppable(cls, packet: AbstractPacket) -> bool:
+		return isinstance(packet, ChatBridgePacket) and packet.type == PacketType.chat
+
+	def __queue_frame(self, frame: bytes, *, droppable: bool, can_block: bool = True) -> bool:
+		if not self.send_queue.put(frame, droppable, can_block=can_block):
+			self.logger.warning('Disconnecting since the client cannot receive packets fast enough, send queue size limit {}B'.format(self.send_queue.settings.max_size))
+			Thread(target=self.stop, name='Disconnect.{}'.format(self.get_connection_client_name()), daemon=True).start()
+			return False
+		return True
+
+	def get_send_queue_size(self) -> int:
+		return super().get_send_queue_size() + self.send_queue.get_size()
+
+	# --------------
+	#    Streams
+	# --------------
+
+	def get_stream_owner(self) -> Optional['AnyClientConnection']:
+		"""
+		:return: The connection this logical client is on, or None if it's not on a stream of a multiplexed connection
+		"""
+		return self.__stream_owner
+
+	@property
+	def ping(self) -> float:
+		owner = self.__stream_owner
+		return owner.ping if owner is not None else super().ping
+
+	def _attach_stream(self, owner: 'AnyClientConnection', stream_id: int):
+		"""
+		Bring the client online on the stream of the owner connection
+		"""
+		self.__stream_owner = owner
+		self.__stream_id = stream_id
+		self._set_status(ClientStatus.ONLINE)
+		self.logger.info('Started client connection on stream {} of {}'.format(stream_id, owner.get_connection_client_name()))
 
-	def send_packet_invoker(self, packet: AbstractPacket):
-		self._send_packet(packet)
+	def _detach_stream(self, *, notify: bool):
+		"""
+		:param notify: If the owner connection should be told that the stream is closed
+		"""
+		owner, stream_id = self.__stream_owner, self.__stream_id
+		if owner is None:
+			return
+		self.__stream_owner = None
+		self._set_status(ClientStatus.STOPPED)
+		self.server._remove_stream(owner, stream_id, self, notify=notify)
+		self.logger.info('Stopped client connection on stream {} of {}'.format(stream_id, owner.get_connection_client_name()))
+
+	def stop(self):
+		if self.__stream_owner is not None:
+			self._detach_stream(notify=True)
+		else:
+			super().stop()
+
+	def _on_stream_packet(self, stream_id: int, packet: ChatBridgePacket):
+		client = self.streams.get(stream_id)
+		if client is None:
+			self.logger.debug('Discarded a packet of closed stream {}'.format(stream_id))
+			return
+		if self.server.should_trace_packet(packet, client.get_connection_client_name()):
+			self.logger.debug('Received packet on stream {} with type {}: {}'.format(stream_id, packet.type, packet.payload))
+		try:
+			self.server.process_packet(client, packet)
+		except:
+			self.logger.exception('Fail to process packet {}'.format(packet))
+
+	def __start_send_thread(self):
+		"""
+		Open the send queue, and start the send thread if it's not kept from the previous connection
+		"""
+		with self.__send_thread_lock:
+			self.send_queue.open()
+			if self.__send_thread is None:
+				self.__send_thread = Thread(target=self.__send_loop, name='Sender.{}'.format(self.get_connection_client_name()), daemon=True)
+				self.__send_thread.start()
+
+	def __record_frames(self, frames: List[bytes]):
+		for frame in frames:
+			self.session.record(frame)
+
+	def __send_loop(self):
+		while True:
+			# the frames are kept in the session in the order they are sent
+			frames = self.send_queue.take_all(timeout=1, on_taken=self.__record_frames)
+			if frames is None:
+				# disconnected. The thread is kept while the session can be resumed, and sends on the new connection then
+				with self.__send_thread_lock:
+					if self.send_queue.is_closed() and not self.session.is_resumable():
+						self.__send_thread = None
+						break
+				self.send_queue.wait_for_open(timeout=1)
+				continue
+			if len(frames) > 0:
+				try:
+					self._send_frame(frames[0] if len(frames) == 1 else b''.join(frames))
+				except Exception as e:
+					self.logger.debug('Failed to send {} queued packets: {}'.format(len(frames), e))
 
 	def _on_packet(self, packet: ChatBridgePacket):
 		super()._on_packet(packet)
@@ -63,13 +239,16 @@ class _ClientConnection(ChatBridgeClient):
 
 	def _on_stopped(self):
 		super()._on_stopped()
+		self.server._close_streams(self)
+		self.send_queue.close()
 		self.logger.info('Stopped client connection')
 
-	def restart_connection(self, conn: socket.socket, addr: Address):
+	def restart_connection(self, conn: socket.socket, addr: Address, login_packet: LoginPacket, frame_reader: net_util.FrameReader):
 		if not self._is_stopped():
 			self.stop()
 		self.set_server_address(addr)
-		self._set_socket(conn)
+		self._set_socket(conn, frame_reader)
+		self.__login_packet = login_packet
 		self.start()
 
 
@@ -84,13 +263,34 @@ class ComingConnection(NamedTuple):
 		return ComingConnection(sock=sock, addr=addr, thread=current_thread(), start_time=time.time())
 
 
+AnyClientConnection = Union[_ClientConnection, SelectorClientConnection]
+
+
 class ChatBridgeServer(ChatBridgeBase):
 	MAXIMUM_LOGIN_DURATION = 20  # 20s
 
-	def __init__(self, aes_key: str, server_address: Address):
+	def __init__(self, aes_key: str, server_address: Address, *, engine: str = ServerEngine.thread, compression_threshold: int = compression.DEFAULT_THRESHOLD, keep_alive_settings: keep_alive.KeepAliveSettings = keep_alive.KeepAliveSettings(), replay_buffer_settings: ReplayBufferSettings = ReplayBufferSettings(), send_queue_settings: SendQueueSettings = SendQueueSettings(), session_settings: SessionSettings = SessionSettings(), federation_settings: Optional[FederationSettings] = None):
+		"""
+		:param compression_threshold: Packets larger than this in bytes are sent compressed. -1 to disable compression
+		:param keep_alive_settings: When to send keep-alive pings to the clients and when to consider them dead
+		:param replay_buffer_settings: How many missed packets are kept for the offline clients with replay_missed_packets enabled
+		:param send_queue_settings: How many packets can be queued for each client, and what to do if a client cannot keep up
+		:param session_settings: How many sent packets are kept for the clients with session_resume_timeout set, to be sent again when they resume their session
+		:param federation_settings: The name of this hub and its peer hubs, or None to disable the federation
+		"""
 		super().__init__('Server', aes_key)
+		if engine not in (ServerEngine.thread, ServerEngine.selector):
+			raise ValueError('Unknown server engine {}'.format(engine))
 		self.server_address = server_address
-		self.clients: Dict[str, _ClientConnection] = {}
+		self.engine = engine
+		self.compression_threshold = compression_threshold
+		self.keep_alive_settings = keep_alive_settings
+		self.replay_buffer_settings = replay_buffer_settings
+		self.send_queue_settings = send_queue_settings
+		self.session_settings = session_settings
+		self.packet_trace_filter = PacketTraceFilter()
+		self.clients: Dict[str, AnyClientConnection] = {}
+		self.channel_index = ChannelIndex()
 		self.__coming_connections: List[ComingConnection] = []
 		self.__coming_connections_lock = Lock()
 		self.__sock: Optional[socket.socket] = None
@@ -98,13 +298,23 @@ class ChatBridgeServer(ChatBridgeBase):
 		self.__stop_lock = RLock()
 		self.__stopping_flag = False
 		self.__binding_done = Event()
+		self.__selector_engine: Optional[SelectorServerEngine] = None
+		self.federation: Optional[Federation] = Federation(self, federation_settings) if federation_settings is not None else None
 
 	@classmethod
 	def _get_main_loop_thread_name(cls):
 		return 'ServerThread'
 
+	def _create_connection(self, client_info: ClientInfo) -> AnyClientConnection:
+		if self.engine == ServerEngine.selector:
+			return SelectorClientConnection(self, client_info)
+		else:
+			return _ClientConnection(self, client_info)
+
 	def add_client(self, client_info: ClientInfo):
-		self.clients[client_info.name] = _ClientConnection(self, client_info)
+		self.clients[client_info.name] = self._create_connection(client_info)
+		if self.federation is not None:
+			self.federation.advertise_directory()
 
 	def is_running(self) -> bool:
 		return not self.__stopping_flag
@@ -122,30 +332,39 @@ class ChatBridgeServer(ChatBridgeBase):
 			self.__binding_done.set()
 		try:
 			self.__sock.listen(5)
-			self.__sock.settimeout(3)
-			self.logger.info('Server started at {}'.format(self.server_address))
-			counter = 0
-			while self.is_running():
-				try:
-					self.__trim_coming_connections()
-					try:
-						conn, addr = self.__sock.accept()
-					except socket.timeout:
-						continue
-					if not self.is_running():
-						conn.close()
-						break
-					address = Address(*addr)
-					counter += 1
-					self.logger.info('New connection #{} from {}'.format(counter, address))
-					Thread(name='Connection#{}'.format(counter), target=self.__handle_connection, args=(conn, address), daemon=True).start()
-				except:
-					if not self.__stopping_flag:
-						self.logger.exception('Error ticking server')
+			self.logger.info('Server started at {} with {} engine'.format(self.server_address, self.engine))
+			if self.federation is not None:
+				self.federation.start()
+			if self.engine == ServerEngine.selector:
+				self.__selector_engine = SelectorServerEngine(self, self.__sock)
+				self.__selector_engine.run()
+			else:
+				self.__thread_engine_loop()
 		finally:
 			self.__stop()
 		self.logger.info('bye')
 
+	def __thread_engine_loop(self):
+		self.__sock.settimeout(3)
+		counter = 0
+		while self.is_running():
+			try:
+				self.__trim_coming_connections()
+				try:
+					conn, addr = self.__sock.accept()
+				except socket.timeout:
+					continue
+				if not self.is_running():
+					conn.close()
+					break
+				address = Address(*addr)
+				counter += 1
+				self.logger.info('New connection #{} from {}'.format(counter, address))
+				Thread(name='Connection#{}'.format(counter), target=self.__handle_connection, args=(conn, address), daemon=True).start()
+			except:
+				if not self.__stopping_flag:
+					self.logger.exception('Error ticking server')
+
 	def start(self):
 		"""
 		Start and wait until port binding done
@@ -156,14 +375,24 @@ class ChatBridgeServer(ChatBridgeBase):
 
 	def __stop(self):
 		self.__stopping_flag = True
+		engine = self.__selector_engine
+		if engine is not None and not engine.is_in_loop_thread():
+			# the engine cleans everything up in its own thread, which invokes this method again on exit
+			engine.wakeup()
+			return
 		with self.__stop_lock:
 			if self.__sock is not None:
 				try:
 					self.__sock.close()
-					with ThreadPoolExecutor(max_workers=len(self.clients)) as worker:
-						for client in self.clients.values():
-							if client.is_running():
+					if self.federation is not None:
+						self.federation.stop()
+					running_clients = [client for client in self.clients.values() if client.is_running()]
+					if len(running_clients) > 0:
+						with ThreadPoolExecutor(max_workers=len(running_clients)) as worker:
+							for client in running_clients:
 								worker.submit(client.stop)
+					for client in self.clients.values():
+						client.session.discard()  # nothing can be resumed now, and the send threads kept for the sessions exit
 					self.__sock = None
 					self.logger.info('Socket closed')
 				except:
@@ -195,23 +424,17 @@ class ChatBridgeServer(ChatBridgeBase):
 			self.__coming_connections.append(cc)
 		try:
 			try:
-				recv_str = net_util.receive_data(conn, self._cryptor, timeout=15)
-				login_packet = LoginPacket.deserialize(json.loads(recv_str))
+				frame_reader = net_util.FrameReader(self._cryptor)
+				login_packet = LoginPacket.deserialize(frame_reader.read_frame(conn, net_util.WireFormat(), timeout=15))
 			except Exception as e:
 				self.logger.error('Failed reading client\'s login packet: {}'.format(e))
 				return
 			else:
 				self.log_packet(login_packet, to_client=False)
-				client = self.clients.get(login_packet.name, None)
-				if client is not None:
-					if client.info.password == login_packet.password:
-						success = True
-						self.logger.info('Identification of {} confirmed: {}'.format(addr, client.info.name))
-						client.restart_connection(conn, addr)
-					else:
-						self.logger.warning('Wrong password during login for client {}: expected {} but received {}'.format(client.info.name, client.info.password, login_packet.password))
-				else:
-					self.logger.warning('Unknown client name during login: {}'.format(login_packet.name))
+				client = self._authenticate_login(login_packet, addr)
+				if isinstance(client, _ClientConnection):
+					success = True
+					client.restart_connection(conn, addr, login_packet, frame_reader)
 			if not success:
 				conn.close()
 				self.logger.warning('Closed connection from {}'.format(addr))
@@ -222,13 +445,100 @@ class ChatBridgeServer(ChatBridgeBase):
 				except ValueError:
 					pass
 
+	def _authenticate_login(self, login_packet: LoginPacket, addr: Union[Address, str]) -> Optional[AnyClientConnection]:
+		"""
+		:param addr: The address of the connection, or the description of the stream
+		:return: The client connection to be used by the logged-in client, or None if the login failed
+		"""
+		client = self.clients.get(login_packet.name, None)
+		if client is not None and login_packet.resume_token != '' and client.session.can_resume(login_packet.resume_token, login_packet.received_count):
+			# the token is only known by the client that has logged in with the password, and the channels are kept in the session
+			self.logger.info('Identification of {} confirmed: {}, with its resume token'.format(addr, client.info.name))
+			return client
+		if client is None and self.federation is not None:
+			client = self.federation.get_connection(login_packet.name)
+			if client is not None:
+				if client.info.password == login_packet.password:
+					self.logger.info('Identification of {} confirmed: peer hub {}'.format(addr, client.info.name))
+					return client
+				self.logger.warning('Wrong password during login for peer hub {}'.format(client.info.name))
+				return None
+		if client is not None:
+			if client.info.password == login_packet.password:
+				self.logger.info('Identification of {} confirmed: {}'.format(addr, client.info.name))
+				channels = [channel for channel in login_packet.channels if isinstance(channel, str) and channel != '']
+				if len(channels) > 0 or len(self.channel_index.get_subscriptions(client.info.name)) > 0:
+					self.logger.info('Client {} subscribed channels: {}'.format(client.info.name, ', '.join(channels)))
+				self.channel_index.set_subscriptions(client.info.name, channels)
+				return client
+			else:
+				self.logger.warning('Wrong password during login for client {}: expected {} but received {}'.format(client.info.name, client.info.password, login_packet.password))
+		else:
+			self.logger.warning('Unknown client name during login: {}'.format(login_packet.name))
+		return None
+
+	def _negotiate_wire_format(self, login_packet: LoginPacket) -> net_util.WireFormat:
+		version = net_util.negotiate_protocol_version(login_packet.protocol_version)
+		if version == net_util.PROTOCOL_VERSION_LEGACY:
+			return net_util.WireFormat(version=version)
+		return net_util.WireFormat(
+			version=version,
+			codec=codec.negotiate_codec(login_packet.codecs),
+			compression=compression.negotiate_compression(login_packet.compressions) if self.compression_threshold >= 0 else compression.NO_COMPRESSION,
+			compression_threshold=self.compression_threshold,
+			cipher=cryptor.negotiate_cipher(login_packet.ciphers) if not self._cryptor.is_key_empty() else cryptor.CIPHER_AES_CBC,
+			multiplex=login_packet.multiplex,
+		)
+
+	@classmethod
+	def _create_login_result(cls, wire_format: net_util.WireFormat, resume_token: str = '', resumed: bool = False) -> LoginResultPacket:
+		return LoginResultPacket(message='ok', protocol_version=wire_format.version, codec=wire_format.codec, compression=wire_format.compression, cipher=wire_format.cipher, multiplex=wire_format.multiplex, resume_token=resume_token, resumed=resumed)
+
+	def _start_session(self, client: AnyClientConnection, login_packet: LoginPacket) -> Optional[Tuple[LoginResultPacket, net_util.WireFormat, List[bytes]]]:
+		"""
+		Resume the session of the client if the login packet asks for it and it's still resumable, otherwise start a new one.
+		Invoked with the replay buffer lock held, after the previous connection of the client is closed
+
+		:return: The login result to send, the wire format to use after it, and the frames to send again.
+			None if the login is only authenticated by the resume token, and the session has expired meanwhile
+		"""
+		session = client.session
+		if session.can_resume(login_packet.resume_token, login_packet.received_count):
+			frames = session.resume(login_packet.received_count)
+			client.logger.info('Resumed the session, sending {} packets again'.format(len(frames)))
+			return self._create_login_result(session.wire_format, session.token, True), session.wire_format, frames
+		if login_packet.password != client.info.password:
+			client.logger.warning('Cannot resume the session, and the password is wrong')
+			return None
+		if login_packet.resume_token != '' and session.enabled:
+			client.logger.info('Cannot resume the session, starting a new one')
+		wire_format = self._negotiate_wire_format(login_packet)
+		token = session.start(wire_format)
+		return self._create_login_result(wire_format, token if session.enabled else ''), wire_format, []
+
+	def should_trace_packet(self, packet: ChatBridgePacket, client_name: str) -> bool:
+		"""
+		:param client_name: The client that the packet is sent to or received from
+		:return: If the packet should be logged, according to the debug switch and the packet trace filter
+		"""
+		return self.logger.is_debug_enabled() and self.packet_trace_filter.accept((packet.sender, client_name), packet.type)
+
 	def log_packet(self, packet: AbstractPacket, *, to_client: bool, client_name: str = None):
+		if not self.logger.is_debug_enabled():
+			return  # it's invoked for every packet forwarded, so build nothing if it's going to be dropped
 		if isinstance(packet, ChatBridgePacket):
 			if to_client:
 				assert client_name is not None
+				if not self.packet_trace_filter.accept((packet.sender, client_name), packet.type):
+					return
 				indicator = '-> {}'.format(client_name)
 			else:
-				indicator = '{} -> {}'.format(packet.sender, ','.join(packet.receivers) if not packet.broadcast else '*')
+				if not self.packet_trace_filter.accept([packet.sender, *packet.receivers], packet.type):
+					return
+				if packet.channel != '':
+					indicator = '{} -> @{}'.format(packet.sender, packet.channel)
+				else:
+					indicator = '{} -> {}'.format(packet.sender, ','.join(packet.receivers) if not packet.broadcast else '*')
 			self.logger.debug('[{}] {}: {}'.format(indicator, packet.type, packet.payload))
 		else:
 			if to_client:
@@ -237,10 +547,24 @@ class ChatBridgeServer(ChatBridgeBase):
 				indicator = '? -> {}'.format(constants.SERVER_NAME)
 			self.logger.debug('[{}] {}: {}'.format(indicator, packet.__class__.__name__, packet.serialize()))
 
-	def process_packet(self, client: _ClientConnection, packet: ChatBridgePacket):
+	def process_packet(self, client: AnyClientConnection, packet: ChatBridgePacket):
 		if packet.sender != client.info.name:
 			self.logger.warning('Un-matched sender name during packet transferring, expected {} but found {}'.format(client.info.name, packet.sender))
 			return
+		if self.federation is not None and self.federation.is_peer_connection(client):
+			if packet.type == PacketType.federation:
+				self.federation.on_peer_packet(client.info.name, packet)
+			return
+		if packet.type == PacketType.stream:
+			self.log_packet(packet, to_client=False)
+			if client.get_stream_owner() is None:
+				try:
+					payload = StreamPayload.deserialize(packet.payload)
+				except:
+					self.logger.exception('Error when deserialize stream packet from {}'.format(client.get_connection_client_name()))
+				else:
+					self.__on_stream_payload(client, payload)
+			return
 		self.log_packet(packet, to_client=False)
 		if packet.type == PacketType.chat:
 			try:
@@ -248,18 +572,144 @@ class ChatBridgeServer(ChatBridgeBase):
 			except:
 				self.logger.exception('Error when deserialize chat packet from {}'.format(
 					client.get_connection_client_name()))
-		receivers = packet.receivers if not packet.broadcast else self.clients.keys()
-		for receiver_name in set(receivers):
+		if packet.channel != '' and not self.channel_index.is_member(packet.channel, packet.sender):
+			self.logger.warning('Client {} sent a packet to channel {} without subscribing it'.format(packet.sender, packet.channel))
+			return
+		self._route_packet(packet, [])
+
+	def _route_packet(self, packet: ChatBridgePacket, visited: List[str], packet_id: str = ''):
+		"""
+		Deliver the packet to its receivers on this hub, and pass it on to the peer hubs for the other receivers
+
+		:param visited: The federation hubs that have received the packet, empty if it's sent by a client of this hub
+		:param packet_id: The federation id of the packet, empty if it's sent by a client of this hub
+		"""
+		if packet.channel != '':
+			receivers = self.channel_index.get_members(packet.channel)
+		elif packet.broadcast:
+			receivers = set(self.clients.keys())
+		else:
+			receivers = set(packet.receivers)
+		remote_receivers = []
+		frame_cache: Dict[net_util.WireFormat, bytes] = {}  # so the packet is only encoded once per wire format
+		for receiver_name in receivers:
 			if receiver_name != packet.sender:
 				if receiver_name == constants.SERVER_NAME:
-					self.on_packet(packet)
+					if len(visited) == 0:  # only the hub of the sender handles it
+						self.on_packet(packet)
 				else:
 					client = self.clients.get(receiver_name)
 					if client is not None:
-						if client.is_online():
-							client.send_packet_invoker(packet)
+						self._send_or_buffer(client, packet, frame_cache)
+					elif self.federation is not None:
+						remote_receivers.append(receiver_name)
 					else:
 						self.logger.warning('Unknown client name {}'.format(receiver_name))
+		if self.federation is not None:
+			self.federation.forward(packet, remote_receivers, visited, packet_id)
+
+	def _send_or_buffer(self, client: AnyClientConnection, packet: ChatBridgePacket, frame_cache: Optional[Dict[net_util.WireFormat, bytes]] = None):
+		replay_buffer = client.replay_buffer
+		session = client.session
+		if not replay_buffer.enabled and not session.enabled:
+			if client.is_online():
+				client.send_packet_invoker(packet, frame_cache)
+			return
+		with replay_buffer.lock:
+			if client.is_online():
+				# never wait for a slow client here, since the lock is needed to disconnect it, and by the keep-alive of every client
+				client.send_packet_invoker(packet, frame_cache, can_block=False)
+			elif replay_buffer.enabled:
+				replay_buffer.add(packet)
+			elif session.is_resumable():
+				# counted as sent in the session, so it's sent if the client resumes the session in time
+				wire_format = session.wire_format
+				frame = frame_cache.get(wire_format) if frame_cache is not None else None
+				if frame is None:
+					frame = net_util.encode_packet(self._cryptor, packet, wire_format)
+					if frame_cache is not None:
+						frame_cache[wire_format] = frame
+				session.record(frame)
+		client.wait_for_send_queue()
+
+	# --------------
+	#    Streams
+	# --------------
+
+	def __send_stream_payload(self, owner: AnyClientConnection, payload: StreamPayload):
+		owner.send_packet_invoker(ChatBridgePacket(
+			sender=constants.SERVER_NAME,
+			receivers=[owner.get_connection_client_name()],
+			broadcast=False,
+			type=PacketType.stream,
+			payload=payload.serialize()
+		))
+
+	def __on_stream_payload(self, owner: AnyClientConnection, payload: StreamPayload):
+		if payload.is_open():
+			self.__open_stream(owner, payload)
+		elif payload.is_close():
+			client = owner.streams.get(payload.stream_id)
+			if client is not None:
+				client._detach_stream(notify=False)
+		else:
+			self.logger.warning('Unknown stream action {} from {}'.format(payload.action, owner.get_connection_client_name()))
+
+	def __open_stream(self, owner: AnyClientConnection, payload: StreamPayload):
+		stream_id = payload.stream_id
+		if not owner.get_wire_format().multiplex:
+			message = 'multiplexing is not negotiated'
+		elif not 0 < stream_id <= net_util.MAX_STREAM_ID or stream_id in owner.streams:
+			message = 'invalid stream id'
+		else:
+			login_packet = LoginPacket(name=payload.name, password=payload.password, channels=payload.channels)
+			client = self._authenticate_login(login_packet, 'stream {} of {}'.format(stream_id, owner.get_connection_client_name()))
+			if client is None or self.clients.get(client.info.name) is not client:
+				message = 'login failed'
+			elif client is owner or len(client.streams) > 0:
+				message = 'the client owns a multiplexed connection'
+			else:
+				if client.is_online():
+					client.logger.info('Replacing the existing connection with stream {} of {}'.format(stream_id, owner.get_connection_client_name()))
+					client.stop()
+				with client.replay_buffer.lock:
+					client.session.discard()  # its packets are sent through the session of the owner now
+					owner.streams[stream_id] = client
+					client._attach_stream(owner, stream_id)
+					self.__send_stream_payload(owner, StreamPayload.opened(stream_id))
+					self._replay_missed_packets(client)
+				return
+		self.logger.warning('Rejected stream {} of {}: {}'.format(stream_id, owner.get_connection_client_name(), message))
+		self.__send_stream_payload(owner, StreamPayload.rejected(stream_id, message))
+
+	def _remove_stream(self, owner: AnyClientConnection, stream_id: int, client: AnyClientConnection, *, notify: bool):
+		"""
+		Invoked by the logical client when it's detached from the stream
+
+		:param notify: If the owner connection should be told that the stream is closed
+		"""
+		if owner.streams.get(stream_id) is client:
+			del owner.streams[stream_id]
+			if notify and owner.is_online():
+				self.__send_stream_payload(owner, StreamPayload.close(stream_id))
+
+	def _close_streams(self, owner: AnyClientConnection):
+		"""
+		Bring all logical clients on the streams of the connection offline, when the connection is closed
+		"""
+		for client in list(owner.streams.values()):
+			client._detach_stream(notify=False)
+
+	def _replay_missed_packets(self, client: AnyClientConnection):
+		"""
+		Deliver the packets buffered while the client was offline. Invoked with the replay buffer lock held right after login
+		"""
+		packets = client.replay_buffer.drain()
+		dropped_count = client.replay_buffer.get_dropped_count()
+		if len(packets) > 0:
+			client.logger.info('Delivering {} packets missed while offline, {} packets were discarded in total'.format(len(packets), dropped_count))
+		for packet in packets:
+			client.send_packet_invoker(packet, can_block=False)
 
 	def on_chat(self, sender: str, content: ChatPayload):
 		pass
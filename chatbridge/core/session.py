@@ -0,0 +1,120 @@
+"""
+Sessions of the client connections, so a client reconnecting shortly after losing its connection continues where it left off
+"""
+import collections
+import hmac
+import secrets
+import time
+from threading import RLock
+from typing import NamedTuple, Optional, Deque, List
+
+from chatbridge.core.network import net_util
+
+
+class SessionSettings(NamedTuple):
+	resume_timeout: float = 0  # a session can be resumed within this many seconds after the connection is lost. 0 to disable resumption. Set for each client by ClientInfo.session_resume_timeout
+	window_size: int = 256 * 2 ** 10  # the maximum total size of the latest frames kept for sending again in bytes
+
+
+class Session:
+	"""
+	The server side state of a client connection, which survives a reconnect within the resume timeout
+
+	Both sides count the frames sent by the server after the login result. The server keeps the latest frames it has written to the socket,
+	and the frames for the client while it's disconnected. A resuming client tells how many frames it has received,
+	so the frames lost with the old connection are sent again, in the same wire format, and nothing is sent twice
+
+	Hold the replay buffer lock of the connection when checking if the client is online and recording frames for the disconnected client,
+	and when resuming the session
+	"""
+	def __init__(self, settings: SessionSettings):
+		self.settings = settings
+		self.lock = RLock()
+		self.token = ''
+		self.wire_format = net_util.WireFormat()
+		self.__frames: Deque[bytes] = collections.deque()
+		self.__first_index = 0  # the index of the first kept frame
+		self.__size = 0
+		self.__disconnect_time: Optional[float] = None
+
+	@property
+	def enabled(self) -> bool:
+		return self.settings.resume_timeout > 0
+
+	def get_sent_count(self) -> int:
+		"""
+		The amount of frames sent in the session
+		"""
+		return self.__first_index + len(self.__frames)
+
+	def __reset(self, first_index: int):
+		self.__frames.clear()
+		self.__first_index = first_index
+		self.__size = 0
+		self.__disconnect_time = None
+		self.token = secrets.token_urlsafe(16)
+
+	def start(self, wire_format: net_util.WireFormat) -> str:
+		"""
+		Start a new session after a full login
+
+		:return: The token to resume the session
+		"""
+		with self.lock:
+			self.wire_format = wire_format
+			self.__reset(0)
+			return self.token
+
+	def can_resume(self, token: str, received_count: int) -> bool:
+		"""
+		:param token: The token provided by the client
+		:param received_count: The amount of frames received by the client in the session
+		"""
+		with self.lock:
+			return self.is_resumable() and token != '' and hmac.compare_digest(token, self.token) and self.__first_index <= received_count <= self.get_sent_count()
+
+	def resume(self, received_count: int) -> List[bytes]:
+		"""
+		Continue the session on a new connection. The token is replaced, so it can only be used once
+
+		:return: The frames not received by the client, which should be sent again
+		"""
+		with self.lock:
+			frames = list(self.__frames)[received_count - self.__first_index:]
+			self.__reset(received_count)
+			return frames
+
+	def discard(self):
+		"""
+		Make the session impossible to resume, e.g. when the client logs in on a stream instead
+		"""
+		with self.lock:
+			self.__reset(self.get_sent_count())
+			self.token = ''
+
+	def on_disconnected(self):
+		with self.lock:
+			if self.__disconnect_time is None:
+				self.__disconnect_time = time.monotonic()
+
+	def is_resumable(self) -> bool:
+		if not self.enabled or self.token == '':
+			return False
+		disconnect_time = self.__disconnect_time
+		if disconnect_time is not None and time.monotonic() - disconnect_time > self.settings.resume_timeout:
+			self.discard()  # free the kept frames
+			return False
+		return True
+
+	def record(self, frame: bytes):
+		"""
+		Keep a frame written to the socket, or a frame for the disconnected client, in the order they are sent
+		"""
+		if not self.enabled:
+			return
+		with self.lock:
+			self.__frames.append(frame)
+			self.__size += len(frame)
+			while self.__size > self.settings.window_size and len(self.__frames) > 0:
+				self.__size -= len(self.__frames.popleft())
+				self.__first_index += 1
@@ -0,0 +1,59 @@
+"""
+Writes the chat messages to the chat log file in a background thread, so forwarding the chat never waits for the disk
+"""
+import os
+import time
+from typing import List, Tuple, Optional
+
+from chatbridge.common.logger import ChatBridgeLogger
+from chatbridge.impl.cli.chat_writer import BufferedChatWriter
+
+
+class ChatArchive(BufferedChatWriter):
+	def __init__(self, file_path: str, logger: ChatBridgeLogger, *, flush_interval: float = 1, rotate_daily: bool = False):
+		"""
+		:param flush_interval: The maximum seconds a message stays in the buffer
+		:param rotate_daily: Rename the chat log file to e.g. chat_2024-01-01.log when the date changes
+		"""
+		super().__init__(logger, thread_name='ChatArchive', target_name='the chat log file', flush_interval=flush_interval)
+		self.file_path = file_path
+		self.rotate_daily = rotate_daily
+		self.__file_date: Optional[str] = None
+
+	def add(self, sender: str, message: str):
+		"""
+		Buffer a chat message to be written. Thread safe
+		"""
+		self._add((time.time(), sender, message))
+
+	def __rotate(self, date: str):
+		if self.__file_date is None and os.path.isfile(self.file_path):
+			self.__file_date = time.strftime('%Y-%m-%d', time.localtime(os.stat(self.file_path).st_mtime))
+		if self.__file_date is not None and self.__file_date != date and os.path.isfile(self.file_path):
+			root, ext = os.path.splitext(self.file_path)
+			archive_path = '{}_{}{}'.format(root, self.__file_date, ext)
+			counter = 1
+			while os.path.exists(archive_path):
+				counter += 1
+				archive_path = '{}_{}-{}{}'.format(root, self.__file_date, counter, ext)
+			os.replace(self.file_path, archive_path)
+		self.__file_date = date
+
+	def _write(self, buffer: List[Tuple[float, str, str]]):
+		file = None
+		try:
+			for timestamp, sender, message in buffer:
+				local_time = time.localtime(timestamp)
+				if self.rotate_daily:
+					date = time.strftime('%Y-%m-%d', local_time)
+					if date != self.__file_date:
+						if file is not None:
+							file.close()
+							file = None
+						self.__rotate(date)
+				if file is None:
+					file = open(self.file_path, 'a', encoding='utf8')
+				file.write('[{}] [{}] {}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S', local_time), sender, message))
+		finally:
+			if file is not None:
+				file.close()
@@ -0,0 +1,130 @@
+"""
+Stores the chat messages in a SQLite database with a full-text index, so recent messages can be listed and searched.
+Messages are inserted in batches in a background thread, so forwarding the chat never waits for the disk
+"""
+import sqlite3
+import time
+from threading import Lock
+from typing import List, Tuple, Optional
+
+from chatbridge.common.logger import ChatBridgeLogger
+from chatbridge.impl.cli.chat_writer import BufferedChatWriter
+from chatbridge.impl.cli.protocol import HistoryMessage
+
+
+class ChatHistory(BufferedChatWriter):
+	MAX_QUERY_COUNT = 1000  # the maximum amount of messages returned by a query
+	MIN_INDEXED_SEARCH_LENGTH = 3  # the trigram index can't search texts shorter than this
+
+	def __init__(self, file_path: str, logger: ChatBridgeLogger, *, flush_interval: float = 1):
+		"""
+		:param flush_interval: The maximum seconds a message stays in the buffer
+		"""
+		super().__init__(logger, thread_name='ChatHistory', target_name='the chat history', flush_interval=flush_interval)
+		self.file_path = file_path
+		self.__write_connection: Optional[sqlite3.Connection] = None
+		self.__query_lock = Lock()
+		self.__query_connection: Optional[sqlite3.Connection] = None
+		self.__full_text_indexed = False
+
+	def __connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+		connection = sqlite3.connect(self.file_path, check_same_thread=check_same_thread)
+		connection.execute('PRAGMA journal_mode=WAL')
+		connection.execute('PRAGMA synchronous=NORMAL')
+		return connection
+
+	def __create_tables(self, connection: sqlite3.Connection):
+		with connection:
+			connection.execute('CREATE TABLE IF NOT EXISTS chat (id INTEGER PRIMARY KEY AUTOINCREMENT, time REAL NOT NULL, client TEXT NOT NULL, author TEXT NOT NULL, message TEXT NOT NULL)')
+		try:
+			with connection:
+				# the trigram tokenizer matches any substring, which also works for languages without spaces between words
+				connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(client, author, message, content='chat', content_rowid='id', tokenize='trigram')")
+				connection.execute('CREATE TRIGGER IF NOT EXISTS chat_fts_insert AFTER INSERT ON chat BEGIN INSERT INTO chat_fts(rowid, client, author, message) VALUES (new.id, new.client, new.author, new.message); END')
+		except sqlite3.OperationalError as e:
+			self.logger.warning('Full-text index is not available, searching the chat history will be slow: {}'.format(e))
+			self.__full_text_indexed = False
+		else:
+			self.__full_text_indexed = True
+
+	def start(self):
+		"""
+		Open the database and start the writer thread
+
+		:raise sqlite3.Error: If the database can't be opened
+		"""
+		connection = self.__connect(check_same_thread=False)
+		self.__create_tables(connection)
+		self.__query_connection = connection
+		super().start()
+
+	def stop(self):
+		"""
+		Write all buffered messages and close the database
+		"""
+		super().stop()
+		with self.__query_lock:
+			if self.__query_connection is not None:
+				self.__query_connection.close()
+				self.__query_connection = None
+
+	def add(self, client: str, author: str, message: str):
+		"""
+		Buffer a chat message to be stored. Thread safe
+		"""
+		self._add((time.time(), client, author, message))
+
+	# --------------
+	#     Writer
+	# --------------
+
+	def _on_writer_started(self):
+		self.__write_connection = self.__connect()
+
+	def _on_writer_stopped(self):
+		if self.__write_connection is not None:
+			self.__write_connection.close()
+			self.__write_connection = None
+
+	def _write(self, buffer: List[Tuple[float, str, str, str]]):
+		with self.__write_connection:
+			self.__write_connection.executemany('INSERT INTO chat (time, client, author, message) VALUES (?, ?, ?, ?)', buffer)
+
+	# ---------------
+	#     Queries
+	# ---------------
+
+	def __query(self, sql: str, params: tuple) -> List[HistoryMessage]:
+		self.flush()
+		with self.__query_lock:
+			if self.__query_connection is None:
+				return []
+			rows = self.__query_connection.execute(sql, params).fetchall()
+		rows.reverse()
+		return [HistoryMessage(id=row[0], time=row[1], client=row[2], author=row[3], message=row[4]) for row in rows]
+
+	def get_latest(self, count: int) -> List[HistoryMessage]:
+		"""
+		:return: The latest messages, ordered from the oldest to the newest
+		"""
+		count = max(0, min(count, self.MAX_QUERY_COUNT))
+		return self.__query('SELECT id, time, client, author, message FROM chat ORDER BY id DESC LIMIT ?', (count,))
+
+	def search(self, text: str, count: int) -> List[HistoryMessage]:
+		"""
+		Search the messages whose author, message or client contains the given text, case-insensitive
+
+		:return: The latest matching messages, ordered from the oldest to the newest
+		"""
+		count = max(0, min(count, self.MAX_QUERY_COUNT))
+		if self.__full_text_indexed and len(text) >= self.MIN_INDEXED_SEARCH_LENGTH:
+			return self.__query(
+				'SELECT id, time, client, author, message FROM chat WHERE id IN (SELECT rowid FROM chat_fts WHERE chat_fts MATCH ? ORDER BY rowid DESC LIMIT ?) ORDER BY id DESC',
+				('"{}"'.format(text.replace('"', '""')), count)
+			)
+		else:
+			pattern = '%{}%'.format(text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+			return self.__query(
+				"SELECT id, time, client, author, message FROM chat WHERE author LIKE ?1 ESCAPE '\\' OR message LIKE ?1 ESCAPE '\\' OR client LIKE ?1 ESCAPE '\\' ORDER BY id DESC LIMIT ?2",
+				(pattern, count)
+			)
@@ -0,0 +1,123 @@
+"""
+The base of the chat sinks, which buffer the chat messages and write them in batches in a background thread,
+so forwarding the chat never waits for the disk
+"""
+from abc import ABC, abstractmethod
+from threading import Thread, Condition
+from typing import List, Optional, Any
+
+from chatbridge.common.logger import ChatBridgeLogger
+
+
+class BufferedChatWriter(ABC):
+	FLUSH_SIZE = 1000  # flush at once when this many messages are buffered
+	MAX_BUFFER_SIZE = 100000  # messages beyond this are dropped if the disk can't keep up
+
+	def __init__(self, logger: ChatBridgeLogger, *, thread_name: str, target_name: str, flush_interval: float = 1):
+		"""
+		:param thread_name: The name of the writer thread
+		:param target_name: What the messages are written to, for the log messages
+		:param flush_interval: The maximum seconds a message stays in the buffer
+		"""
+		self.logger = logger
+		self.flush_interval = flush_interval
+		self.__thread_name = thread_name
+		self.__target_name = target_name
+		self.__condition = Condition()
+		self.__buffer: List[Any] = []
+		self.__added_count = 0
+		self.__written_count = 0
+		self.__dropped_count = 0
+		self.__flush_requested = False
+		self.__stopping = False
+		self.__thread: Optional[Thread] = None
+
+	def start(self):
+		self.__thread = Thread(target=self.__loop, name=self.__thread_name, daemon=True)
+		self.__thread.start()
+
+	def stop(self):
+		"""
+		Write all buffered messages and stop the writer thread
+		"""
+		with self.__condition:
+			self.__stopping = True
+			self.__condition.notify_all()
+		if self.__thread is not None:
+			self.__thread.join()
+			self.__thread = None
+
+	def _add(self, item):
+		"""
+		Buffer a message to be written. Thread safe
+		"""
+		with self.__condition:
+			if len(self.__buffer) >= self.MAX_BUFFER_SIZE:
+				self.__dropped_count += 1
+				return
+			self.__buffer.append(item)
+			self.__added_count += 1
+			if len(self.__buffer) == self.FLUSH_SIZE:
+				self.__condition.notify_all()
+
+	def flush(self):
+		"""
+		Wait until all messages added before are written
+		"""
+		with self.__condition:
+			target = self.__added_count
+			self.__flush_requested = True
+			self.__condition.notify_all()
+			while self.__written_count < target and self.__thread is not None and self.__thread.is_alive():
+				self.__condition.wait(1)
+
+	# --------------
+	#     Writer
+	# --------------
+
+	def _on_writer_started(self):
+		"""
+		Invoked on the writer thread before writing anything
+		"""
+		pass
+
+	def _on_writer_stopped(self):
+		"""
+		Invoked on the writer thread when it's about to exit
+		"""
+		pass
+
+	@abstractmethod
+	def _write(self, items: list):
+		"""
+		Write a batch of messages. Invoked on the writer thread
+		"""
+		raise NotImplementedError()
+
+	def __loop(self):
+		try:
+			self._on_writer_started()
+			while True:
+				with self.__condition:
+					if not self.__stopping and not self.__flush_requested and len(self.__buffer) < self.FLUSH_SIZE:
+						self.__condition.wait(self.flush_interval)
+					buffer, self.__buffer = self.__buffer, []
+					self.__flush_requested = False
+					dropped_count, self.__dropped_count = self.__dropped_count, 0
+					stopping = self.__stopping
+				if dropped_count > 0:
+					self.logger.warning('Dropped {} chat messages since {} cannot be written fast enough'.format(dropped_count, self.__target_name))
+				if len(buffer) > 0:
+					try:
+						self._write(buffer)
+					except Exception as e:
+						self.logger.error('Failed to write {} chat messages to {}: {} {}'.format(len(buffer), self.__target_name, type(e), e))
+				with self.__condition:
+					self.__written_count += len(buffer)
+					self.__condition.notify_all()
+				if stopping:
+					break
+		except Exception:
+			self.logger.exception('Writer of {} stopped unexpectedly'.format(self.__target_name))
+		finally:
+			self._on_writer_stopped()
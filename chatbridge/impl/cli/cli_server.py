@@ -2,17 +2,29 @@ import sys
 import threading
 import time
 import traceback
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import Optional, List
 
+from chatbridge.common import constants
+from chatbridge.common.logger import ChatBridgeLogger
 from chatbridge.core.config import ServerConfig
 from chatbridge.core.network.basic import Address
-from chatbridge.core.network.protocol import ChatPayload
+from chatbridge.core.network.protocol import ChatPayload, ChatBridgePacket, PacketType, CommandPayload
+from chatbridge.core.packet_trace import PacketTraceFilter
 from chatbridge.core.server import ChatBridgeServer
 from chatbridge.impl import utils
+from chatbridge.impl.cli.chat_archive import ChatArchive
+from chatbridge.impl.cli.chat_history import ChatHistory
+from chatbridge.impl.cli.protocol import HISTORY_COMMAND, HistoryQueryParams, HistoryQueryResult, HistoryMessage
 
 
 class CLIServerConfig(ServerConfig):
 	show_chat: bool = True
 	log_chat: bool = False
+	chat_log_flush_interval: float = 1  # the maximum seconds a chat message stays in memory before being written to the chat log file
+	chat_log_rotate_daily: bool = False  # rename the chat log file to e.g. chat_2024-01-01.log when the date changes
+	chat_history: bool = False  # store the chat messages in a database, so they can be listed and searched
+	chat_history_file: str = 'chat_history.db'
 
 
 config: CLIServerConfig
@@ -34,15 +46,97 @@ def thread_dump() -> str:
 
 
 class CLIServer(ChatBridgeServer):
+	DEFAULT_HISTORY_COUNT = 20
+	chat_archive: Optional[ChatArchive] = None
+	chat_history: Optional[ChatHistory] = None
+	__history_query_executor: Optional[ThreadPoolExecutor] = None
+
+	def start(self):
+		if config.log_chat:
+			self.chat_archive = ChatArchive(CHAT_LOGGING_FILE, self.logger, flush_interval=config.chat_log_flush_interval, rotate_daily=config.chat_log_rotate_daily)
+			self.chat_archive.start()
+		if config.chat_history:
+			self.chat_history = ChatHistory(config.chat_history_file, self.logger, flush_interval=config.chat_log_flush_interval)
+			self.chat_history.start()
+			# queries may take a while, so they are not done in the network threads
+			self.__history_query_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ChatHistoryQuery')
+		super().start()
+
+	def stop(self):
+		super().stop()
+		if self.chat_archive is not None:
+			self.chat_archive.stop()
+			self.chat_archive = None
+		if self.__history_query_executor is not None:
+			self.__history_query_executor.shutdown(wait=True)
+			self.__history_query_executor = None
+		if self.chat_history is not None:
+			self.chat_history.stop()
+			self.chat_history = None
+
 	def on_chat(self, sender: str, content: ChatPayload):
 		if config.show_chat:
 			self.logger.info('Chat from {}: {}'.format(sender, content.formatted_str()))
-		if config.log_chat:
+		chat_archive = self.chat_archive
+		if chat_archive is not None:
+			chat_archive.add(sender, content.formatted_str())
+		chat_history = self.chat_history
+		if chat_history is not None:
+			chat_history.add(sender, content.author, content.message)
+
+	def on_packet(self, packet: ChatBridgePacket):
+		if packet.type == PacketType.command:
 			try:
-				with open(CHAT_LOGGING_FILE, 'a') as file:
-					file.write('[{}] [{}] {}\n'.format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), sender, content.formatted_str()))
-			except Exception as e:
-				self.logger.error('Failed to log chat message: {} {}'.format(type(e), e))
+				payload = CommandPayload.deserialize(packet.payload)
+			except:
+				self.logger.exception('Error when deserialize command packet from {}'.format(packet.sender))
+				return
+			if not payload.responded and payload.command == HISTORY_COMMAND:
+				executor = self.__history_query_executor
+				if executor is not None:
+					try:
+						executor.submit(self.__answer_history_query, packet.sender, payload)
+					except RuntimeError:  # the executor is shut down
+						pass
+				else:
+					self.__reply_command(packet.sender, payload, HistoryQueryResult.no_history())
+
+	def __reply_command(self, target: str, asker_payload: CommandPayload, result: HistoryQueryResult):
+		client = self.clients.get(target)
+		if client is not None and client.is_online():
+			client.send_packet_invoker(ChatBridgePacket(
+				sender=constants.SERVER_NAME,
+				receivers=[target],
+				broadcast=False,
+				type=PacketType.command,
+				payload=CommandPayload.answer(asker_payload, result).serialize()
+			))
+
+	def __answer_history_query(self, asker: str, payload: CommandPayload):
+		try:
+			params = HistoryQueryParams.deserialize(payload.params)
+		except:
+			self.__reply_command(asker, payload, HistoryQueryResult.bad_params())
+			return
+		try:
+			chat_history = self.chat_history
+			if chat_history is None:
+				result = HistoryQueryResult.no_history()
+			elif params.search != '':
+				result = HistoryQueryResult.create(chat_history.search(params.search, params.count))
+			else:
+				result = HistoryQueryResult.create(chat_history.get_latest(params.count))
+			self.__reply_command(asker, payload, result)
+		except:
+			self.logger.exception('Failed to answer the chat history query from {}'.format(asker))
+
+	def __show_history(self, messages: List[HistoryMessage]):
+		self.logger.info('Found {} chat messages'.format(len(messages)))
+		for message in messages:
+			self.logger.info('[{}] [{}] {}'.format(
+				time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(message.time)), message.client,
+				ChatPayload(author=message.author, message=message.message).formatted_str()
+			))
 
 	def console_loop(self):
 		while self.is_running():
@@ -64,20 +158,68 @@ class CLIServer(ChatBridgeServer):
 			elif text == 'list':
 				self.logger.info('Client count: {}'.format(len(self.clients)))
 				for client in self.clients.values():
-					self.logger.info('- {}: online = {}, ping = {}'.format(client.info.name, client.is_online(), client.get_ping_text()))
+					line = '- {}: online = {}, ping = {}, send queue = {}B, lagged = {}, dropped = {}'.format(
+						client.info.name, client.is_online(), client.get_ping_text(), client.get_send_queue_size(),
+						client.send_queue.get_overflow_count(), client.send_queue.get_dropped_count()
+					)
+					if client.get_stream_owner() is not None:
+						line += ', on a stream of {}'.format(client.get_stream_owner().get_connection_client_name())
+					if client.replay_buffer.enabled:
+						line += ', replay buffer = {} packets / {}B, discarded = {}'.format(len(client.replay_buffer), client.replay_buffer.get_size(), client.replay_buffer.get_dropped_count())
+					self.logger.info(line)
+			elif text == 'channels':
+				channels = self.channel_index.get_channels()
+				self.logger.info('Channel count: {}'.format(len(channels)))
+				for channel, members in sorted(channels.items()):
+					self.logger.info('- {}: {}'.format(channel, ', '.join(sorted(members))))
+			elif text == 'federation':
+				federation = self.federation
+				if federation is None:
+					self.logger.warning('Federation is not enabled')
+				else:
+					self.logger.info('Hub name: {}, peer count: {}'.format(federation.hub_name, len(federation.peers)))
+					for line in federation.get_status_lines():
+						self.logger.info(line)
 			elif text == 'debug on':
 				self.logger.set_debug_all(True)
 				self.logger.info('Debug logging on')
 			elif text == 'debug off':
 				self.logger.set_debug_all(False)
 				self.logger.info('Debug logging off')
+			elif text == 'trace' or text.startswith('trace '):
+				args = text.split()[1:]
+				if len(args) == 0:
+					self.logger.info('Packet trace filter: {}'.format(self.packet_trace_filter))
+				else:
+					try:
+						self.packet_trace_filter = PacketTraceFilter() if args == ['all'] else PacketTraceFilter.parse(args)
+					except ValueError as e:
+						self.logger.warning('Invalid packet trace filter: {}'.format(e))
+					else:
+						self.logger.info('Packet trace filter set to: {}'.format(self.packet_trace_filter))
+			elif text == 'history' or text.startswith('history ') or text.startswith('search '):
+				chat_history = self.chat_history
+				command, _, arg = text.partition(' ')
+				if chat_history is None:
+					self.logger.warning('Chat history is not enabled')
+				elif command == 'search':
+					self.__show_history(chat_history.search(arg, self.DEFAULT_HISTORY_COUNT))
+				elif arg == '' or arg.isdigit():
+					self.__show_history(chat_history.get_latest(int(arg) if arg != '' else self.DEFAULT_HISTORY_COUNT))
+				else:
+					self.logger.warning('Invalid message count {}'.format(arg))
 			elif text == 'thread_dump':
 				self.logger.info(thread_dump())
 			else:
 				self.logger.info('stop": stop the server')
 				self.logger.info('stop <client_name>": stop a client')
 				self.logger.info('list": show the client list')
+				self.logger.info('channels": show the channels and their members')
+				self.logger.info('federation": show the peer hubs and their links')
 				self.logger.info('debug on|off": switch debug logging')
+				self.logger.info('trace [all|client=<names> type=<types> sample=<n>]": show or set which packets are logged in debug logging')
+				self.logger.info('history [<n>]": show the latest n chat messages')
+				self.logger.info('search <text>": show the latest chat messages containing the text')
 
 
 def main():
@@ -86,7 +228,9 @@ def main():
 	address = Address(config.hostname, config.port)
 	print('AES Key = {}'.format(config.aes_key))
 	print('Server address = {}'.format(address))
-	server = CLIServer(config.aes_key, address)
+	ChatBridgeLogger.set_async_all(config.async_logging)
+	ChatBridgeLogger.set_file_rotation(max_size=config.log_rotate_size * 2 ** 20, daily=config.log_rotate_daily)
+	server = CLIServer(config.aes_key, address, engine=config.engine, compression_threshold=config.compression_threshold, keep_alive_settings=config.keep_alive_settings, replay_buffer_settings=config.replay_buffer_settings, send_queue_settings=config.send_queue_settings, session_settings=config.session_settings, federation_settings=config.federation_settings)
 	for i, client_info in enumerate(config.clients):
 		print('- Client #{}: name = {}, password = {}'.format(i + 1, client_info.name, client_info.password))
 		server.add_client(client_info)
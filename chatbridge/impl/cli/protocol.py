@@ -0,0 +1,39 @@
+from typing import List
+
+from chatbridge.common.serializer import FastSerializable
+
+HISTORY_COMMAND = '!!history'
+
+
+class HistoryQueryParams(FastSerializable):
+	count: int = 20
+	search: str = ''  # only the messages containing this text, empty for all messages
+
+
+class HistoryMessage(FastSerializable):
+	id: int
+	time: float
+	client: str  # the name of the client that sent the message
+	author: str
+	message: str
+
+
+class HistoryQueryResult(FastSerializable):
+	error_code: int = 0
+	messages: List[HistoryMessage] = []  # ordered from the oldest to the newest
+
+	@property
+	def success(self) -> bool:
+		return self.error_code == 0
+
+	@classmethod
+	def create(cls, messages: List[HistoryMessage]) -> 'HistoryQueryResult':
+		return HistoryQueryResult(error_code=0, messages=messages)
+
+	@classmethod
+	def no_history(cls) -> 'HistoryQueryResult':
+		return HistoryQueryResult(error_code=1)
+
+	@classmethod
+	def bad_params(cls) -> 'HistoryQueryResult':
+		return HistoryQueryResult(error_code=2)
@@ -179,7 +179,7 @@ def main():
 	global chatClient, cq_bot
 	config = utils.load_config(ConfigFile, CqHttpConfig)
 	chatClient = CqHttpChatBridgeClient.create(config)
-	utils.start_guardian(chatClient)
+	chatClient.start()
 	utils.register_exit_on_termination()
 	print('Starting CQ Bot')
 	cq_bot = CQBot(config)
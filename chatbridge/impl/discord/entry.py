@@ -12,7 +12,7 @@ def main():
 	stored.config = utils.load_config(ConfigFile, DiscordConfig)
 	stored.client = DiscordChatClient.create(stored.config)
 	stored.bot = bot.create_bot()
-	utils.start_guardian(stored.client)
+	stored.client.start()
 	utils.register_exit_on_termination()
 
 	try:
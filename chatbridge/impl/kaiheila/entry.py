@@ -230,7 +230,7 @@ def main():
 	global chatClient, khlBot, config
 	config = utils.load_config(ConfigFile, KaiHeiLaConfig)
 	chatClient = KhlChatBridgeClient.create(config)
-	utils.start_guardian(chatClient)
+	chatClient.start()
 	utils.register_exit_on_termination()
 	print('Starting KHL Bot')
 	khlBot = KaiHeiLaBot(config)
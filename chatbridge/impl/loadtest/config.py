@@ -0,0 +1,24 @@
+from mcdreforged.utils.serializer import Serializable
+
+from chatbridge.core.config import BasicConfig, ServerEngine
+
+
+class PacketMix(Serializable):
+	"""
+	Relative weights of the packets sent by the synthetic clients
+	"""
+	chat: float = 0.8  # chat broadcasts to all clients
+	command: float = 0.15  # commands to a random client
+	keep_alive: float = 0.05  # keep-alive pings to the server
+
+
+class LoadTestConfig(BasicConfig):
+	hostname: str = '127.0.0.1'
+	port: int = 30002
+	engine: str = ServerEngine.thread
+	client_count: int = 100
+	packet_rate: float = 0.2  # packets per second sent by each client
+	packet_mix: PacketMix = PacketMix()
+	message_length: int = 64  # length of the chat messages
+	warmup: float = 5  # seconds of traffic before the measurement starts
+	duration: float = 30  # seconds of the measurement
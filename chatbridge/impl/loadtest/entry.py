@@ -0,0 +1,341 @@
+"""
+Drive a local ChatBridge server with lots of synthetic clients, and report the latency, the throughput and the server resource usage
+
+The server runs in a child process, so its CPU and memory usage can be measured alone.
+All synthetic clients are multiplexed on a single thread in the current process
+"""
+import collections
+import heapq
+import multiprocessing
+import random
+import selectors
+import socket
+import time
+from typing import List, Dict, Optional, Deque, Tuple
+
+import psutil
+
+from chatbridge.common import constants
+from chatbridge.core.config import ClientInfo
+from chatbridge.core.network import net_util, codec, compression, cryptor
+from chatbridge.core.network.basic import Address
+from chatbridge.core.network.cryptor import AESCryptor
+from chatbridge.core.network.protocol import ChatBridgePacket, PacketType, ChatPayload, CommandPayload, KeepAlivePayload, \
+	LoginPacket, LoginResultPacket, AbstractPayload
+from chatbridge.core.server import ChatBridgeServer
+from chatbridge.impl import utils
+from chatbridge.impl.loadtest.config import LoadTestConfig
+
+ConfigFile = 'ChatBridge_loadtest.json'
+LOADTEST_COMMAND = '!!loadtest'
+SERVER_START_TIMEOUT = 30
+LOGIN_TIMEOUT = 10
+DRAIN_DURATION = 3  # seconds to wait for the packets in flight after the measurement
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def create_client_infos(count: int) -> List[ClientInfo]:
+	return [ClientInfo(name='loadtest{}'.format(i), password='password{}'.format(i)) for i in range(count)]
+
+
+def _run_server(config: LoadTestConfig, client_infos: List[ClientInfo], ready_event, stop_event):
+	server = ChatBridgeServer(config.aes_key, Address(config.hostname, config.port), engine=config.engine, compression_threshold=config.compression_threshold, keep_alive_settings=config.keep_alive_settings)
+	for client_info in client_infos:
+		server.add_client(client_info)
+	server.start()
+	ready_event.set()
+	stop_event.wait()
+	server.stop()
+
+
+class _LatencyRecorder:
+	def __init__(self):
+		self.__samples: Dict[str, List[float]] = collections.defaultdict(list)
+
+	def record(self, kind: str, latency: float):
+		self.__samples[kind].append(latency)
+
+	def get_count(self, kind: str) -> int:
+		return len(self.__samples[kind])
+
+	def get_summary(self, kind: str) -> Optional[Tuple[float, ...]]:
+		"""
+		:return: The latencies at each percentile in :data:`PERCENTILES`, and the max latency. None if there's no sample
+		"""
+		samples = sorted(self.__samples[kind])
+		if len(samples) == 0:
+			return None
+		return tuple(samples[min(len(samples) - 1, int(len(samples) * p))] for p in PERCENTILES) + (samples[-1],)
+
+
+class _SyntheticClient:
+	def __init__(self, info: ClientInfo, sock: socket.socket, frame_reader: net_util.FrameReader, wire_format: net_util.WireFormat):
+		self.info = info
+		self.sock = sock
+		self.frame_reader = frame_reader
+		self.wire_format = wire_format
+		self.send_buffer = bytearray()
+		self.ping_sent_times: Deque[float] = collections.deque()
+
+
+class LoadTestDriver:
+	def __init__(self, config: LoadTestConfig, client_infos: List[ClientInfo]):
+		self.config = config
+		self.client_infos = client_infos
+		self.__cryptor = AESCryptor(config.aes_key)
+		self.__selector = selectors.DefaultSelector()
+		self.__clients: List[_SyntheticClient] = []
+		self.__random = random.Random()
+		self.__recorder = _LatencyRecorder()
+		self.__measure_start = 0.0
+		self.__measure_end = 0.0
+		self.__sent_counts: Dict[str, int] = collections.Counter()
+		self.__expected_counts: Dict[str, int] = collections.Counter()
+		self.__disconnect_count = 0
+
+	# ------------------
+	#   Connection
+	# ------------------
+
+	def connect_all(self):
+		address = (self.config.hostname, self.config.port)
+		for info in self.client_infos:
+			client = self.__login(info, socket.create_connection(address, timeout=LOGIN_TIMEOUT))
+			client.sock.setblocking(False)
+			self.__selector.register(client.sock, selectors.EVENT_READ, client)
+			self.__clients.append(client)
+
+	def __login(self, info: ClientInfo, sock: socket.socket) -> _SyntheticClient:
+		compression_threshold = self.config.compression_threshold
+		sock.sendall(net_util.encode_packet(self.__cryptor, LoginPacket(
+			name=info.name,
+			password=info.password,
+			protocol_version=net_util.PROTOCOL_VERSION_LATEST,
+			codecs=codec.get_available_codec_names(),
+			compressions=compression.get_available_compression_names() if compression_threshold >= 0 else [],
+			ciphers=cryptor.get_available_cipher_names() if not self.__cryptor.is_key_empty() else [],
+		)))
+		frame_reader = net_util.FrameReader(self.__cryptor)
+		result = LoginResultPacket.deserialize(frame_reader.read_frame(sock, net_util.WireFormat(), timeout=LOGIN_TIMEOUT))
+		wire_format = net_util.WireFormat(
+			version=result.protocol_version,
+			codec=result.codec,
+			compression=result.compression,
+			compression_threshold=compression_threshold,
+			cipher=result.cipher,
+		)
+		return _SyntheticClient(info, sock, frame_reader, wire_format)
+
+	def close_all(self):
+		for client in self.__clients:
+			self.__close(client)
+		self.__selector.close()
+
+	def __close(self, client: _SyntheticClient):
+		if client.sock.fileno() != -1:
+			self.__selector.unregister(client.sock)
+			client.sock.close()
+
+	def get_wire_format(self) -> Optional[net_util.WireFormat]:
+		return self.__clients[0].wire_format if len(self.__clients) > 0 else None
+
+	# ------------------
+	#   Sending
+	# ------------------
+
+	def __send(self, client: _SyntheticClient, receivers: List[str], type_: str, payload: AbstractPayload):
+		packet = ChatBridgePacket(sender=client.info.name, receivers=receivers, broadcast=type_ == PacketType.chat, type=type_, payload=payload.serialize())
+		client.send_buffer += net_util.encode_packet(self.__cryptor, packet, client.wire_format)
+		self.__flush(client)
+
+	def __flush(self, client: _SyntheticClient):
+		try:
+			sent = client.sock.send(client.send_buffer)
+		except (BlockingIOError, InterruptedError):
+			sent = 0
+		except OSError:
+			self.__on_disconnect(client)
+			return
+		del client.send_buffer[:sent]
+		events = selectors.EVENT_READ | (selectors.EVENT_WRITE if len(client.send_buffer) > 0 else 0)
+		self.__selector.modify(client.sock, events, client)
+
+	def __is_measuring(self, send_time: float) -> bool:
+		return self.__measure_start <= send_time < self.__measure_end
+
+	def __send_random_packet(self, client: _SyntheticClient, now: float):
+		mix = self.config.packet_mix
+		kind = self.__random.choices(('chat', 'command', 'keep_alive'), (mix.chat, mix.command, mix.keep_alive))[0]
+		if self.__is_measuring(now):
+			self.__sent_counts[kind] += 1
+			self.__expected_counts[kind] += len(self.__clients) - 1 if kind == 'chat' else 1
+		if kind == 'chat':
+			message = '{:.9f} '.format(now).ljust(self.config.message_length, 'x')
+			self.__send(client, [], PacketType.chat, ChatPayload(author=client.info.name, message=message))
+		elif kind == 'command':
+			target = self.__random.choice(self.__clients)
+			while target is client and len(self.__clients) > 1:
+				target = self.__random.choice(self.__clients)
+			self.__send(client, [target.info.name], PacketType.command, CommandPayload.ask(LOADTEST_COMMAND, {'time': now}))
+		else:
+			client.ping_sent_times.append(now)
+			self.__send(client, [constants.SERVER_NAME], PacketType.keep_alive, KeepAlivePayload.ping())
+
+	# ------------------
+	#   Receiving
+	# ------------------
+
+	def __on_readable(self, client: _SyntheticClient):
+		try:
+			client.frame_reader.receive(client.sock)
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError:
+			self.__on_disconnect(client)
+			return
+		while True:
+			data = client.frame_reader.pop_frame(client.wire_format)
+			if data is None:
+				break
+			self.__on_packet(client, ChatBridgePacket.deserialize(data), time.perf_counter())
+
+	def __on_packet(self, client: _SyntheticClient, packet: ChatBridgePacket, now: float):
+		if packet.type == PacketType.chat:
+			send_time = float(ChatPayload.deserialize(packet.payload).message.split(' ', 1)[0])
+			kind = 'chat'
+		elif packet.type == PacketType.command:
+			send_time = CommandPayload.deserialize(packet.payload).params['time']
+			kind = 'command'
+		elif packet.type == PacketType.keep_alive:
+			payload = KeepAlivePayload.deserialize(packet.payload)
+			if payload.is_ping():
+				self.__send(client, [packet.sender], PacketType.keep_alive, KeepAlivePayload.pong())
+				return
+			if len(client.ping_sent_times) == 0:
+				return
+			send_time = client.ping_sent_times.popleft()
+			kind = 'keep_alive'
+		else:
+			return
+		if self.__is_measuring(send_time):
+			self.__recorder.record(kind, now - send_time)
+
+	def __on_disconnect(self, client: _SyntheticClient):
+		if client.sock.fileno() != -1:
+			self.__disconnect_count += 1
+			self.__close(client)
+
+	# ------------------
+	#   Main loop
+	# ------------------
+
+	def run(self, server_process: psutil.Process):
+		"""
+		Send packets for the warmup and the measurement duration, then wait for the packets in flight
+
+		:return: The report lines
+		"""
+		start = time.perf_counter()
+		self.__measure_start = start + self.config.warmup
+		self.__measure_end = self.__measure_start + self.config.duration
+		drain_end = self.__measure_end + DRAIN_DURATION
+
+		# (time of the next packet, client index)
+		schedule: List[Tuple[float, int]] = []
+		if self.config.packet_rate > 0:
+			interval = 1 / self.config.packet_rate
+			schedule = [(start + self.__random.random() * interval, i) for i in range(len(self.__clients))]
+			heapq.heapify(schedule)
+
+		server_rss_peak = 0
+		next_sample_time = start
+		self_process = psutil.Process()
+		# cpu seconds of the server and the load generator, at the start and the end of the measurement
+		cpu_samples: List[Tuple[float, float]] = []
+
+		def sample_cpu():
+			cpu_samples.append((sum(server_process.cpu_times()[:2]), sum(self_process.cpu_times()[:2])))
+
+		while True:
+			now = time.perf_counter()
+			if now >= drain_end:
+				break
+			if (len(cpu_samples) == 0 and now >= self.__measure_start) or (len(cpu_samples) == 1 and now >= self.__measure_end):
+				sample_cpu()
+			if now >= next_sample_time:
+				server_rss_peak = max(server_rss_peak, server_process.memory_info().rss)
+				next_sample_time = now + 1
+
+			while len(schedule) > 0 and schedule[0][0] <= now and now < self.__measure_end:
+				send_time, index = heapq.heappop(schedule)
+				client = self.__clients[index]
+				if client.sock.fileno() != -1:
+					self.__send_random_packet(client, now)
+					heapq.heappush(schedule, (send_time + self.__random.expovariate(self.config.packet_rate), index))
+
+			wake_times = [next_sample_time, drain_end]
+			if now < self.__measure_end:
+				wake_times.append(self.__measure_end)
+				if len(schedule) > 0:
+					wake_times.append(schedule[0][0])
+			timeout = min(wake_times) - now
+			for key, mask in self.__selector.select(max(0.0, timeout)):
+				client: _SyntheticClient = key.data
+				if mask & selectors.EVENT_WRITE:
+					self.__flush(client)
+				if mask & selectors.EVENT_READ and client.sock.fileno() != -1:
+					self.__on_readable(client)
+
+		while len(cpu_samples) < 2:
+			sample_cpu()
+		(server_cpu_start, self_cpu_start), (server_cpu_end, self_cpu_end) = cpu_samples
+		duration = self.config.duration
+		return self.__create_report((server_cpu_end - server_cpu_start) / duration, (self_cpu_end - self_cpu_start) / duration, server_process.memory_info().rss, server_rss_peak)
+
+	def __create_report(self, server_cpu_usage: float, self_cpu_usage: float, server_rss: int, server_rss_peak: int) -> List[str]:
+		lines = []
+		sent = sum(self.__sent_counts.values())
+		expected = sum(self.__expected_counts.values())
+		delivered = sum(self.__recorder.get_count(kind) for kind in self.__expected_counts.keys())
+		lines.append('Clients: {}, disconnected: {}, wire format: {}'.format(len(self.__clients), self.__disconnect_count, self.get_wire_format()))
+		lines.append('Sent {} packets ({:.1f}/s), delivered {} of {} expected ({:.1f}/s), lost {}'.format(
+			sent, sent / self.config.duration, delivered, expected, delivered / self.config.duration, expected - delivered
+		))
+		lines.append('{:>12} {:>8} {:>8}'.format('latency', 'sent', 'received') + ''.join('{:>9}'.format('p{:g}'.format(p * 100)) for p in PERCENTILES) + '{:>9}'.format('max'))
+		for kind in ('chat', 'command', 'keep_alive'):
+			summary = self.__recorder.get_summary(kind)
+			cells = ''.join('{:>7.2f}ms'.format(latency * 1000) for latency in summary) if summary is not None else ''
+			lines.append('{:>12} {:>8} {:>8}'.format(kind, self.__sent_counts[kind], self.__recorder.get_count(kind)) + cells)
+		lines.append('Server CPU: {:.1f}% of a core, RSS: {:.1f} MiB, peak RSS: {:.1f} MiB'.format(server_cpu_usage * 100, server_rss / 2 ** 20, max(server_rss, server_rss_peak) / 2 ** 20))
+		lines.append('Load generator CPU: {:.1f}% of a core{}'.format(self_cpu_usage * 100, ', the result might be limited by the load generator' if self_cpu_usage > 0.9 else ''))
+		return lines
+
+
+def main():
+	config = utils.load_config(ConfigFile, LoadTestConfig)
+	client_infos = create_client_infos(config.client_count)
+	print('Server address = {}, engine = {}, client count = {}'.format(Address(config.hostname, config.port), config.engine, config.client_count))
+
+	ready_event = multiprocessing.Event()
+	stop_event = multiprocessing.Event()
+	process = multiprocessing.Process(target=_run_server, args=(config, client_infos, ready_event, stop_event), name='ChatBridge LoadTest Server', daemon=True)
+	process.start()
+	driver = LoadTestDriver(config, client_infos)
+	try:
+		if not ready_event.wait(SERVER_START_TIMEOUT):
+			raise RuntimeError('Server did not start in {}s'.format(SERVER_START_TIMEOUT))
+		print('Connecting {} clients'.format(config.client_count))
+		driver.connect_all()
+		print('Running with a warmup of {}s and a measurement of {}s'.format(config.warmup, config.duration))
+		report = driver.run(psutil.Process(process.pid))
+		print('\n'.join(report))
+	finally:
+		driver.close_all()
+		stop_event.set()
+		process.join(SERVER_START_TIMEOUT)
+		if process.is_alive():
+			process.terminate()
+
+
+if __name__ == '__main__':
+	main()
@@ -1,3 +1,4 @@
+import os
 from typing import Optional
 
 from mcdreforged.api.all import *
@@ -9,10 +10,11 @@ from chatbridge.impl.tis.protocol import StatsQueryResult, OnlineQueryResult
 
 
 class ChatBridgeMCDRClient(ChatBridgeClient):
-	KEEP_ALIVE_THREAD_NAME = 'ChatBridge-KeepAlive'
-
 	def __init__(self, config: MCDRClientConfig, server: ServerInterface):
-		super().__init__(config.aes_key, config.client_info, server_address=config.server_address)
+		outbound_journal_settings = config.outbound_journal_settings
+		if outbound_journal_settings is not None and isinstance(server, PluginServerInterface):
+			outbound_journal_settings = outbound_journal_settings._replace(directory=os.path.join(server.get_data_folder(), outbound_journal_settings.directory))
+		super().__init__(config.aes_key, config.client_info, server_address=config.server_address, compression_threshold=config.compression_threshold, keep_alive_settings=config.keep_alive_settings, outbound_journal_settings=outbound_journal_settings, channels=config.channels, reconnect_settings=config.reconnect_settings)
 		self.config = config
 		self.server: ServerInterface = server
 		prev_handler = self.logger.console_handler
@@ -27,9 +29,6 @@ class ChatBridgeMCDRClient(ChatBridgeClient):
 	def _get_main_loop_thread_name(self):
 		return 'ChatBridge-' + super()._get_main_loop_thread_name()
 
-	def _get_keep_alive_thread_name(self):
-		return 'ChatBridge-' + super()._get_keep_alive_thread_name()
-
 	def _on_stopped(self):
 		super()._on_stopped()
 		self.logger.info('Client stopped')
@@ -5,7 +5,6 @@ from typing import Optional
 
 from mcdreforged.api.all import *
 
-from chatbridge.impl import utils
 from chatbridge.impl.mcdr.client import ChatBridgeMCDRClient
 from chatbridge.impl.mcdr.config import MCDRClientConfig
 
@@ -13,7 +12,6 @@ META = ServerInterface.get_instance().as_plugin_server_interface().get_self_meta
 Prefixes = ('!!ChatBridge', '!!cb')
 client: Optional[ChatBridgeMCDRClient] = None
 config: Optional[MCDRClientConfig] = None
-plugin_unload_flag = False
 cb_stop_done = Event()
 cb_lock = Lock()
 
@@ -30,7 +28,8 @@ def display_status(source: CommandSource):
 	if config is None or client is None:
 		source.reply(tr('status.not_init'))
 	else:
-		source.reply(tr('status.info', client.is_online(), client.get_ping_text()))
+		stats = client.get_reconnect_stats()
+		source.reply(tr('status.info', client.is_online(), client.get_ping_text(), stats.reconnect_count, '{}s'.format(round(stats.backoff, 1)) if stats.backoff > 0 else 'N/A'))
 
 
 def query_online(source: CommandSource):
@@ -53,8 +52,6 @@ def restart_client(source: CommandSource):
 
 @new_thread('ChatBridge-unload')
 def on_unload(server: PluginServerInterface):
-	global plugin_unload_flag
-	plugin_unload_flag = True
 	with cb_lock:
 		if client is not None and client.is_running():
 			server.logger.info('Stopping chatbridge client due to plugin unload')
@@ -66,9 +63,9 @@ def on_unload(server: PluginServerInterface):
 def send_chat(message: str, *, author: str = ''):
 	with cb_lock:
 		if client is not None:
-			if not client.is_running():
+			if not client.is_running() and not config.auto_reconnect:  # otherwise it reconnects by itself, with backoff
 				client.start()
-			if client.is_online():
+			if client.is_online() or client.is_outbound_journal_enabled():
 				client.broadcast_chat(message, author)
 
 
@@ -119,8 +116,7 @@ def on_load(server: PluginServerInterface, old_module):
 				if not stop_event.wait(30):
 					server.logger.warning('Previous chatbridge instance does not stop for 30s')
 			server.logger.info('Starting chatbridge client')
-			client.start()
-			utils.start_guardian(client, wait_time=60, loop_condition=lambda: not plugin_unload_flag)
+			client.start()  # it reconnects by itself until stopped
 
 	start()
 
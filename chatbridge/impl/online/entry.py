@@ -138,7 +138,7 @@ def main():
 	global config, chatClient
 	config = utils.load_config(ClientConfigFile, OnlineConfig)
 	chatClient = OnlineChatClient.create(config)
-	utils.start_guardian(chatClient)
+	chatClient.start()
 	if sys.stdin.isatty():
 		console_input_loop()
 	else:
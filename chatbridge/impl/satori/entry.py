@@ -217,7 +217,7 @@ def main():
 		satori_client.shutdown()
 		cb_client.stop()
 
-	utils.start_guardian(cb_client)
+	cb_client.start()
 	utils.register_exit_on_termination(exit_callback)
 
 	print('Starting Satori Bot')
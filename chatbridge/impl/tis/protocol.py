@@ -1,9 +1,9 @@
 from typing import List
 
-from mcdreforged.utils.serializer import Serializable
+from chatbridge.common.serializer import FastSerializable
 
 
-class StatsQueryResult(Serializable):
+class StatsQueryResult(FastSerializable):
 	error_code: int = 0
 	stats_name: str
 	data: List[str]
@@ -26,7 +26,7 @@ class StatsQueryResult(Serializable):
 		return StatsQueryResult(error_code=2)
 
 
-class OnlineQueryResult(Serializable):
+class OnlineQueryResult(FastSerializable):
 	data: List[str]
 
 	@classmethod
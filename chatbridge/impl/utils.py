@@ -3,11 +3,8 @@ import os
 import queue
 import signal
 import sys
-import time
-from threading import Thread
 from typing import Type, TypeVar, Callable, Optional, Any
 
-from chatbridge.core.client import ChatBridgeClient
 from chatbridge.core.config import BasicConfig
 
 T = TypeVar('T', BasicConfig, BasicConfig)
@@ -29,22 +26,6 @@ def load_config(config_path: str, config_class: Type[T]) -> T:
 		return config
 
 
-def start_guardian(client: ChatBridgeClient, wait_time: float = 10, loop_condition: Callable[[], bool] = lambda: True) -> Thread:
-	def loop():
-		first = True
-		while loop_condition():
-			if not client.is_running():
-				client.logger.info('Guardian triggered {}'.format('start' if first else 'restart'))
-				client.start()
-			first = False
-			time.sleep(wait_time)
-		client.logger.info('Guardian stopped')
-
-	thread = Thread(name='ChatBridge Guardian', target=loop, daemon=True)
-	thread.start()
-	return thread
-
-
 def wait_until_terminate():
 	q = queue.Queue()
 	signal.signal(signal.SIGINT, lambda s, _: q.put(s))
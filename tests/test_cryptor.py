@@ -0,0 +1,53 @@
+import unittest
+
+from chatbridge.core.network.cryptor import AESCryptor
+
+
+class PaddingTest(unittest.TestCase):
+	def setUp(self):
+		self.cryptor = AESCryptor('ThisIstheSecret')
+
+	def __encrypt_raw(self, plain: bytes) -> bytes:
+		"""
+		Encrypt without adding the padding, so the padding can be broken on purpose
+		"""
+		return self.cryptor.get_cryptor().encrypt(plain)
+
+	def test_round_trip(self):
+		for length in range(0, 50):
+			data = bytes(range(length))
+			encrypted = self.cryptor.encrypt_bytes(data)
+			self.assertEqual(0, len(encrypted) % 16)
+			self.assertGreater(len(encrypted), length)  # a full block of padding if the data fills the blocks
+			self.assertEqual(data, self.cryptor.decrypt_bytes(encrypted))
+
+	def test_trailing_zeros_kept(self):
+		data = b'data\0\0\0'
+		self.assertEqual(data, self.cryptor.decrypt_bytes(self.cryptor.encrypt_bytes(data)))
+
+	def test_bad_padding(self):
+		cases = {
+			'zero': b'a' * 15 + b'\x00',
+			'too large': b'a' * 15 + b'\x11',
+			'mismatched bytes': b'a' * 13 + b'\x02\x03\x03',
+			'full block mismatched': b'\x10' * 15 + b'\x0f',
+		}
+		for name, plain in cases.items():
+			with self.subTest(name):
+				with self.assertRaises(ValueError):
+					self.cryptor.decrypt_bytes(self.__encrypt_raw(plain))
+
+	def test_valid_padding_built_by_hand(self):
+		self.assertEqual(b'a' * 13, self.cryptor.decrypt_bytes(self.__encrypt_raw(b'a' * 13 + b'\x03\x03\x03')))
+		self.assertEqual(b'', self.cryptor.decrypt_bytes(self.__encrypt_raw(b'\x10' * 16)))
+
+	def test_empty_or_truncated_ciphertext(self):
+		encrypted = self.cryptor.encrypt_bytes(b'some data')
+		for data in (b'', encrypted[:-1]):
+			with self.subTest(length=len(data)):
+				with self.assertRaises(ValueError):
+					self.cryptor.decrypt_bytes(data)
+
+
+if __name__ == '__main__':
+	unittest.main()
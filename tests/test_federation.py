@@ -0,0 +1,137 @@
+import collections
+import socket
+import time
+import unittest
+from threading import Thread
+from typing import Dict, List
+
+from chatbridge.core.client import ChatBridgeClient
+from chatbridge.core.config import ClientInfo, FederationSettings, FederationPeerInfo
+from chatbridge.core.network.basic import Address
+from chatbridge.core.server import ChatBridgeServer
+
+AES_KEY = 'ThisIstheSecret'
+TIMEOUT = 15
+
+
+def get_free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(('localhost', 0))
+		return sock.getsockname()[1]
+
+
+def stop_all(nodes):
+	"""
+	Stop in parallel, since stopping waits for the blocking socket reads to time out
+	"""
+	threads = [Thread(target=node.stop) for node in nodes]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+
+def wait_until(condition, timeout: float = TIMEOUT) -> bool:
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if condition():
+			return True
+		time.sleep(0.05)
+	return condition()
+
+
+class _RecordingClient(ChatBridgeClient):
+	def __init__(self, *args, received: List[tuple], **kwargs):
+		super().__init__(*args, **kwargs)
+		self.received = received
+
+	def get_logging_file_name(self):
+		return None
+
+	def on_chat(self, sender: str, payload):
+		self.received.append((self.get_name(), sender, payload.message))
+
+
+class _Server(ChatBridgeServer):
+	def get_logging_file_name(self):
+		return None
+
+
+class DiamondFederationTest(unittest.TestCase):
+	"""
+	Hubs linked as A - B - D and A - C - D, so the packets from A reach D through both B and C
+	"""
+	HUBS = ('A', 'B', 'C', 'D')
+	LINKS = (('A', 'B'), ('A', 'C'), ('B', 'D'), ('C', 'D'))  # (dialing hub, dialed hub)
+
+	servers: Dict[str, ChatBridgeServer]
+	clients: Dict[str, _RecordingClient]
+	received: List[tuple]
+	server_chats: Dict[str, List[str]]
+
+	@classmethod
+	def setUpClass(cls):
+		ports = {hub: get_free_port() for hub in cls.HUBS}
+		cls.servers = {}
+		cls.clients = {}
+		cls.received = []
+		cls.server_chats = collections.defaultdict(list)
+		for hub in cls.HUBS:
+			peers = []
+			for dialer, dialed in cls.LINKS:
+				if dialer == hub:
+					peers.append(FederationPeerInfo(name=dialed, password=dialer + dialed, hostname='localhost', port=ports[dialed]))
+				elif dialed == hub:
+					peers.append(FederationPeerInfo(name=dialer, password=dialer + dialed))
+			server = _Server(AES_KEY, Address('localhost', ports[hub]), federation_settings=FederationSettings(hub_name=hub, peers=tuple(peers)))
+			server.on_chat = lambda sender, payload, hub=hub: cls.server_chats[hub].append(payload.message)
+			name = hub.lower()
+			server.add_client(ClientInfo(name=name, password='pwd'))
+			cls.servers[hub] = server
+			cls.clients[name] = _RecordingClient(AES_KEY, ClientInfo(name=name, password='pwd'), server_address=Address('localhost', ports[hub]), channels=['ch'], received=cls.received)
+		for server in cls.servers.values():
+			server.start()
+		for client in cls.clients.values():
+			client.start()
+
+		def is_ready() -> bool:
+			for hub, server in cls.servers.items():
+				reachable = set()
+				for peer_name in server.federation.peers:
+					if not server.federation.is_peer_online(peer_name):
+						return False
+					reachable.update(server.federation.get_directory(peer_name))
+				if not reachable.issuperset(name for name in cls.clients if name != hub.lower()):
+					return False
+			return all(client.is_online() for client in cls.clients.values())
+		if not wait_until(is_ready):
+			cls.tearDownClass()
+			raise AssertionError('The federation is not ready')
+
+	@classmethod
+	def tearDownClass(cls):
+		stop_all(cls.clients.values())
+		stop_all(cls.servers.values())
+
+	def assertReceivedOnce(self, message: str, receivers: List[str]):
+		wait_until(lambda: len([x for x in self.received if x[2] == message]) >= len(receivers))
+		time.sleep(0.5)  # for the duplicates to arrive, if any
+		counter = collections.Counter(name for name, sender, received_message in self.received if received_message == message)
+		self.assertEqual({name: 1 for name in receivers}, dict(counter))
+
+	def test_broadcast(self):
+		self.clients['a'].broadcast_chat('hello')
+		self.assertReceivedOnce('hello', ['b', 'c', 'd'])
+		self.assertEqual(['hello'], self.server_chats['D'])  # handled once on every hub
+
+	def test_channel(self):
+		self.clients['a'].send_chat_to_channel('ch', 'hello channel')
+		self.assertReceivedOnce('hello channel', ['b', 'c', 'd'])
+
+	def test_direct(self):
+		self.clients['a'].send_chat('d', 'hello d')
+		self.assertReceivedOnce('hello d', ['d'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,128 @@
+import socket
+import time
+import unittest
+from threading import Thread
+from typing import List
+
+from chatbridge.core.client import ChatBridgeClient
+from chatbridge.core.config import ClientInfo, ServerEngine
+from chatbridge.core.network.basic import Address
+from chatbridge.core.server import ChatBridgeServer
+
+AES_KEY = 'ThisIstheSecret'
+TIMEOUT = 15
+
+
+def get_free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(('localhost', 0))
+		return sock.getsockname()[1]
+
+
+def is_listening(address: Address) -> bool:
+	"""
+	The server returns from start() once the port is bound, a moment before it's listening
+	"""
+	try:
+		socket.create_connection(address, timeout=1).close()
+		return True
+	except OSError:
+		return False
+
+
+def wait_until(condition, timeout: float = TIMEOUT) -> bool:
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if condition():
+			return True
+		time.sleep(0.05)
+	return condition()
+
+
+class _RecordingClient(ChatBridgeClient):
+	def __init__(self, *args, received: List[tuple], **kwargs):
+		super().__init__(*args, **kwargs)
+		self.received = received
+
+	def get_logging_file_name(self):
+		return None
+
+	def on_chat(self, sender: str, payload):
+		self.received.append((self.get_name(), sender, payload.message))
+
+
+class _Server(ChatBridgeServer):
+	def get_logging_file_name(self):
+		return None
+
+
+class StreamDemultiplexTest(unittest.TestCase):
+	"""
+	The logical clients bot1 and bot2 share the connection of host, and other is connected on its own
+	"""
+	ENGINE = ServerEngine.thread
+	NAMES = ('host', 'bot1', 'bot2', 'other')
+
+	def setUp(self):
+		address = Address('localhost', get_free_port())
+		self.server = _Server(AES_KEY, address, engine=self.ENGINE)
+		for name in self.NAMES:
+			self.server.add_client(ClientInfo(name=name, password='pwd'))
+		self.received: List[tuple] = []
+		host = self.__create_client('host', server_address=address)
+		self.clients = {
+			'host': host,
+			'bot1': self.__create_client('bot1', multiplex_with=host),
+			'bot2': self.__create_client('bot2', multiplex_with=host),
+			'other': self.__create_client('other', server_address=address),
+		}
+		self.server.start()
+		self.assertTrue(wait_until(lambda: is_listening(address)))
+		for client in self.clients.values():
+			client.start()
+		self.assertTrue(wait_until(lambda: all(client.is_online() for client in self.clients.values())))
+
+	def __create_client(self, name: str, **kwargs) -> _RecordingClient:
+		return _RecordingClient(AES_KEY, ClientInfo(name=name, password='pwd'), received=self.received, **kwargs)
+
+	def tearDown(self):
+		for name in ('bot1', 'bot2'):
+			self.clients[name].stop()
+		threads = [Thread(target=node.stop) for node in (self.clients['host'], self.clients['other'], self.server)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+	def assertReceived(self, expected: List[tuple]):
+		wait_until(lambda: len(self.received) >= len(expected))
+		time.sleep(0.3)  # for the misrouted packets to arrive, if any
+		self.assertEqual(sorted(expected), sorted(self.received))
+
+	def test_one_physical_connection(self):
+		host = self.server.clients['host']
+		for name in ('bot1', 'bot2'):
+			self.assertIs(host, self.server.clients[name].get_stream_owner())
+		self.assertEqual({'bot1', 'bot2'}, {client.info.name for client in host.streams.values()})
+
+	def test_demultiplex_to_streams(self):
+		for name in ('host', 'bot1', 'bot2'):
+			self.clients['other'].send_chat(name, 'to ' + name)
+		self.assertReceived([(name, 'other', 'to ' + name) for name in ('host', 'bot1', 'bot2')])
+
+	def test_send_from_streams(self):
+		self.clients['bot1'].send_chat('other', 'from bot1')
+		self.clients['bot2'].send_chat('bot1', 'from bot2')  # both ends on the same connection
+		self.assertReceived([('other', 'bot1', 'from bot1'), ('bot1', 'bot2', 'from bot2')])
+
+	def test_broadcast(self):
+		self.clients['other'].broadcast_chat('hello')
+		self.assertReceived([(name, 'other', 'hello') for name in ('host', 'bot1', 'bot2')])
+
+
+class SelectorStreamDemultiplexTest(StreamDemultiplexTest):
+	ENGINE = ServerEngine.selector
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,144 @@
+import socket
+import unittest
+
+from chatbridge.core.network import net_util, cryptor
+from chatbridge.core.network.cryptor import AESCryptor
+from chatbridge.core.network.net_util import WireFormat, FrameReader, InvalidFrame
+from chatbridge.core.network.protocol import LoginPacket
+
+BINARY = WireFormat(version=net_util.PROTOCOL_VERSION_BINARY)
+MULTIPLEX = WireFormat(version=net_util.PROTOCOL_VERSION_BINARY, multiplex=True)
+LEGACY = WireFormat()
+
+
+class FrameReaderTest(unittest.TestCase):
+	def setUp(self):
+		self.cryptor = AESCryptor('ThisIstheSecret')
+		self.sender, self.receiver = socket.socketpair()
+		self.receiver.settimeout(1)
+
+	def tearDown(self):
+		self.sender.close()
+		self.receiver.close()
+
+	def __feed(self, reader: FrameReader, data: bytes):
+		self.sender.sendall(data)
+		received = 0
+		while received < len(data):
+			received += reader.receive(self.receiver)
+
+	def __frame(self, name: str, wire_format: WireFormat) -> bytes:
+		return net_util.encode_packet(self.cryptor, LoginPacket(name=name, password='pwd'), wire_format)
+
+	def test_partial_reads(self):
+		for wire_format in (LEGACY, BINARY):
+			with self.subTest(version=wire_format.version):
+				reader = FrameReader(self.cryptor)
+				frame = self.__frame('a', wire_format)
+				for i in range(len(frame) - 1):
+					self.__feed(reader, frame[i:i + 1])
+					self.assertIsNone(reader.pop_frame(wire_format))  # incomplete, even with only the header missing bytes
+				self.__feed(reader, frame[-1:])
+				self.assertEqual('a', reader.pop_frame(wire_format)['name'])
+				self.assertEqual(0, reader.get_buffered_size())
+
+	def test_several_frames_in_one_read(self):
+		reader = FrameReader(self.cryptor)
+		first, second = self.__frame('a', BINARY), self.__frame('b', BINARY)
+		self.__feed(reader, first + second[:5])
+		self.assertEqual('a', reader.pop_frame(BINARY)['name'])
+		self.assertIsNone(reader.pop_frame(BINARY))
+		self.__feed(reader, second[5:])
+		self.assertEqual('b', reader.pop_frame(BINARY)['name'])
+		self.assertIsNone(reader.pop_frame(BINARY))
+
+	def test_frame_larger_than_buffer(self):
+		reader = FrameReader(self.cryptor, buffer_size=16)
+		frame = net_util.encode_packet(self.cryptor, LoginPacket(name='a' * 1000, password='pwd'), BINARY)
+		for i in range(0, len(frame), 100):
+			self.assertIsNone(reader.pop_frame(BINARY))
+			self.__feed(reader, frame[i:i + 100])
+		self.assertEqual('a' * 1000, reader.pop_frame(BINARY)['name'])
+
+	def test_frame_over_size_limit(self):
+		for wire_format in (LEGACY, BINARY):
+			with self.subTest(version=wire_format.version):
+				reader = FrameReader(self.cryptor, max_frame_size=64)
+				frame = net_util.encode_packet(self.cryptor, LoginPacket(name='a' * 100, password='pwd'), wire_format)
+				self.__feed(reader, frame[:wire_format.header.size])  # rejected by the header, before the body arrives
+				with self.assertRaises(InvalidFrame):
+					reader.pop_frame(wire_format)
+
+	def test_frame_at_size_limit(self):
+		frame = self.__frame('a', BINARY)
+		reader = FrameReader(self.cryptor, max_frame_size=len(frame) - BINARY.header.size)
+		self.__feed(reader, frame)
+		self.assertEqual('a', reader.pop_frame(BINARY)['name'])
+
+
+class StreamFrameTest(unittest.TestCase):
+	def setUp(self):
+		self.cryptor = AESCryptor('ThisIstheSecret')
+		self.sender, self.receiver = socket.socketpair()
+		self.receiver.settimeout(1)
+
+	def tearDown(self):
+		self.sender.close()
+		self.receiver.close()
+
+	def __receive(self, reader: FrameReader, data: bytes):
+		self.sender.sendall(data)
+		received = 0
+		while received < len(data):
+			received += reader.receive(self.receiver)
+
+	def __frame(self, name: str, stream_id: int, wire_format: WireFormat = MULTIPLEX) -> bytes:
+		return net_util.encode_packet(self.cryptor, LoginPacket(name=name, password='pwd'), wire_format, stream_id)
+
+	def test_demultiplex(self):
+		reader = FrameReader(self.cryptor)
+		self.__receive(reader, self.__frame('owner', 0) + self.__frame('a', 1) + self.__frame('b', net_util.MAX_STREAM_ID) + self.__frame('owner', 0))
+		popped = []
+		for _ in range(4):
+			name = reader.pop_frame(MULTIPLEX)['name']
+			popped.append((reader.get_stream_id(), name))
+		self.assertEqual([(0, 'owner'), (1, 'a'), (net_util.MAX_STREAM_ID, 'b'), (0, 'owner')], popped)
+
+	def test_stream_flag(self):
+		untagged, tagged = self.__frame('owner', 0), self.__frame('a', 7)
+		self.assertEqual(0, untagged[1] & net_util.FRAME_FLAG_STREAM)
+		self.assertEqual(net_util.FRAME_FLAG_STREAM, tagged[1] & net_util.FRAME_FLAG_STREAM)
+		self.assertEqual(len(untagged) + 2, len(tagged))  # the uint16 stream id after the header
+
+	def test_stream_id_split_across_reads(self):
+		reader = FrameReader(self.cryptor)
+		frame = self.__frame('a', 0x1234)
+		self.__receive(reader, frame[:MULTIPLEX.header.size + 1])  # half of the stream id
+		self.assertIsNone(reader.pop_frame(MULTIPLEX))
+		self.__receive(reader, frame[MULTIPLEX.header.size + 1:])
+		self.assertEqual('a', reader.pop_frame(MULTIPLEX)['name'])
+		self.assertEqual(0x1234, reader.get_stream_id())
+
+	def test_stream_rejected_without_multiplex(self):
+		reader = FrameReader(self.cryptor)
+		self.__receive(reader, self.__frame('a', 1))
+		with self.assertRaises(InvalidFrame):
+			reader.pop_frame(BINARY)
+
+	def test_stream_id_authenticated(self):
+		ciphers = cryptor.get_available_cipher_names()
+		if len(ciphers) == 0:
+			self.skipTest('No AEAD cipher available')
+		for cipher in ciphers:
+			with self.subTest(cipher):
+				wire_format = MULTIPLEX._replace(cipher=cipher)
+				frame = bytearray(self.__frame('a', 1, wire_format))
+				frame[wire_format.header.size + 1] = 2  # delivered to another stream
+				reader = FrameReader(self.cryptor)
+				self.__receive(reader, bytes(frame))
+				with self.assertRaises(ValueError):
+					reader.pop_frame(wire_format)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+from typing import List
+
+from chatbridge.common.logger import ChatBridgeLogger
+from chatbridge.core.network.protocol import ChatBridgePacket, ChatPayload, PacketType
+from chatbridge.core.outbound_journal import OutboundJournal, OutboundJournalSettings
+
+
+def create_packet(message: str) -> ChatBridgePacket:
+	return ChatBridgePacket(sender='client', receivers=[], broadcast=True, type=PacketType.chat, payload=ChatPayload(author='', message=message).serialize())
+
+
+class TornSegmentTest(unittest.TestCase):
+	def setUp(self):
+		self.__directory = tempfile.TemporaryDirectory()
+		self.settings = OutboundJournalSettings(directory=self.__directory.name)
+		self.logger = ChatBridgeLogger('Journal')
+
+	def tearDown(self):
+		self.__directory.cleanup()
+
+	def __open(self) -> OutboundJournal:
+		return OutboundJournal(self.settings, self.logger)
+
+	def __replay(self, journal: OutboundJournal) -> List[str]:
+		messages = []
+		journal.replay(lambda packet: messages.append(packet.payload['message']))
+		return messages
+
+	def __segment_path(self) -> str:
+		file_names = [file_name for file_name in os.listdir(self.settings.directory) if file_name.endswith(OutboundJournal.SEGMENT_SUFFIX)]
+		self.assertEqual(1, len(file_names))
+		return os.path.join(self.settings.directory, file_names[0])
+
+	def __write_and_tear(self, tear):
+		"""
+		Append three packets, then break the end of the segment file like a crash in the middle of a write
+
+		:param tear: Invoked with the segment content and the size of the last record, returns the broken content
+		"""
+		journal = self.__open()
+		journal.append(create_packet('a'))
+		journal.append(create_packet('b'))
+		size_before = journal.get_size()
+		journal.append(create_packet('c'))
+		path = self.__segment_path()
+		with open(path, 'rb') as file:
+			content = file.read()
+		with open(path, 'wb') as file:
+			file.write(tear(content, journal.get_size() - size_before))
+		return size_before
+
+	def __assert_recovered(self, valid_size: int):
+		journal = self.__open()
+		self.assertEqual(2, len(journal))
+		self.assertEqual(valid_size, os.path.getsize(self.__segment_path()))  # the broken record is truncated
+		journal.append(create_packet('d'))  # appended after the valid records, not after the broken bytes
+		self.assertEqual(['a', 'b', 'd'], self.__replay(self.__open()))
+
+	def test_torn_data(self):
+		valid_size = self.__write_and_tear(lambda content, record_size: content[:-record_size // 2])
+		self.__assert_recovered(valid_size)
+
+	def test_torn_header(self):
+		valid_size = self.__write_and_tear(lambda content, record_size: content[:-record_size + 3])
+		self.__assert_recovered(valid_size)
+
+	def test_corrupted_data(self):
+		valid_size = self.__write_and_tear(lambda content, record_size: content[:-1] + bytes((content[-1] ^ 0xFF,)))
+		self.__assert_recovered(valid_size)
+
+	def test_garbage_after_records(self):
+		valid_size = self.__write_and_tear(lambda content, record_size: content[:-record_size] + b'\xff' * 40)
+		self.__assert_recovered(valid_size)
+
+	def test_only_torn_record(self):
+		self.__write_and_tear(lambda content, record_size: content[:5])
+		journal = self.__open()
+		self.assertEqual(0, len(journal))
+		self.assertEqual([], os.listdir(self.settings.directory))  # the empty segment is removed
+		self.assertEqual([], self.__replay(journal))
+
+
+if __name__ == '__main__':
+	unittest.main()
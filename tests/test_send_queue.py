@@ -0,0 +1,147 @@
+import secrets
+import socket
+import time
+import unittest
+from threading import Event, Thread
+
+from chatbridge.core.client import ChatBridgeClient
+from chatbridge.core.config import ClientInfo
+from chatbridge.core.network.basic import Address
+from chatbridge.core.send_queue import SendQueue, SendQueueSettings, OverflowPolicy
+from chatbridge.core.server import ChatBridgeServer
+
+AES_KEY = 'ThisIstheSecret'
+TIMEOUT = 15
+
+
+def get_free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(('localhost', 0))
+		return sock.getsockname()[1]
+
+
+def is_listening(address: Address) -> bool:
+	"""
+	The server returns from start() once the port is bound, a moment before it's listening
+	"""
+	try:
+		socket.create_connection(address, timeout=1).close()
+		return True
+	except OSError:
+		return False
+
+
+def wait_until(condition, timeout: float = TIMEOUT) -> bool:
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if condition():
+			return True
+		time.sleep(0.05)
+	return condition()
+
+
+def frame(name: str) -> bytes:
+	return name.encode('utf8').ljust(10, b'.')  # 10 bytes
+
+
+class DropOldestChatTest(unittest.TestCase):
+	def test_oldest_chat_dropped_in_order(self):
+		queue = SendQueue(SendQueueSettings(max_size=40, overflow_policy=OverflowPolicy.drop_oldest_chat))
+		queue.put(frame('c1'), True)
+		queue.put(frame('n1'), False)
+		queue.put(frame('c2'), True)
+		queue.put(frame('c3'), True)
+		queue.put(frame('c4'), True)  # c1 makes room
+		queue.put(frame('n2'), False)  # c2 makes room, n1 stays in front of it
+		self.assertEqual([frame(name) for name in ('n1', 'c3', 'c4', 'n2')], queue.poll_all())
+		self.assertEqual(2, queue.get_dropped_count())
+		self.assertEqual(2, queue.get_overflow_count())
+		self.assertEqual(0, queue.get_size())
+
+	def test_only_chats_dropped(self):
+		queue = SendQueue(SendQueueSettings(max_size=20, overflow_policy=OverflowPolicy.drop_oldest_chat))
+		queue.put(frame('n1'), False)
+		queue.put(frame('n2'), False)
+		self.assertTrue(queue.put(frame('c1'), True))  # no chat to make room, so the new chat is dropped
+		queue.put(frame('n3'), False)  # other packets are kept beyond the limit
+		self.assertEqual(30, queue.get_size())
+		self.assertEqual([frame(name) for name in ('n1', 'n2', 'n3')], queue.poll_all())
+		self.assertEqual(1, queue.get_dropped_count())
+
+	def test_several_chats_dropped_for_a_large_frame(self):
+		queue = SendQueue(SendQueueSettings(max_size=40, overflow_policy=OverflowPolicy.drop_oldest_chat))
+		for name in ('c1', 'c2', 'c3', 'c4'):
+			queue.put(frame(name), True)
+		queue.put(b'n' * 25, False)
+		self.assertEqual([frame('c4'), b'n' * 25], queue.poll_all())
+		self.assertEqual(3, queue.get_dropped_count())
+
+
+class _Client(ChatBridgeClient):
+	def get_logging_file_name(self):
+		return None
+
+
+class _StalledClient(_Client):
+	"""
+	Stops reading from the socket on the first chat, until resumed
+	"""
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.stalled = Event()
+		self.resume = Event()
+
+	def on_chat(self, sender: str, payload):
+		self.stalled.set()
+		self.resume.wait()
+
+
+class _Server(ChatBridgeServer):
+	def get_logging_file_name(self):
+		return None
+
+
+class StalledClientTest(unittest.TestCase):
+	def setUp(self):
+		address = Address('localhost', get_free_port())
+		self.server = _Server(AES_KEY, address, send_queue_settings=SendQueueSettings(max_size=64 * 2 ** 10, overflow_policy=OverflowPolicy.block))
+		for name in ('fast', 'slow'):
+			self.server.add_client(ClientInfo(name=name, password='pwd', replay_missed_packets=True))
+		self.fast = _Client(AES_KEY, ClientInfo(name='fast', password='pwd'), server_address=address)
+		self.slow = _StalledClient(AES_KEY, ClientInfo(name='slow', password='pwd'), server_address=address)
+		self.server.start()
+		self.assertTrue(wait_until(lambda: is_listening(address)))
+		self.fast.start()
+		self.slow.start()
+		self.assertTrue(wait_until(lambda: self.fast.is_online() and self.slow.is_online()))
+
+	def tearDown(self):
+		self.slow.resume.set()
+		threads = [Thread(target=node.stop) for node in (self.fast, self.slow, self.server)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+	def test_replay_lock_not_held_while_blocked(self):
+		message = secrets.token_urlsafe(40000)  # not compressible
+
+		def flood():
+			try:
+				for _ in range(500):
+					self.fast.broadcast_chat(message)
+			except OSError:  # the client is stopped while it's still sending
+				pass
+		Thread(target=flood, daemon=True).start()
+		slow_connection = self.server.clients['slow']
+		self.assertTrue(wait_until(lambda: self.slow.stalled.is_set() and slow_connection.send_queue.get_overflow_count() > 0))
+		time.sleep(1)  # for the socket buffers to fill up, so the queue stays full
+
+		# the forwarding thread waits for the slow client now, but the lock used to disconnect it is still free
+		lock = slow_connection.replay_buffer.lock
+		self.assertTrue(lock.acquire(timeout=1))
+		lock.release()
+
+
+if __name__ == '__main__':
+	unittest.main()
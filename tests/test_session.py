@@ -0,0 +1,130 @@
+import socket
+import time
+import unittest
+from threading import Thread
+from typing import List
+
+from chatbridge.core.client import ChatBridgeClient
+from chatbridge.core.config import ClientInfo, ServerEngine
+from chatbridge.core.network.basic import Address
+from chatbridge.core.server import ChatBridgeServer
+from chatbridge.core.session import SessionSettings
+
+AES_KEY = 'ThisIstheSecret'
+TIMEOUT = 15
+
+
+def get_free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(('localhost', 0))
+		return sock.getsockname()[1]
+
+
+def is_listening(address: Address) -> bool:
+	"""
+	The server returns from start() once the port is bound, a moment before it's listening
+	"""
+	try:
+		socket.create_connection(address, timeout=1).close()
+		return True
+	except OSError:
+		return False
+
+
+def wait_until(condition, timeout: float = TIMEOUT) -> bool:
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if condition():
+			return True
+		time.sleep(0.05)
+	return condition()
+
+
+class _Client(ChatBridgeClient):
+	def get_logging_file_name(self):
+		return None
+
+
+class _ReceivingClient(_Client):
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.received: List[int] = []
+
+	def on_chat(self, sender: str, payload):
+		self.received.append(int(payload.message.split()[0]))
+		time.sleep(0.002)  # slow enough to have packets in flight when the connection breaks
+
+	def break_connection(self):
+		"""
+		Lose the connection like in a network blip, without stopping the client
+		"""
+		self._ChatBridgeClient__sock.shutdown(socket.SHUT_RDWR)
+
+
+class _Server(ChatBridgeServer):
+	def get_logging_file_name(self):
+		return None
+
+
+class SessionResumeTest(unittest.TestCase):
+	ENGINE = ServerEngine.thread
+	COUNT = 1000
+
+	def setUp(self):
+		address = Address('localhost', get_free_port())
+		self.server = _Server(AES_KEY, address, engine=self.ENGINE, session_settings=SessionSettings(window_size=4 * 2 ** 20))  # all packets in flight fit in
+		self.server.add_client(ClientInfo(name='receiver', password='pwd', session_resume_timeout=30))
+		self.server.add_client(ClientInfo(name='sender', password='pwd'))
+		self.receiver = _ReceivingClient(AES_KEY, ClientInfo(name='receiver', password='pwd'), server_address=address)
+		self.sender = _Client(AES_KEY, ClientInfo(name='sender', password='pwd'), server_address=address)
+		self.server.start()
+		self.assertTrue(wait_until(lambda: is_listening(address)))
+		self.receiver.start()
+		self.sender.start()
+		self.assertTrue(wait_until(lambda: self.receiver.is_online() and self.sender.is_online()))
+
+	def tearDown(self):
+		threads = [Thread(target=node.stop) for node in (self.receiver, self.sender, self.server)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+	def __send_all(self):
+		for i in range(self.COUNT):
+			self.sender.send_chat('receiver', '{} {}'.format(i, 'x' * 200))
+			if i % 100 == 0:
+				time.sleep(0.01)
+
+	def __break_and_resume(self):
+		thread = Thread(target=self.__send_all)
+		thread.start()
+		self.assertTrue(wait_until(lambda: len(self.receiver.received) > 0))
+		self.receiver.break_connection()  # with packets in flight
+		self.assertTrue(wait_until(lambda: not self.receiver.is_running()))
+		time.sleep(0.3)  # packets sent meanwhile are kept in the session
+		self.receiver.start()
+		thread.join()
+
+	def test_missed_packets_received_once(self):
+		send_thread = self.server.clients['receiver']._ClientConnection__send_thread if self.ENGINE == ServerEngine.thread else None
+		self.__break_and_resume()
+		if send_thread is not None:
+			self.assertIs(send_thread, self.server.clients['receiver']._ClientConnection__send_thread)  # kept for the session, not started again
+		self.assertTrue(wait_until(lambda: len(self.receiver.received) >= self.COUNT))
+		time.sleep(0.5)  # for the duplicates to arrive, if any
+		self.assertEqual(list(range(self.COUNT)), self.receiver.received)
+
+	def test_resume_without_password(self):
+		self.server.clients['receiver'].info.password = 'changed'  # the token proves the identity instead
+		self.__break_and_resume()
+		self.assertTrue(wait_until(lambda: len(self.receiver.received) >= self.COUNT))
+		self.assertTrue(self.receiver.is_online())
+
+
+class SelectorSessionResumeTest(SessionResumeTest):
+	ENGINE = ServerEngine.selector
+
+
+if __name__ == '__main__':
+	unittest.main()